@@ -0,0 +1,260 @@
+#
+# Python bindings for TinySoundFont
+# https://github.com/nwhitehead/tinysoundfont-pybind
+#
+# Copyright (C) 2024 Nathan Whitehead
+#
+# This code is licensed under the MIT license (see LICENSE for details)
+#
+"""Differential render checker for optimized render paths.
+
+Renders the bundled SoundFonts with the bundled MIDI files and with seeded
+random event streams, once with the reference configuration (exact math,
+linear interpolation, no note cache, one block size) and once with each
+optimized configuration. For every pair it reports the maximum sample error,
+the RMS error relative to the signal, and the first sample that differs.
+Configurations marked exact must match the reference bit for bit, the others
+must stay under their error limit.
+
+The CRC32 of the reference render and of every configuration that is not
+exact is also compared with the golden hashes in `benchmarks/golden.json`,
+so changes to the reference engine itself are caught too. Floating point
+results can differ between compilers and CPUs, so regenerate the hashes with
+`--update` on a new platform after checking that the differential results
+are clean. Hashes are stored per rendered length.
+
+Run from the repository root with::
+
+    python benchmarks/differential.py
+    python benchmarks/differential.py --config fast_math --case random_0
+    python benchmarks/differential.py --update
+
+The exit status is 1 if any configuration diverges or any hash differs.
+"""
+
+import argparse
+import json
+import random
+import sys
+import zlib
+
+import numpy as np
+
+import tinysoundfont
+from tinysoundfont.midi import ControlChange, Event, NoteOff, NoteOn, PitchBend, ProgramChange
+
+SOUNDFONTS = {"piano": "test/florestan-piano.sf2", "subset": "test/florestan-subset.sfo"}
+GOLDEN = "benchmarks/golden.json"
+SAMPLERATE = 44100
+BLOCK = 512
+
+CASES = {}
+CONFIGS = {}
+SHARED = {}
+
+
+def config(name, exact=True, limit_db=None, **kwargs):
+    """Register an optimized configuration compared against the reference.
+
+    :param exact: Whether output must be bit-identical to the reference
+    :param limit_db: Largest allowed RMS error relative to signal when not exact
+    :param kwargs: Keyword arguments for `render`
+    """
+    CONFIGS[name] = {"exact": exact, "limit_db": limit_db, "kwargs": kwargs}
+
+
+def shared_soundfont(soundfont):
+    """SoundFont placed in shared memory, created once per run."""
+    if soundfont not in SHARED:
+        synth = tinysoundfont.Synth()
+        SHARED[soundfont] = synth.sfshare(synth.sfload(SOUNDFONTS[soundfont]))
+    return SHARED[soundfont]
+
+
+def setup(synth, soundfont, shared):
+    sfid = synth.sfload(shared_soundfont(soundfont) if shared else SOUNDFONTS[soundfont])
+    for chan in range(16):
+        synth.program_select(chan, sfid, 0, synth.sfpresets(sfid)[0]["preset"], is_drums=chan == 9)
+    return sfid
+
+
+def midi_case(soundfont, filename):
+    def play(synth, seconds, shared):
+        setup(synth, soundfont, shared)
+        seq = tinysoundfont.Sequencer(synth, sample_clock=True)
+        seq.midi_load(filename)
+
+    return play
+
+
+def random_events(seed, seconds, presets):
+    """Seeded random notes, controllers, pitch bends and program changes."""
+    rng = random.Random(seed)
+    events = []
+    held = []
+    t = 0.0
+    while t < seconds:
+        t += rng.expovariate(40)
+        chan = rng.randrange(16)
+        kind = rng.random()
+        if kind < 0.45:
+            key = rng.randrange(21, 109)
+            events.append(Event(NoteOn(key, rng.randrange(1, 128)), t, chan))
+            held.append((chan, key))
+        elif kind < 0.8 and held:
+            chan, key = held.pop(rng.randrange(len(held)))
+            events.append(Event(NoteOff(key), t, chan))
+        elif kind < 0.88:
+            # Volume, pan, expression, sustain, reverb and chorus sends
+            control = rng.choice([7, 10, 11, 64, 91, 93])
+            events.append(Event(ControlChange(control, rng.randrange(128)), t, chan))
+        elif kind < 0.96:
+            events.append(Event(PitchBend(rng.randrange(16384)), t, chan))
+        else:
+            events.append(Event(ProgramChange(rng.choice(presets)), t, chan))
+    return events
+
+
+def random_case(soundfont, seed):
+    def play(synth, seconds, shared):
+        sfid = setup(synth, soundfont, shared)
+        presets = [p["preset"] for p in synth.sfpresets(sfid) if p["bank"] == 0]
+        seq = tinysoundfont.Sequencer(synth, sample_clock=True)
+        seq.add(random_events(seed, seconds, presets))
+
+    return play
+
+
+for _name, _soundfont, _filename in [
+    ("piano_1080", "piano", "test/1080-c01.mid"),
+    ("subset_1080", "subset", "test/1080-c01.mid"),
+    ("subset_drums", "subset", "test/drum.mid"),
+]:
+    CASES[_name] = midi_case(_soundfont, _filename)
+for _seed in range(3):
+    CASES[f"random_{_seed}"] = random_case("subset" if _seed % 2 else "piano", _seed)
+
+
+def render(
+    play, seconds, synth_args=None, block=BLOCK, fork_at=None, layout="interleaved", shared=False, segment=None
+):
+    """Render a case and return interleaved float32 samples."""
+    synth = tinysoundfont.Synth(samplerate=SAMPLERATE, gain=-6, layout=layout, **(synth_args or {}))
+    play(synth, seconds, shared)
+    total = int(seconds * SAMPLERATE)
+    if segment is not None:
+        return np.frombuffer(synth.generate_parallel(total, segment=segment), dtype=np.float32)
+    chunks = []
+    pos = 0
+    while pos < total:
+        if fork_at is not None and pos >= fork_at:
+            # Continue from an independent copy in the same state
+            synth = synth.fork()
+            fork_at = None
+        count = min(block, total - pos)
+        chunk = np.frombuffer(synth.generate(count), dtype=np.float32)
+        if layout == "planar":
+            chunk = chunk.reshape(2, -1).T.ravel()
+        chunks.append(chunk)
+        pos += count
+    return np.concatenate(chunks)
+
+
+# Modulation and envelopes update every 64 samples counted from the start of
+# each render call, so splitting output into other block sizes is not exact
+config("blocks", exact=False, limit_db=-30, block=97)
+config("planar", layout="planar")
+config("fork", fork_at=SAMPLERATE)
+config("realtime", synth_args={"realtime": True})
+config("midi_channels", synth_args={"midi_channels": 48})
+config("shared", shared=True)
+config("note_cache", synth_args={"note_cache": 16 << 20})
+config("fast_math", exact=False, limit_db=-60, synth_args={"fast_math": True})
+# Renders segments in single calls instead of blocks, and notes in different
+# segments do not interact, for example through retriggered keys
+config("parallel", exact=False, limit_db=-30, segment=2.0)
+
+
+def compare(reference, output):
+    """Max error, RMS error relative to signal in dB, and first differing frame."""
+    diff = output.astype(np.float64) - reference
+    differs = np.flatnonzero(diff)
+    if len(differs) == 0:
+        return 0.0, float("-inf"), None
+    signal = np.sqrt(np.mean(reference.astype(np.float64) ** 2)) or 1.0
+    rms = np.sqrt(np.mean(diff**2))
+    return float(np.abs(diff).max()), float(20 * np.log10(rms / signal)), int(differs[0] // 2)
+
+
+def crc(samples):
+    return f"{zlib.crc32(samples.tobytes()):08x}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--case", action="append", choices=list(CASES), help="cases to render (default all)")
+    parser.add_argument("--config", action="append", choices=list(CONFIGS), help="configurations to check (default all)")
+    parser.add_argument("--seconds", type=float, default=10.0, help="seconds rendered per case (default 10)")
+    parser.add_argument("--update", action="store_true", help=f"write golden hashes to {GOLDEN}")
+    args = parser.parse_args()
+
+    key = f"{args.seconds:g}s"
+    try:
+        with open(GOLDEN) as f:
+            golden = json.load(f)
+    except FileNotFoundError:
+        golden = {}
+    hashes = golden.setdefault(key, {})
+    failures = []
+
+    print(f"{'case':<14} {'config':<14} {'max error':>10} {'rms (dB)':>9} {'first diff':>11} {'hash':>9}")
+    for case_name in args.case or CASES:
+        play = CASES[case_name]
+        reference = render(play, args.seconds, synth_args={"fast_math": False})
+        renders = [("reference", reference, None)]
+        for config_name in args.config or CONFIGS:
+            spec = CONFIGS[config_name]
+            kwargs = dict(spec["kwargs"])
+            synth_args = {"fast_math": False, **kwargs.pop("synth_args", {})}
+            renders.append((config_name, render(play, args.seconds, synth_args=synth_args, **kwargs), spec))
+
+        for config_name, output, spec in renders:
+            # Exact configurations are covered by the reference hash
+            status = "-"
+            if spec is None or not spec["exact"]:
+                digest = crc(output)
+                expected = hashes.setdefault(case_name, {}).get(config_name)
+                if expected == digest:
+                    status = "ok"
+                elif args.update:
+                    hashes[case_name][config_name] = digest
+                    status = "updated"
+                elif expected is None:
+                    status = "new"
+                else:
+                    status = "MISMATCH"
+                    failures.append(f"{case_name}/{config_name} hash")
+            if spec is None:
+                print(f"{case_name:<14} {config_name:<14} {'-':>10} {'-':>9} {'-':>11} {status:>9}")
+                continue
+            max_error, rms_db, first = compare(reference, output)
+            diverged = first is not None if spec["exact"] else rms_db > spec["limit_db"]
+            if diverged:
+                failures.append(f"{case_name}/{config_name}")
+            where = "-" if first is None else str(first)
+            flag = "  DIVERGED" if diverged else ""
+            print(f"{case_name:<14} {config_name:<14} {max_error:>10.3g} {rms_db:>9.1f} {where:>11} {status:>9}{flag}")
+
+    if args.update:
+        with open(GOLDEN, "w") as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+            f.write("\n")
+    for shared in SHARED.values():
+        shared.unlink()
+    if failures:
+        print(f"{len(failures)} failure(s): {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
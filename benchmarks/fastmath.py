@@ -0,0 +1,93 @@
+#
+# Python bindings for TinySoundFont
+# https://github.com/nwhitehead/tinysoundfont-pybind
+#
+# Copyright (C) 2024 Nathan Whitehead
+#
+# This code is licensed under the MIT license (see LICENSE for details)
+#
+"""Compare accuracy and CPU cost of the fast math voice render path.
+
+First reports the worst case relative error of the table based conversions
+(timecents to pitch ratio, decibels to gain, cents to filter cutoff) over
+their useful input ranges, computed with the same table as the native code.
+Then renders dense chords with every interpolation mode with exact and fast
+math and reports render time and the error of fast math output relative to
+the exact output.
+
+Run from the repository root with::
+
+    python benchmarks/fastmath.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import tinysoundfont
+
+SOUNDFONT = "test/florestan-piano.sf2"
+TABLE_SIZE = 1024
+
+
+def fast_exp2(x):
+    # Mirrors tsf_fast_exp2, with the table stored as float32
+    table = (2.0 ** (np.arange(TABLE_SIZE + 1) / TABLE_SIZE)).astype(np.float32)
+    x = np.clip(np.asarray(x, dtype=np.float32), -126, 127)
+    octave = np.floor(x)
+    pos = ((x - octave) * TABLE_SIZE).astype(np.float32)
+    index = pos.astype(np.int32)
+    mantissa = table[index] + (table[index + 1] - table[index]) * (pos - index)
+    return np.ldexp(mantissa, octave.astype(np.int32))
+
+
+def conversion_errors():
+    cases = [
+        ("timecents", np.linspace(-12000, 12000, 200001), lambda tc: 2.0 ** (tc / 1200), lambda tc: fast_exp2(tc / 1200)),
+        ("decibels", np.linspace(-99, 24, 200001), lambda db: 10.0 ** (db / 20), lambda db: fast_exp2(db * 0.166096404744)),
+        ("cents", np.linspace(1500, 13500, 200001), lambda c: 8.176 * 2.0 ** (c / 1200), lambda c: 8.176 * fast_exp2(c / 1200)),
+    ]
+    print(f"{'conversion':>10} {'max rel error':>14}")
+    for name, values, exact, fast in cases:
+        error = np.max(np.abs(fast(values) / exact(values) - 1))
+        print(f"{name:>10} {error:>14.2e}")
+
+
+def render(seconds, samplerate, **kwargs):
+    synth = tinysoundfont.Synth(gain=-20, samplerate=samplerate, **kwargs)
+    sfid = synth.sfload(SOUNDFONT, max_voices=512)
+    for chan in range(16):
+        synth.program_select(chan, sfid, 0, 0)
+        # Detune channels so voices have fractional pitch ratios
+        synth.pitchbend(chan, 8192 + 300 * (chan - 8))
+        for key in range(36 + chan, 96, 12):
+            synth.noteon(chan, key, 100)
+    samples = int(seconds * samplerate)
+    start = time.process_time()
+    buffer = synth.generate(samples)
+    elapsed = time.process_time() - start
+    return np.frombuffer(buffer, dtype=np.float32), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--samplerate", type=int, default=44100)
+    args = parser.parse_args()
+
+    conversion_errors()
+    print()
+    print(f"{'interpolation':>13} {'exact (s)':>10} {'fast (s)':>10} {'speedup':>8} {'error (dB)':>10}")
+    for interpolation in ("none", "linear", "cubic", "sinc"):
+        exact, exact_time = render(args.seconds, args.samplerate, interpolation=interpolation, fast_math=False)
+        fast, fast_time = render(args.seconds, args.samplerate, interpolation=interpolation, fast_math=True)
+        error = np.sqrt(np.mean((fast - exact) ** 2))
+        signal = np.sqrt(np.mean(exact**2))
+        error_db = 20 * np.log10(error / signal) if error > 0 else float("-inf")
+        speedup = exact_time / fast_time if fast_time > 0 else float("inf")
+        print(f"{interpolation:>13} {exact_time:>10.3f} {fast_time:>10.3f} {speedup:>8.2f} {error_db:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#
+# Python bindings for TinySoundFont
+# https://github.com/nwhitehead/tinysoundfont-pybind
+#
+# Copyright (C) 2024 Nathan Whitehead
+#
+# This code is licensed under the MIT license (see LICENSE for details)
+#
+"""Compare CPU cost and aliasing of interpolation and oversampling modes.
+
+Renders high notes (large pitch ratios alias the most) with each mode and
+reports render time along with the error against a reference rendered with
+sinc interpolation at 4x oversampling. Lower error means less aliasing.
+
+Run from the repository root with::
+
+    python benchmarks/interpolation.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import tinysoundfont
+
+SOUNDFONT = "test/florestan-piano.sf2"
+KEYS = [84, 91, 96, 103, 108]
+
+
+def render(seconds, samplerate, **kwargs):
+    synth = tinysoundfont.Synth(gain=-14, samplerate=samplerate, **kwargs)
+    sfid = synth.sfload(SOUNDFONT)
+    synth.program_select(0, sfid, 0, 0)
+    for key in KEYS:
+        synth.noteon(0, key, 100)
+    samples = int(seconds * samplerate)
+    start = time.process_time()
+    buffer = synth.generate(samples)
+    elapsed = time.process_time() - start
+    return np.frombuffer(buffer, dtype=np.float32).reshape(-1, 2), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--samplerate", type=int, default=48000)
+    args = parser.parse_args()
+
+    reference, _ = render(
+        args.seconds,
+        args.samplerate,
+        interpolation="sinc",
+        internal_samplerate=args.samplerate * 4,
+    )
+    modes = [
+        ("none", None),
+        ("linear", None),
+        ("cubic", None),
+        ("sinc", None),
+        ("linear", args.samplerate * 2),
+        ("cubic", args.samplerate * 2),
+    ]
+    print(f"{'interpolation':>13} {'internal rate':>13} {'cpu (s)':>8} {'x realtime':>10} {'error (dB)':>10}")
+    for interpolation, internal_samplerate in modes:
+        output, elapsed = render(
+            args.seconds,
+            args.samplerate,
+            interpolation=interpolation,
+            internal_samplerate=internal_samplerate,
+        )
+        error = np.sqrt(np.mean((output - reference) ** 2))
+        signal = np.sqrt(np.mean(reference**2))
+        error_db = 20 * np.log10(error / signal)
+        rate = internal_samplerate or args.samplerate
+        speed = args.seconds / elapsed if elapsed > 0 else float("inf")
+        print(f"{interpolation:>13} {rate:>13} {elapsed:>8.3f} {speed:>10.1f} {error_db:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
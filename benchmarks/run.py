@@ -0,0 +1,348 @@
+#
+# Python bindings for TinySoundFont
+# https://github.com/nwhitehead/tinysoundfont-pybind
+#
+# Copyright (C) 2024 Nathan Whitehead
+#
+# This code is licensed under the MIT license (see LICENSE for details)
+#
+"""Headless performance benchmarks for tinysoundfont.
+
+No audio device is needed, all audio is generated into memory. Run from the
+repository root so the bundled test data can be found::
+
+    python benchmarks/run.py                          # print results
+    python benchmarks/run.py --output results.json    # save results
+    python benchmarks/run.py --compare benchmarks/baseline.json
+
+When comparing, any metric that is worse than the baseline by more than the
+threshold is reported as a regression and the exit status is 1.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import struct
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+import tinysoundfont
+
+SF2 = "test/florestan-piano.sf2"
+SFO = "test/florestan-subset.sfo"
+MIDI_FILES = ["test/1080-c01.mid", "test/drum.mid"]
+SAMPLERATE = 44100
+BLOCK = 512
+
+# Metrics where bigger values are better, all others are costs
+HIGHER_IS_BETTER = {"voices_per_core", "events_per_second", "bytes_per_second", "hit_rate"}
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark function returning a dictionary of metrics."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def median_time(func, repeat, number=1):
+    """Median over `repeat` runs of the time per call of `func` called `number` times."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return statistics.median(times)
+
+
+def synthetic_midi(notes=20000, channels=16):
+    """Build a type 0 Standard MIDI File with dense notes on all channels."""
+    track = bytearray()
+    # Tempo of 500000 microseconds per beat
+    track += b"\x00\xff\x51\x03\x07\xa1\x20"
+    for chan in range(channels):
+        track += bytes([0, 0xC0 | chan, chan])
+    for i in range(notes):
+        chan = i % channels
+        key = 36 + (i * 7) % 60
+        track += bytes([0, 0x90 | chan, key, 100])
+        track += bytes([5, 0x80 | chan, key, 0])
+    track += b"\x00\xff\x2f\x00"
+    header = b"MThd" + struct.pack(">IHHH", 6, 0, 1, 96)
+    return header + b"MTrk" + struct.pack(">I", len(track)) + bytes(track)
+
+
+def drum_midi(bars=16):
+    """Build a type 0 Standard MIDI File with a 16th note drum pattern."""
+    track = bytearray()
+    track += b"\x00\xff\x51\x03\x07\xa1\x20"
+    pattern = [(36, 42), (42,), (38, 42), (42, 46)]
+    delta = 0
+    for step in range(bars * 16):
+        keys = pattern[step % len(pattern)]
+        for i, key in enumerate(keys):
+            track += bytes([delta if i == 0 else 0, 0x99, key, 90 + (step * 7) % 30])
+            delta = 0
+        for i, key in enumerate(keys):
+            track += bytes([12 if i == 0 else 0, 0x89, key, 0])
+        delta = 12
+    track += b"\x00\xff\x2f\x00"
+    header = b"MThd" + struct.pack(">IHHH", 6, 0, 1, 96)
+    return header + b"MTrk" + struct.pack(">I", len(track)) + bytes(track)
+
+
+def one_shot_soundfont():
+    """Test piano with loops and pitch/filter modulation removed, like a drum kit."""
+    with open(SF2, "rb") as f:
+        data = bytearray(f.read())
+    for chunk in (b"pgen", b"igen"):
+        pos = data.find(chunk)
+        size = struct.unpack_from("<I", data, pos + 4)[0]
+        for offset in range(pos + 8, pos + 8 + size, 4):
+            oper = struct.unpack_from("<H", data, offset)[0]
+            # modLfoToPitch, vibLfoToPitch, modEnvToPitch, modLfoToFilterFc, modEnvToFilterFc, sampleModes
+            if oper in (5, 6, 7, 10, 11, 54):
+                struct.pack_into("<H", data, offset + 2, 0)
+    return bytes(data)
+
+
+@benchmark
+def load_sf2(repeat):
+    with open(SF2, "rb") as f:
+        data = f.read()
+    return {
+        "file_seconds": median_time(lambda: tinysoundfont.Synth().sfload(SF2), repeat, 50),
+        "bytes_seconds": median_time(lambda: tinysoundfont.Synth().sfload(data), repeat, 50),
+    }
+
+
+@benchmark
+def load_sfo(repeat):
+    # Samples are Ogg Vorbis compressed, so this includes decoding time
+    return {
+        "file_seconds": median_time(lambda: tinysoundfont.Synth().sfload(SFO), repeat, 5),
+    }
+
+
+@benchmark
+def note_on_latency(repeat):
+    synth = tinysoundfont.Synth()
+    sfid = synth.sfload(SF2)
+    synth.program_select(0, sfid, 0, 0)
+    keys = range(21, 109)
+
+    def notes():
+        for key in keys:
+            synth.noteon(0, key, 100)
+        synth.sounds_off()
+
+    return {"seconds": median_time(notes, repeat, 20) / len(keys)}
+
+
+def voices_per_core(blocks):
+    # Keep retriggering chords on all channels so many voices are always active
+    synth = tinysoundfont.Synth(gain=-30)
+    sfid = synth.sfload(SF2, max_voices=512)
+    for chan in range(16):
+        synth.program_select(chan, sfid, 0, 0)
+    voice_seconds = 0.0
+    cpu_seconds = 0.0
+    for i in range(blocks):
+        if i % 20 == 0:
+            for chan in range(16):
+                for key in range(36 + chan, 96, 12):
+                    synth.noteon(chan, key, 100)
+        voices = synth.stats()["active_voices"]
+        start = time.process_time()
+        synth.generate(BLOCK)
+        cpu_seconds += time.process_time() - start
+        voice_seconds += voices * BLOCK / SAMPLERATE
+    # Number of voices one core could render in real time
+    return voice_seconds / cpu_seconds if cpu_seconds else 0.0
+
+
+@benchmark
+def realtime_voices(repeat):
+    return {
+        "voices_per_core": statistics.median(voices_per_core(200) for _ in range(repeat)),
+    }
+
+
+def sequencer_overhead(filename, blocks):
+    # Time spent per block outside of native rendering, for sequencing events
+    synth = tinysoundfont.Synth()
+    sfid = synth.sfload(SF2)
+    for chan in range(16):
+        synth.program_select(chan, sfid, 0, 0)
+    seq = tinysoundfont.Sequencer(synth)
+    seq.midi_load(filename)
+    start = time.perf_counter()
+    for _ in range(blocks):
+        synth.generate(BLOCK)
+    elapsed = time.perf_counter() - start
+    return (elapsed - synth.stats()["render"]["seconds"]) / blocks
+
+
+@benchmark
+def sequencer_block_overhead(repeat):
+    results = {}
+    for filename in MIDI_FILES:
+        name = filename.split("/")[-1].split(".")[0].replace("-", "_")
+        results[f"{name}_seconds"] = statistics.median(
+            sequencer_overhead(filename, 400) for _ in range(repeat)
+        )
+    return results
+
+
+def drum_render(soundfont, events, note_cache):
+    synth = tinysoundfont.Synth(note_cache=note_cache)
+    sfid = synth.sfload(soundfont)
+    synth.program_select(9, sfid, 0, 0)
+    seq = tinysoundfont.Sequencer(synth)
+    seq.add(events)
+    while not seq.is_empty():
+        synth.generate(BLOCK)
+    # Only native render time, sequencing costs the same with or without cache
+    stats = synth.stats()
+    return stats["render"]["seconds"], stats["note_cache"]
+
+
+@benchmark
+def note_cache(repeat):
+    soundfont = one_shot_soundfont()
+    events = tinysoundfont.midi.load_memory(drum_midi())
+    uncached = statistics.median(drum_render(soundfont, events, 0)[0] for _ in range(repeat))
+    runs = [drum_render(soundfont, events, 16 << 20) for _ in range(repeat)]
+    cached = statistics.median(seconds for seconds, _ in runs)
+    return {
+        "uncached_seconds": uncached,
+        "cached_seconds": cached,
+        "hit_rate": runs[0][1]["hit_rate"],
+    }
+
+
+@benchmark
+def midi_load(repeat):
+    results = {}
+    total_bytes = 0
+    total_events = 0
+    total_seconds = 0.0
+    for filename in MIDI_FILES:
+        with open(filename, "rb") as f:
+            data = f.read()
+        events = len(tinysoundfont.midi.load_memory(data))
+        seconds = median_time(lambda: tinysoundfont.midi.load_memory(data), repeat)
+        total_bytes += len(data)
+        total_events += events
+        total_seconds += seconds
+    results["events_per_second"] = total_events / total_seconds
+    results["bytes_per_second"] = total_bytes / total_seconds
+    # Synthetic stress case with many events
+    data = synthetic_midi()
+    results["synthetic_seconds"] = median_time(
+        lambda: tinysoundfont.midi.load_memory(data), repeat
+    )
+    return results
+
+
+@benchmark
+def peak_memory(repeat):
+    data = synthetic_midi()
+    tracemalloc.start()
+    synth = tinysoundfont.Synth()
+    synth.sfload(SF2)
+    seq = tinysoundfont.Sequencer(synth)
+    seq.add(tinysoundfont.midi.load_memory(data))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results = {"python_bytes": peak}
+    if resource is not None:
+        # Linux reports kilobytes, macOS reports bytes
+        scale = 1 if sys.platform == "darwin" else 1024
+        results["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return results
+
+
+def run(names, repeat):
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name](repeat)
+        print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print comparison table and return list of regressed metrics."""
+    regressions = []
+    print(f"{'metric':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            old = baseline["results"].get(name, {}).get(metric)
+            key = f"{name}.{metric}"
+            if not old:
+                print(f"{key:<48} {'-':>12} {value:>12.4g} {'new':>8}")
+                continue
+            change = (value - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(key)
+            print(f"{key:<48} {old:>12.4g} {value:>12.4g} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run (default all)")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per measurement (default 5)")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="relative change counted as regression (default 0.25)",
+    )
+    args = parser.parse_args()
+
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}, choose from {', '.join(BENCHMARKS)}")
+    current = run(names, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    elif not args.output:
+        print(json.dumps(current, indent=2))
+
+
+if __name__ == "__main__":
+    main()
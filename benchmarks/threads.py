@@ -0,0 +1,161 @@
+#
+# Python bindings for TinySoundFont
+# https://github.com/nwhitehead/tinysoundfont-pybind
+#
+# Copyright (C) 2024 Nathan Whitehead
+#
+# This code is licensed under the MIT license (see LICENSE for details)
+#
+"""Multithreaded stress benchmark for independent and shared synthesizers.
+
+First renders with 1, 2, 4, ... threads that each own a separate Synth and
+reports total throughput and scaling relative to one thread. Rendering
+releases the GIL, so threads run in parallel on regular builds of Python and
+also on free-threaded builds (3.13t and later) where the module does not need
+the GIL at all.
+
+Then stresses a single shared Synth, with one thread rendering while other
+threads send notes, program changes and controllers, and checks that every
+thread finished without errors.
+
+Finally renders one song with Synth.generate and with Synth.generate_parallel
+and reports the speedup of splitting it into segments.
+
+Run from the repository root with::
+
+    python benchmarks/threads.py
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import tinysoundfont
+
+SOUNDFONT = "test/florestan-piano.sf2"
+SONG = "test/1080-c01.mid"
+BLOCK = 512
+
+
+def make_synth():
+    synth = tinysoundfont.Synth(gain=-30)
+    sfid = synth.sfload(SOUNDFONT, max_voices=256)
+    for chan in range(16):
+        synth.program_select(chan, sfid, 0, 0)
+    return synth
+
+
+def render_loop(synth, blocks):
+    # Keep retriggering chords so many voices are always active
+    for i in range(blocks):
+        if i % 20 == 0:
+            for chan in range(16):
+                for key in range(36 + chan, 96, 12):
+                    synth.noteon(chan, key, 100)
+        synth.generate(BLOCK)
+
+
+def independent(threads, blocks):
+    synths = [make_synth() for _ in range(threads)]
+    workers = [threading.Thread(target=render_loop, args=(synth, blocks)) for synth in synths]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return threads * blocks * BLOCK / elapsed
+
+
+def shared(threads, seconds):
+    synth = make_synth()
+    stop = threading.Event()
+    errors = []
+    counts = [0] * threads
+
+    def render():
+        try:
+            while not stop.is_set():
+                synth.generate(BLOCK)
+                counts[0] += 1
+        except Exception as err:
+            errors.append(err)
+
+    def events(index):
+        try:
+            n = 0
+            while not stop.is_set():
+                chan = (index * 5 + n) % 16
+                key = 36 + n % 60
+                synth.noteon(chan, key, 100)
+                synth.control_change(chan, 10, n % 128)
+                if n % 50 == 0:
+                    synth.program_change(chan, 0)
+                synth.noteoff(chan, key)
+                n += 1
+            counts[index] = n
+        except Exception as err:
+            errors.append(err)
+
+    workers = [threading.Thread(target=render)]
+    workers += [threading.Thread(target=events, args=(i,)) for i in range(1, threads)]
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return counts, errors
+
+
+def song(seconds, workers):
+    synth = make_synth()
+    seq = tinysoundfont.Sequencer(synth, sample_clock=True)
+    seq.midi_load(SONG)
+    samples = int(seconds * synth.samplerate)
+    start = time.perf_counter()
+    synth.fork().generate(samples)
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    synth.generate_parallel(samples, workers=workers, segment=seconds / (workers * 2))
+    parallel = time.perf_counter() - start
+    return serial, parallel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--blocks", type=int, default=400, help="blocks rendered by each thread (default 400)")
+    parser.add_argument("--max-threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seconds", type=float, default=2.0, help="duration of shared stress test (default 2)")
+    parser.add_argument("--song-seconds", type=float, default=60.0, help="length of song render (default 60)")
+    args = parser.parse_args()
+
+    gil = sys._is_gil_enabled() if hasattr(sys, "_is_gil_enabled") else True
+    print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}, {os.cpu_count()} cores")
+    print()
+    print(f"{'threads':>7} {'frames/s':>12} {'speedup':>8} {'efficiency':>10}")
+    threads = 1
+    base = None
+    while threads <= args.max_threads:
+        throughput = independent(threads, args.blocks)
+        base = base or throughput
+        speedup = throughput / base
+        print(f"{threads:>7} {throughput:>12.0f} {speedup:>8.2f} {speedup / threads:>10.0%}")
+        threads *= 2
+
+    print()
+    threads = max(2, min(args.max_threads, 8))
+    counts, errors = shared(threads, args.seconds)
+    print(f"shared synth: {counts[0]} blocks rendered while {threads - 1} threads sent {sum(counts[1:])} note events")
+    if errors:
+        print(f"{len(errors)} thread(s) failed: {errors[0]!r}")
+        sys.exit(1)
+
+    serial, parallel = song(args.song_seconds, args.max_threads)
+    print(f"song: {serial:.2f}s with generate, {parallel:.2f}s with generate_parallel on {args.max_threads} threads ({serial / parallel:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
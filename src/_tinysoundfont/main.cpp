@@ -12,14 +12,61 @@
 namespace py = pybind11;
 using namespace pybind11::literals;
 
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <cmath>
+#include <cstdlib>
+#include <cstring>
+#include <deque>
+#include <exception>
 #include <fstream>
+#include <iterator>
+#include <limits>
+#include <memory>
+#include <mutex>
 #include <stdexcept>
 #include <string>
+#include <thread>
+#include <unordered_map>
 #include <vector>
 
+#if defined(_WIN32)
+#include <windows.h>
+#else
+#include <sys/mman.h>
+#include <unistd.h>
+#endif
+
 // Include support for OGG Vorbis file format (detected automatically by TinySoundFont header)
 #include "stb/stb_vorbis.c"
 
+namespace {
+
+// Depth of render scopes entered by the current thread, and number of
+// TinySoundFont allocations made by this thread while inside a render scope
+thread_local int render_scope_depth = 0;
+thread_local unsigned long long render_allocations = 0;
+
+void* tsf_counted_malloc(size_t size) {
+    if (render_scope_depth) {
+        render_allocations++;
+    }
+    return std::malloc(size);
+}
+
+void* tsf_counted_realloc(void* ptr, size_t size) {
+    if (render_scope_depth) {
+        render_allocations++;
+    }
+    return std::realloc(ptr, size);
+}
+
+} // end anonymous namespace
+
+#define TSF_MALLOC tsf_counted_malloc
+#define TSF_REALLOC tsf_counted_realloc
+#define TSF_FREE std::free
 #define TSF_IMPLEMENTATION
 #include "tsf/tsf.h"
 
@@ -32,30 +79,353 @@ inline const char* string_none_if_nullptr(const char* s) {
     return s ? s : "<None>";
 }
 
+size_t page_size() {
+#if defined(_WIN32)
+    SYSTEM_INFO info;
+    GetSystemInfo(&info);
+    return info.dwPageSize;
+#else
+    return static_cast<size_t>(sysconf(_SC_PAGESIZE));
+#endif
+}
+
+bool lock_memory(void* start, size_t size) {
+#if defined(_WIN32)
+    return VirtualLock(start, size) != 0;
+#else
+    return mlock(start, size) == 0;
+#endif
+}
+
+void unlock_memory(void* start, size_t size) {
+#if defined(_WIN32)
+    VirtualUnlock(start, size);
+#else
+    munlock(start, size);
+#endif
+}
+
 } // end anonymous namespace
 
+// Number of render time histogram buckets, bucket 0 counts blocks under 1 microsecond,
+// bucket i counts blocks from 2^(i-1) up to 2^i microseconds, last bucket counts everything longer
+constexpr int RENDER_HISTOGRAM_BUCKETS = 24;
+
+// Cumulative render timing, cheap enough to always collect
+class RenderStats {
+public:
+    unsigned long long blocks = 0;
+    unsigned long long frames = 0;
+    double seconds = 0.0;
+    double max_seconds = 0.0;
+    unsigned long long histogram[RENDER_HISTOGRAM_BUCKETS] = {};
+
+    void add(double elapsed, int count) {
+        blocks++;
+        frames += count;
+        seconds += elapsed;
+        max_seconds = std::max(max_seconds, elapsed);
+        double microseconds = elapsed * 1e6;
+        int bucket = microseconds < 1.0 ? 0 : std::min(std::ilogb(microseconds) + 1, RENDER_HISTOGRAM_BUCKETS - 1);
+        histogram[bucket]++;
+    }
+
+    void reset() { *this = RenderStats(); }
+
+    py::dict to_dict() const {
+        py::dict d;
+        d["blocks"] = blocks;
+        d["frames"] = frames;
+        d["seconds"] = seconds;
+        d["max_seconds"] = max_seconds;
+        py::list buckets;
+        for (unsigned long long count : histogram) {
+            buckets.append(count);
+        }
+        d["histogram"] = buckets;
+        return d;
+    }
+};
+
+// Clock for the note cache to time rendering of stored samples
+static double steady_seconds() {
+    return std::chrono::duration<double>(std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+// Adds time spent until end of scope to RenderStats
+class RenderTimer {
+public:
+    int frames = 0;
+
+    RenderTimer(RenderStats& stats) : stats(stats), start(std::chrono::steady_clock::now()) {}
+
+    ~RenderTimer() {
+        std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+        stats.add(elapsed.count(), frames);
+    }
+
+private:
+    RenderStats& stats;
+    std::chrono::steady_clock::time_point start;
+};
+
+using Lock = std::lock_guard<std::mutex>;
+
+// Wait for a lock with the GIL released, so a thread rendering while holding the lock does not
+// stall every Python thread. Taken without releasing the GIL when the lock is free.
+std::unique_lock<std::mutex> lock_without_gil(std::mutex& mutex) {
+    std::unique_lock<std::mutex> lock(mutex, std::try_to_lock);
+    if (!lock.owns_lock()) {
+        py::gil_scoped_release release;
+        lock.lock();
+    }
+    return lock;
+}
+
+// Same for two locks, taken together without deadlock
+std::pair<std::unique_lock<std::mutex>, std::unique_lock<std::mutex>> lock_without_gil(std::mutex& a, std::mutex& b) {
+    std::unique_lock<std::mutex> first(a, std::defer_lock);
+    std::unique_lock<std::mutex> second(b, std::defer_lock);
+    if (std::try_lock(first, second) != -1) {
+        py::gil_scoped_release release;
+        std::lock(first, second);
+    }
+    return {std::move(first), std::move(second)};
+}
+
+// Guards reference counts of sample data shared between clones of a SoundFont
+std::mutex& shared_data_mutex() {
+    static std::mutex mutex;
+    return mutex;
+}
+
+// Stream for tsf_load reading a Python binary file object. The many small reads of SoundFont
+// headers are served from a buffer filled in large chunks, while large reads such as sample
+// data go straight into their destination with readinto, so loading does not hold a second
+// copy of the file in memory. Errors raised by the file are kept and raised again after loading.
+// Loading runs without the GIL, which is only taken while calling methods of the file.
+class FileStream {
+public:
+    static constexpr size_t CHUNK = 1 << 20;
+    py::object file;
+    py::object readinto;
+    bool seekable = false;
+    std::vector<char> buffer;
+    size_t pos = 0;
+    size_t end = 0;
+    long long total = 0;
+    std::exception_ptr error;
+
+    explicit FileStream(py::object file) : file(file) {
+        if (py::hasattr(file, "readinto")) {
+            readinto = file.attr("readinto");
+        }
+        if (py::hasattr(file, "seekable")) {
+            seekable = file.attr("seekable")().cast<bool>();
+        }
+    }
+
+    // Read up to size bytes directly from the file, returns number of bytes read (0 at end)
+    size_t read_file(char* ptr, size_t size) {
+        py::gil_scoped_acquire gil;
+        size_t done = 0;
+        while (done < size) {
+            size_t count = 0;
+            if (readinto) {
+                py::object result = readinto(py::memoryview::from_memory(ptr + done, static_cast<py::ssize_t>(size - done)));
+                count = result.is_none() ? 0 : result.cast<size_t>();
+            } else {
+                std::string data = file.attr("read")(size - done).cast<std::string>();
+                count = std::min(data.size(), size - done);
+                std::memcpy(ptr + done, data.data(), count);
+            }
+            if (count == 0) {
+                break;
+            }
+            done += count;
+        }
+        return done;
+    }
+
+    size_t fill() {
+        buffer.resize(CHUNK);
+        pos = 0;
+        end = read_file(buffer.data(), CHUNK);
+        return end;
+    }
+
+    int read(char* ptr, unsigned int size) {
+        size_t done = std::min<size_t>(size, end - pos);
+        std::memcpy(ptr, buffer.data() + pos, done);
+        pos += done;
+        if (size - done >= CHUNK) {
+            done += read_file(ptr + done, size - done);
+        }
+        while (done < size && fill() > 0) {
+            size_t count = std::min<size_t>(size - done, end - pos);
+            std::memcpy(ptr + done, buffer.data() + pos, count);
+            pos += count;
+            done += count;
+        }
+        total += done;
+        return static_cast<int>(done);
+    }
+
+    int skip(unsigned int count) {
+        size_t done = std::min<size_t>(count, end - pos);
+        pos += done;
+        total += done;
+        if (done == count) {
+            return 1;
+        }
+        if (seekable) {
+            py::gil_scoped_acquire gil;
+            file.attr("seek")(count - done, 1);
+            total += count - done;
+            return 1;
+        }
+        while (done < count && fill() > 0) {
+            size_t step = std::min<size_t>(count - done, end - pos);
+            pos += step;
+            done += step;
+            total += step;
+        }
+        return done == count ? 1 : 0;
+    }
+
+    static int read_callback(void* data, void* ptr, unsigned int size) {
+        FileStream* stream = static_cast<FileStream*>(data);
+        if (stream->error) {
+            return 0;
+        }
+        try {
+            return stream->read(static_cast<char*>(ptr), size);
+        } catch (...) {
+            stream->error = std::current_exception();
+            return 0;
+        }
+    }
+
+    static int skip_callback(void* data, unsigned int count) {
+        FileStream* stream = static_cast<FileStream*>(data);
+        if (stream->error) {
+            return 0;
+        }
+        try {
+            return stream->skip(count);
+        } catch (...) {
+            stream->error = std::current_exception();
+            return 0;
+        }
+    }
+};
+
+// All methods that use playback state lock the object, so a SoundFont can be used from several threads
 class SoundFont {
 public:
     tsf* obj = nullptr;
+    mutable std::mutex mutex;
+    // Time spent and number of bytes read while loading and decoding
+    double load_seconds = 0.0;
+    long long load_bytes = 0;
+    RenderStats render_stats;
+    // Page aligned sample memory locked by warm, unlocked when closed
+    std::vector<std::pair<char*, size_t>> locked;
+    // Exported block that regions and samples point into, shared with clones
+    struct External {
+        py::object owner;
+        py::buffer_info info;
+    };
+    std::shared_ptr<External> external;
+
+    SoundFont() {}
 
-    SoundFont(py::bytes bytes)
+    // Use data written by export_to in place, owner is kept alive along with the buffer
+    static SoundFont* attach(py::buffer buffer, py::object owner) {
+        auto data = std::make_shared<External>();
+        data->owner = owner;
+        data->info = buffer.request();
+        tsf* obj = tsf_load_exported(data->info.ptr, static_cast<size_t>(data->info.size * data->info.itemsize));
+        if (!obj) {
+            throw std::runtime_error("Could not attach SoundFont, data must be exported by the same version and aligned to 8 bytes");
+        }
+        SoundFont* result = new SoundFont();
+        result->obj = obj;
+        result->external = data;
+        return result;
+    }
+
+    // Any contiguous buffer such as bytes, bytearray, memoryview, mmap, or NumPy array is read
+    // in place, only the sample data is copied while converting it
+    SoundFont(py::buffer buffer)
     {
-        py::buffer_info info(py::buffer(bytes).request());
-        obj = tsf_load_memory(info.ptr, info.size);
+        py::buffer_info info = buffer.request();
+        py::ssize_t expected = info.itemsize;
+        for (py::ssize_t dim = info.ndim - 1; dim >= 0; dim--) {
+            if (info.shape[dim] > 1 && info.strides[dim] != expected) {
+                throw std::runtime_error("Could not load SoundFont, buffer must be contiguous");
+            }
+            expected *= info.shape[dim];
+        }
+        py::ssize_t size = info.size * info.itemsize;
+        if (size > std::numeric_limits<int>::max()) {
+            throw std::runtime_error("Could not load SoundFont, buffer is larger than 2 GiB");
+        }
+        auto start = std::chrono::steady_clock::now();
+        {
+            // The exported buffer cannot be resized or freed until info is released
+            py::gil_scoped_release release;
+            obj = tsf_load_memory(info.ptr, static_cast<int>(size));
+        }
         if (!obj) {
             throw std::runtime_error(std::string("Could not load SoundFont from bytes"));
         }
+        load_seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+        load_bytes = size;
+    }
+
+    // Load from a readable binary file object, see FileStream
+    static SoundFont* from_file(py::object file) {
+        FileStream source(file);
+        struct tsf_stream stream = { &source, &FileStream::read_callback, &FileStream::skip_callback };
+        auto start = std::chrono::steady_clock::now();
+        tsf* obj;
+        {
+            py::gil_scoped_release release;
+            obj = tsf_load(&stream);
+        }
+        if (source.error) {
+            tsf_close(obj);
+            std::rethrow_exception(source.error);
+        }
+        if (!obj) {
+            throw std::runtime_error("Could not load SoundFont from file object");
+        }
+        SoundFont* result = new SoundFont();
+        result->obj = obj;
+        result->load_seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+        result->load_bytes = source.total;
+        return result;
     }
 
     SoundFont(const std::string& filename)
     {
-        obj = tsf_load_filename(filename.c_str());
+        auto start = std::chrono::steady_clock::now();
+        {
+            py::gil_scoped_release release;
+            obj = tsf_load_filename(filename.c_str());
+        }
         if (!obj) {
             throw std::runtime_error(std::string("Could not load SoundFont file: ") + filename);
         }
+        load_seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+        std::ifstream file(filename, std::ios::binary | std::ios::ate);
+        load_bytes = file ? static_cast<long long>(file.tellg()) : 0;
     }
 
-    SoundFont(const SoundFont &other) {
+    SoundFont(const SoundFont &other) : external(other.external) {
+        auto lock = lock_without_gil(other.mutex);
+        Lock shared(shared_data_mutex());
         obj = tsf_copy(other.obj);
         if (!obj) {
             throw std::runtime_error("Could not clone existing SoundFont object");
@@ -63,10 +433,39 @@ public:
     }
 
     ~SoundFont() {
+        for (const auto& range : locked) {
+            unlock_memory(range.first, range.second);
+        }
+        Lock shared(shared_data_mutex());
         tsf_close(obj);
     }
 
-    void reset() { tsf_reset(obj); }
+    void reset() { auto lock = lock_without_gil(mutex); tsf_reset(obj); }
+
+    size_t export_size() const { return tsf_export(obj, nullptr, 0); }
+
+    void export_to(py::buffer buffer) const {
+        py::buffer_info info = buffer.request(true);
+        if (!tsf_export(obj, info.ptr, static_cast<size_t>(info.size * info.itemsize))) {
+            throw std::runtime_error("Buffer is too small to export SoundFont");
+        }
+    }
+
+    py::bytes to_bytes() const {
+        std::string data(export_size(), '\0');
+        tsf_export(obj, &data[0], data.size());
+        return py::bytes(data);
+    }
+
+    void copy_state(const SoundFont& other) {
+        if (&other == this) {
+            return;
+        }
+        auto locks = lock_without_gil(mutex, other.mutex);
+        if (!tsf_copy_state(obj, other.obj)) {
+            throw std::runtime_error("Could not copy state, SoundFonts must be clones of the same SoundFont");
+        }
+    }
 
     int get_preset_index(int bank, int number) { return tsf_get_presetindex(obj, bank, number); }
 
@@ -76,33 +475,251 @@ public:
 
     std::string get_preset_name(int bank, int number) { return string_none_if_nullptr(tsf_bank_get_presetname(obj, bank, number)); }
 
-    void set_output(enum TSFOutputMode output_mode, int samplerate, float global_gain_db) { tsf_set_output(obj, output_mode, samplerate, global_gain_db); }
+    // Sorted, non-overlapping ranges of sample data used by regions of presets
+    std::vector<std::pair<unsigned int, unsigned int>> sample_ranges(const std::vector<int>& indices) const {
+        std::vector<std::pair<unsigned int, unsigned int>> ranges;
+        for (int index : indices) {
+            const struct tsf_preset& preset = obj->presets[index];
+            for (int i = 0; i < preset.regionNum; i++) {
+                ranges.emplace_back(preset.regions[i].offset, preset.regions[i].end);
+            }
+        }
+        std::sort(ranges.begin(), ranges.end());
+        std::vector<std::pair<unsigned int, unsigned int>> merged;
+        for (const auto& range : ranges) {
+            if (!merged.empty() && range.first <= merged.back().second) {
+                merged.back().second = std::max(merged.back().second, range.second);
+            } else if (range.second > range.first) {
+                merged.push_back(range);
+            }
+        }
+        return merged;
+    }
 
-    void set_volume(float global_gain) { tsf_set_volume(obj, global_gain); }
+    py::list presets() {
+        py::list result;
+        for (int index = 0; index < obj->presetNum; index++) {
+            const struct tsf_preset& preset = obj->presets[index];
+            // Total size of sample data used by regions, counting shared sample ranges once
+            unsigned long long samples = 0;
+            for (const auto& range : sample_ranges({index})) {
+                samples += range.second - range.first;
+            }
+            py::dict d;
+            d["index"] = index;
+            d["bank"] = static_cast<int>(preset.bank);
+            d["preset"] = static_cast<int>(preset.preset);
+            d["name"] = std::string(preset.presetName);
+            d["regions"] = preset.regionNum;
+            d["sample_bytes"] = samples * sizeof(float);
+            result.append(d);
+        }
+        return result;
+    }
 
-    void set_max_voices(int max_voices) { tsf_set_max_voices(obj, max_voices); }
+    void set_output(enum TSFOutputMode output_mode, int samplerate, float global_gain_db) { auto lock = lock_without_gil(mutex); tsf_set_output(obj, output_mode, samplerate, global_gain_db); }
+
+    void set_volume(float global_gain) { auto lock = lock_without_gil(mutex); tsf_set_volume(obj, global_gain); }
+
+    void set_max_voices(int max_voices) { auto lock = lock_without_gil(mutex); tsf_set_max_voices(obj, max_voices); }
+
+    void set_interpolation(enum TSFInterpolation interpolation) { auto lock = lock_without_gil(mutex); tsf_set_interpolation(obj, interpolation); }
+
+    void set_fast_math(bool enable) { auto lock = lock_without_gil(mutex); tsf_set_fast_math(obj, enable); }
+
+    bool fast_math() const { auto lock = lock_without_gil(mutex); return obj->fastMath; }
+
+    void preallocate_channels(int channels) {
+        auto lock = lock_without_gil(mutex);
+        if (channels > 0 && !tsf_channel_init(obj, channels - 1)) {
+            throw std::runtime_error("Could not allocate channels");
+        }
+    }
+
+    // Touch every page of sample data used by presets so playing them later does not page fault,
+    // optionally locking the pages in memory. Returns bytes touched and bytes newly locked.
+    py::dict warm(py::iterable preset_indices, bool lock) {
+        auto guard = lock_without_gil(mutex);
+        std::vector<int> indices;
+        for (py::handle item : preset_indices) {
+            int index = item.cast<int>();
+            if (index < 0 || index >= obj->presetNum) {
+                throw std::runtime_error("Invalid preset index");
+            }
+            indices.push_back(index);
+        }
+        size_t page = page_size();
+        size_t total = static_cast<size_t>(obj->fontSampleCount) * sizeof(float);
+        char* base = reinterpret_cast<char*>(obj->fontSamples);
+        unsigned long long touched = 0;
+        unsigned long long locked_bytes = 0;
+        for (const auto& range : sample_ranges(indices)) {
+            // Interpolation reads a few samples past the end of a region
+            size_t start = static_cast<size_t>(range.first) * sizeof(float);
+            size_t end = std::min(total, (static_cast<size_t>(range.second) + 8) * sizeof(float));
+            volatile char sink = 0;
+            for (size_t pos = start; pos < end; pos += page) {
+                sink = sink + base[pos];
+            }
+            sink = sink + base[end - 1];
+            touched += end - start;
+            if (lock) {
+                char* first = base + (start / page) * page;
+                size_t size = (base + end) - first;
+                if (lock_memory(first, size)) {
+                    locked.emplace_back(first, size);
+                    locked_bytes += size;
+                }
+            }
+        }
+        py::dict d;
+        d["bytes"] = touched;
+        d["locked_bytes"] = locked_bytes;
+        return d;
+    }
+
+    void set_note_cache(unsigned int max_bytes) {
+        auto lock = lock_without_gil(mutex);
+        if (!tsf_set_note_cache(obj, max_bytes)) {
+            throw std::runtime_error("Could not allocate note cache");
+        }
+    }
 
     void note_on(int index, int key, float velocity) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_note_on(obj, index, key, velocity)) {
             throw std::runtime_error(std::string("Error in note_on"));
         }
     }
 
     void note_on(int bank, int number, int key, float velocity) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_bank_note_on(obj, bank, number, key, velocity)) {
             throw std::runtime_error("Error in note_on");
         }
     }
 
-    void note_off() { tsf_note_off_all(obj); }
+    void note_off() { auto lock = lock_without_gil(mutex); tsf_note_off_all(obj); }
+
+    void note_off(int index, int key) { auto lock = lock_without_gil(mutex); tsf_note_off(obj, index, key); }
+
+    void note_off(int bank, int number, int key) { auto lock = lock_without_gil(mutex); tsf_bank_note_off(obj, bank, number, key); }
+
+    int active_voice_count() { auto lock = lock_without_gil(mutex); return tsf_active_voice_count(obj); }
+
+    // Unlike tsf_reset, voices end without a release and channel state is kept
+    void voices_off() {
+        auto lock = lock_without_gil(mutex);
+        struct tsf_voice *v = obj->voices, *vEnd = v + obj->voiceNum;
+        for (; v != vEnd; v++) {
+            if (v->playingPreset != -1) {
+                tsf_voice_kill(v);
+            }
+        }
+    }
+
+    // Stop only voices of notes that are still held, or only voices that are releasing
+    void voices_off(bool held) {
+        auto lock = lock_without_gil(mutex);
+        struct tsf_voice *v = obj->voices, *vEnd = v + obj->voiceNum;
+        for (; v != vEnd; v++) {
+            if (v->playingPreset != -1 && (v->ampenv.segment < TSF_SEGMENT_RELEASE) == held) {
+                tsf_voice_kill(v);
+            }
+        }
+    }
+
+    // Copy parameters of channels from a different SoundFont, presets are matched by bank and
+    // preset number with the same fallbacks as tsf_channel_set_presetnumber
+    void copy_channels(const SoundFont& other, py::iterable channel_numbers) {
+        if (&other == this) {
+            return;
+        }
+        std::vector<int> channels;
+        for (py::handle item : channel_numbers) {
+            channels.push_back(item.cast<int>());
+        }
+        auto locks = lock_without_gil(mutex, other.mutex);
+        for (int channel : channels) {
+            if (channel < 0 || !other.obj->channels || channel >= other.obj->channels->channelNum) {
+                continue;
+            }
+            const struct tsf_channel& source = other.obj->channels->channels[channel];
+            struct tsf_channel* c = tsf_channel_init(obj, channel);
+            if (!c) {
+                throw std::runtime_error("Could not allocate channel");
+            }
+            const struct tsf_preset& preset = other.obj->presets[source.presetIndex];
+            int index = tsf_get_presetindex(obj, preset.bank, preset.preset);
+            if (index == -1 && preset.bank >= 128) {
+                index = tsf_get_presetindex(obj, 128, 0);
+            }
+            if (index == -1) {
+                index = tsf_get_presetindex(obj, 0, preset.preset);
+            }
+            *c = source;
+            c->presetIndex = static_cast<unsigned short>(index == -1 ? 0 : index);
+        }
+    }
 
-    void note_off(int index, int key) { tsf_note_off(obj, index, key); }
+    py::dict stats() {
+        auto lock = lock_without_gil(mutex);
+        int peak;
+        unsigned int stolen, dropped;
+        tsf_get_voice_stats(obj, &peak, &stolen, &dropped);
+        py::dict d;
+        d["active_voices"] = tsf_active_voice_count(obj);
+        d["peak_voices"] = peak;
+        d["stolen_voices"] = stolen;
+        d["dropped_voices"] = dropped;
+        // Count active voices for each channel that has any
+        py::dict channel_voices;
+        struct tsf_voice *v = obj->voices, *vEnd = v + obj->voiceNum;
+        for (; v != vEnd; v++) {
+            if (v->playingPreset == -1) {
+                continue;
+            }
+            py::int_ channel(obj->channels ? v->playingChannel : 0);
+            channel_voices[channel] = channel_voices.contains(channel) ? channel_voices[channel].cast<int>() + 1 : 1;
+        }
+        d["channel_voices"] = channel_voices;
+        d["load_seconds"] = load_seconds;
+        d["load_bytes"] = load_bytes;
+        d["sample_bytes"] = static_cast<long long>(obj->fontSampleCount) * sizeof(float);
+        d["render"] = render_stats.to_dict();
+        unsigned int hits, misses, evictions, bytes;
+        unsigned long long samples;
+        int entries;
+        tsf_get_note_cache_stats(obj, &hits, &misses, &evictions, &samples, &bytes, &entries);
+        py::dict note_cache;
+        note_cache["hits"] = hits;
+        note_cache["misses"] = misses;
+        note_cache["evictions"] = evictions;
+        note_cache["samples"] = samples;
+        note_cache["bytes"] = bytes;
+        note_cache["entries"] = entries;
+        unsigned long long fill_samples;
+        double fill_seconds;
+        tsf_get_note_cache_fill_stats(obj, &fill_samples, &fill_seconds);
+        note_cache["fill_samples"] = fill_samples;
+        note_cache["fill_seconds"] = fill_seconds;
+        // Stored samples mixed instead of rendered, at the measured render time per sample
+        note_cache["saved_seconds"] = fill_samples ? samples * (fill_seconds / fill_samples) : 0.0;
+        d["note_cache"] = note_cache;
+        return d;
+    }
 
-    void note_off(int bank, int number, int key) { tsf_bank_note_off(obj, bank, number, key); }
+    void reset_stats() {
+        auto lock = lock_without_gil(mutex);
+        tsf_reset_stats(obj);
+        render_stats.reset();
+    }
 
     void render(py::buffer buffer, bool mix) {
         py::buffer_info info = buffer.request();
         int output_channels = obj->outputmode == TSF_MONO ? 1 : 2;
+        int samples = 0;
+        bool is_short = false;
         if (info.ndim == 1) {
             // 1D buffers must be contiguous byte arrays
             if (info.format != py::format_descriptor<unsigned char>::format()) {
@@ -111,111 +728,1049 @@ public:
             if (info.shape[0] % (sizeof(float) * output_channels)) {
                 throw std::runtime_error("Buffer length does not divide evenly into sample frames");
             }
-            int samples = info.shape[0] / (sizeof(float) * output_channels);
-            tsf_render_float(obj, static_cast<float *>(info.ptr), samples, mix ? 1 : 0);
+            samples = info.shape[0] / (sizeof(float) * output_channels);
+        } else {
+            is_short = info.format == py::format_descriptor<short>::format();
+            if (info.format != py::format_descriptor<float>::format() && !is_short) {
+                throw std::runtime_error("Incompatible buffer format, must be float32 or int16");
+            }
+            if (info.ndim != 2) {
+                throw std::runtime_error("Incompatible buffer dimension, must be 1 dimensional bytearray or 2 dimensional of size (samples, channels)");
+            }
+            if (info.shape[1] != output_channels) {
+                throw std::runtime_error(std::string("Incompatible buffer length, channel size must be ") + std::string(output_channels == 1 ? "1 for mono" : "2 for stereo"));
+            }
+            samples = info.shape[0];
+        }
+        // Release the GIL before locking so other threads can run while rendering
+        py::gil_scoped_release release;
+        Lock lock(mutex);
+        RenderTimer timer(render_stats);
+        timer.frames = samples;
+        if (is_short) {
+            tsf_render_short(obj, static_cast<short *>(info.ptr), samples, mix ? 1 : 0);
             return;
         }
+        tsf_render_float(obj, static_cast<float *>(info.ptr), samples, mix ? 1 : 0);
+    }
+
+    void render_channels(py::buffer buffer, int offset, int samples, bool mix) {
+        py::buffer_info info = buffer.request(true);
+        int output_channels = obj->outputmode == TSF_MONO ? 1 : 2;
         if (info.format != py::format_descriptor<float>::format()) {
             throw std::runtime_error("Incompatible buffer format, must be float32");
         }
-        if (info.ndim != 2) {
-            throw std::runtime_error("Incompatible buffer dimension, must be 1 dimensional bytearray or 2 dimensional of size (samples, channels)");
+        if (info.ndim != 3) {
+            throw std::runtime_error("Incompatible buffer dimension, must be 3 dimensional of size (stems, samples, channels)");
         }
-        if (info.shape[1] != output_channels) {
+        if (info.shape[2] != output_channels) {
             throw std::runtime_error(std::string("Incompatible buffer length, channel size must be ") + std::string(output_channels == 1 ? "1 for mono" : "2 for stereo"));
         }
-        int samples = info.shape[0];
-        tsf_render_float(obj, static_cast<float *>(info.ptr), samples, mix ? 1 : 0);
-        return;
+        int stems = static_cast<int>(info.shape[0]);
+        int frames = static_cast<int>(info.shape[1]);
+        if (info.strides[2] != sizeof(float) || info.strides[1] != static_cast<py::ssize_t>(sizeof(float) * output_channels)
+            || info.strides[0] != static_cast<py::ssize_t>(sizeof(float) * output_channels) * frames) {
+            throw std::runtime_error("Incompatible buffer, must be contiguous");
+        }
+        if (samples < 0) {
+            samples = frames - offset;
+        }
+        if (offset < 0 || offset + samples > frames) {
+            throw std::runtime_error("Sample range does not fit in buffer");
+        }
+        if (obj->outputmode == TSF_STEREO_UNWEAVED && (offset != 0 || samples != frames)) {
+            throw std::runtime_error("Unweaved output can only render complete stems");
+        }
+        py::gil_scoped_release release;
+        Lock lock(mutex);
+        RenderTimer timer(render_stats);
+        timer.frames = samples;
+        float* base = static_cast<float *>(info.ptr);
+        int stem_size = frames * output_channels;
+        if (!mix) {
+            for (int stem = 0; stem < stems; stem++) {
+                std::fill_n(base + stem * stem_size + offset * output_channels, samples * output_channels, 0.0f);
+            }
+        }
+        if (stems == 0 || samples == 0) {
+            return;
+        }
+        // Each voice is rendered directly into the stem of the channel it is playing on.
+        // Voices on channels past the last stem are collected in the last stem.
+        struct tsf_voice *v = obj->voices, *vEnd = v + obj->voiceNum;
+        for (; v != vEnd; v++) {
+            if (v->playingPreset == -1) {
+                continue;
+            }
+            int stem = obj->channels ? v->playingChannel : 0;
+            if (stem >= stems) {
+                stem = stems - 1;
+            }
+            tsf_voice_render(obj, v, base + stem * stem_size + offset * output_channels, samples);
+        }
     }
 
     void channel_set_preset_index(int channel, int index) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_presetindex(obj, channel, index)) {
             throw std::runtime_error("Error in channel_set_preset_index");
         }
     }
 
     void channel_set_preset_number(int channel, int number, bool drum) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_presetnumber(obj, channel, number, drum ? 1 : 0)) {
             throw std::runtime_error("Error in channel_set_preset_number");
         }
     }
 
     void channel_set_bank(int channel, int bank) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_bank(obj, channel, bank)) {
             throw std::runtime_error("Error in channel_set_bank");
         }
     }
 
     void channel_set_bank_preset(int channel, int bank, int number) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_bank_preset(obj, channel, bank, number)) {
             throw std::runtime_error("Error in channel_set_bank_preset");
         }
     }
 
     void channel_set_pan(int channel, float pan) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_pan(obj, channel, pan)) {
             throw std::runtime_error("Error in channel_set_pan");
         }
     }
 
     void channel_set_volume(int channel, float volume) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_volume(obj, channel, volume)) {
             throw std::runtime_error("Error in channel_set_volume");
         }
     }
 
     void channel_set_pitch_wheel(int channel, int pitch_wheel) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_pitchwheel(obj, channel, pitch_wheel)) {
             throw std::runtime_error("Error in channel_set_pitch_wheel");
         }
     }
 
     void channel_set_pitch_range(int channel, float range) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_pitchrange(obj, channel, range)) {
             throw std::runtime_error("Error in channel_set_pitch_range");
         }
     }
 
     void channel_set_tuning(int channel, float tuning) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_set_tuning(obj, channel, tuning)) {
             throw std::runtime_error("Error in channel_set_tuning");
         }
     }
 
     void channel_note_on(int channel, int key, float velocity) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_note_on(obj, channel, key, velocity)) {
             throw std::runtime_error(std::string("Error in channel_note_on"));
         }
     }
 
-    void channel_note_off(int channel, int key) { tsf_channel_note_off(obj, channel, key); }
+    void channel_note_off(int channel, int key) { auto lock = lock_without_gil(mutex); tsf_channel_note_off(obj, channel, key); }
 
-    void channel_note_off(int channel) { tsf_channel_note_off_all(obj, channel); }
+    void channel_note_off(int channel) { auto lock = lock_without_gil(mutex); tsf_channel_note_off_all(obj, channel); }
 
-    void channel_sounds_off(int channel) { tsf_channel_sounds_off_all(obj, channel); }
+    void channel_sounds_off(int channel) { auto lock = lock_without_gil(mutex); tsf_channel_sounds_off_all(obj, channel); }
 
     void channel_midi_control(int channel, int controller, int control_value) {
+        auto lock = lock_without_gil(mutex);
         if (!tsf_channel_midi_control(obj, channel, controller, control_value)) {
             throw std::runtime_error(std::string("Error in channel_midi_control"));
         }
     }
 
-    int channel_get_preset_index(int channel) { return tsf_channel_get_preset_index(obj, channel); }
+    int channel_get_preset_index(int channel) { auto lock = lock_without_gil(mutex); return tsf_channel_get_preset_index(obj, channel); }
+
+    int channel_get_preset_bank(int channel) { auto lock = lock_without_gil(mutex); return tsf_channel_get_preset_bank(obj, channel); }
+
+    int channel_get_preset_number(int channel) { auto lock = lock_without_gil(mutex); return tsf_channel_get_preset_number(obj, channel); }
+
+    float channel_get_pan(int channel) { auto lock = lock_without_gil(mutex); return tsf_channel_get_pan(obj, channel); }
+
+    float channel_get_volume(int channel) { auto lock = lock_without_gil(mutex); return tsf_channel_get_volume(obj, channel); }
+
+    int channel_get_pitch_wheel(int channel) { auto lock = lock_without_gil(mutex); return tsf_channel_get_pitchwheel(obj, channel); }
+
+    float channel_get_pitch_range(int channel) { auto lock = lock_without_gil(mutex); return tsf_channel_get_pitchrange(obj, channel); }
+
+    float channel_get_tuning(int channel) { auto lock = lock_without_gil(mutex); return tsf_channel_get_tuning(obj, channel); }
+};
+
+enum class SampleFormat {
+    Float32,
+    Int16
+};
+
+// Number of frames mixed at a time when output needs conversion, must be a
+// multiple of TSF_RENDER_EFFECTSAMPLEBLOCK so voice effect updates happen at
+// the same positions as when rendering directly.
+constexpr int MIXER_BLOCK_FRAMES = 1024;
+
+// Largest number of polyphase filter phases allowed for a resampling ratio
+constexpr int RESAMPLER_MAX_PHASES = 4096;
+
+namespace {
+
+// Zeroth order modified Bessel function of the first kind, for Kaiser window
+double bessel_i0(double x) {
+    double sum = 1.0, term = 1.0;
+    for (int k = 1; k < 32; k++) {
+        term *= (x / (2.0 * k)) * (x / (2.0 * k));
+        sum += term;
+    }
+    return sum;
+}
+
+int gcd(int a, int b) {
+    while (b) {
+        int t = a % b;
+        a = b;
+        b = t;
+    }
+    return a;
+}
+
+} // end anonymous namespace
+
+// Freeverb style reverb (8 parallel damped combs then 4 series allpasses per side),
+// reads a mono send bus and adds stereo output
+class Reverb {
+public:
+    float room_size = 0.5f;
+    float damping = 0.5f;
+    float width = 1.0f;
+    float level = 1.0f;
+
+    void setup(int samplerate) {
+        static const int comb_tuning[REVERB_COMBS] = {1116, 1188, 1277, 1356, 1422, 1491, 1557, 1617};
+        static const int allpass_tuning[REVERB_ALLPASSES] = {556, 441, 341, 225};
+        // Tunings are in samples at 44100 Hz, right side is offset to decorrelate
+        const int spread = 23;
+        double scale = samplerate / 44100.0;
+        for (int side = 0; side < 2; side++) {
+            for (int i = 0; i < REVERB_COMBS; i++) {
+                combs[side][i].buffer.assign(std::max(1, static_cast<int>((comb_tuning[i] + side * spread) * scale)), 0.0f);
+            }
+            for (int i = 0; i < REVERB_ALLPASSES; i++) {
+                allpasses[side][i].buffer.assign(std::max(1, static_cast<int>((allpass_tuning[i] + side * spread) * scale)), 0.0f);
+            }
+        }
+        clear();
+    }
+
+    void clear() {
+        for (int side = 0; side < 2; side++) {
+            for (Comb& comb : combs[side]) {
+                std::fill(comb.buffer.begin(), comb.buffer.end(), 0.0f);
+                comb.pos = 0;
+                comb.store = 0.0f;
+            }
+            for (Allpass& allpass : allpasses[side]) {
+                std::fill(allpass.buffer.begin(), allpass.buffer.end(), 0.0f);
+                allpass.pos = 0;
+            }
+        }
+    }
+
+    void process(const float* in, float* out, int count, int channels) {
+        float feedback = room_size * 0.28f + 0.7f;
+        float damp = damping * 0.4f;
+        // Wet gain of Freeverb is 3, input gain is 0.015 for each of two input channels
+        float wet1 = 3.0f * level * (width * 0.5f + 0.5f);
+        float wet2 = 3.0f * level * ((1.0f - width) * 0.5f);
+        for (int n = 0; n < count; n++) {
+            float input = in[n] * 0.03f;
+            float side_out[2];
+            for (int side = 0; side < 2; side++) {
+                float acc = 0.0f;
+                for (Comb& comb : combs[side]) {
+                    float output = comb.buffer[comb.pos];
+                    comb.store = output * (1.0f - damp) + comb.store * damp;
+                    comb.buffer[comb.pos] = input + comb.store * feedback;
+                    if (++comb.pos == comb.buffer.size()) comb.pos = 0;
+                    acc += output;
+                }
+                for (Allpass& allpass : allpasses[side]) {
+                    float delayed = allpass.buffer[allpass.pos];
+                    allpass.buffer[allpass.pos] = acc + delayed * 0.5f;
+                    if (++allpass.pos == allpass.buffer.size()) allpass.pos = 0;
+                    acc = delayed - acc;
+                }
+                side_out[side] = acc;
+            }
+            if (channels == 1) {
+                out[n] += (side_out[0] + side_out[1]) * 0.5f * (wet1 + wet2);
+            } else {
+                out[n * 2] += side_out[0] * wet1 + side_out[1] * wet2;
+                out[n * 2 + 1] += side_out[1] * wet1 + side_out[0] * wet2;
+            }
+        }
+    }
+
+private:
+    static constexpr int REVERB_COMBS = 8;
+    static constexpr int REVERB_ALLPASSES = 4;
+    struct Comb {
+        std::vector<float> buffer;
+        size_t pos = 0;
+        float store = 0.0f;
+    };
+    struct Allpass {
+        std::vector<float> buffer;
+        size_t pos = 0;
+    };
+    Comb combs[2][REVERB_COMBS];
+    Allpass allpasses[2][REVERB_ALLPASSES];
+};
+
+// Stereo chorus from one delay line with two sine modulated taps a quarter period apart,
+// reads a mono send bus and adds stereo output
+class Chorus {
+public:
+    float delay_ms = 12.0f;
+    float depth_ms = 4.0f;
+    float rate_hz = 0.4f;
+    float level = 1.0f;
+
+    void setup(int samplerate) {
+        this->samplerate = samplerate;
+        // Longest delay allowed by parameter checks, plus interpolation margin
+        buffer.assign(static_cast<size_t>(CHORUS_MAX_MS * 2 * samplerate / 1000) + 2, 0.0f);
+        clear();
+    }
+
+    void clear() {
+        std::fill(buffer.begin(), buffer.end(), 0.0f);
+        pos = 0;
+        lfo_phase = 0.0;
+    }
+
+    // Clear the delay line but keep the LFO where it would be after `frames` more frames
+    void skip(long long frames) {
+        double phase = std::fmod(lfo_phase + frames * (2.0 * TSF_PI * rate_hz / samplerate), 2.0 * TSF_PI);
+        clear();
+        lfo_phase = phase;
+    }
+
+    void process(const float* in, float* out, int count, int channels) {
+        double increment = 2.0 * TSF_PI * rate_hz / samplerate;
+        float delay = delay_ms * 0.001f * samplerate;
+        float depth = depth_ms * 0.001f * samplerate;
+        int size = static_cast<int>(buffer.size());
+        for (int n = 0; n < count; n++) {
+            buffer[pos] = in[n];
+            float tap[2];
+            for (int side = 0; side < 2; side++) {
+                float d = delay + depth * static_cast<float>(std::sin(lfo_phase + side * TSF_PI * 0.5));
+                float read = static_cast<float>(pos) - d;
+                if (read < 0.0f) read += size;
+                int i0 = static_cast<int>(read);
+                int i1 = i0 + 1 == size ? 0 : i0 + 1;
+                float alpha = read - i0;
+                tap[side] = buffer[i0] + (buffer[i1] - buffer[i0]) * alpha;
+            }
+            if (channels == 1) {
+                out[n] += (tap[0] + tap[1]) * 0.5f * level;
+            } else {
+                out[n * 2] += tap[0] * level;
+                out[n * 2 + 1] += tap[1] * level;
+            }
+            if (++pos == size) pos = 0;
+            lfo_phase += increment;
+            if (lfo_phase >= 2.0 * TSF_PI) lfo_phase -= 2.0 * TSF_PI;
+        }
+    }
+
+    // Largest value allowed for delay_ms and depth_ms
+    static constexpr float CHORUS_MAX_MS = 50.0f;
 
-    int channel_get_preset_bank(int channel) { return tsf_channel_get_preset_bank(obj, channel); }
+private:
+    int samplerate = 44100;
+    std::vector<float> buffer;
+    int pos = 0;
+    double lfo_phase = 0.0;
+};
 
-    int channel_get_preset_number(int channel) { return tsf_channel_get_preset_number(obj, channel); }
+// Look-ahead peak limiter for the final mix, delays output by the look-ahead time so gain
+// reduction starts before a peak arrives, with a hard clip at the threshold as last resort
+class Limiter {
+public:
+    float threshold = 1.0f;
+    // Lowest gain applied since last read by the meters
+    float min_gain = 1.0f;
+    // Samples over 0 dBFS before limiting
+    unsigned long long clipped = 0;
 
-    float channel_get_pan(int channel) { return tsf_channel_get_pan(obj, channel); }
+    void setup(int samplerate, int channels, float threshold_db, float lookahead_ms, float release_ms) {
+        this->channels = channels;
+        threshold = static_cast<float>(std::pow(10.0, threshold_db / 20.0));
+        lookahead = std::max(0, static_cast<int>(lookahead_ms * 0.001f * samplerate));
+        // Attack reaches the target within the look-ahead, release is the time constant
+        attack_coef = lookahead ? 1.0f - static_cast<float>(std::exp(-5.0 / lookahead)) : 1.0f;
+        float release_samples = std::max(1.0f, release_ms * 0.001f * samplerate);
+        release_coef = 1.0f - static_cast<float>(std::exp(-1.0 / release_samples));
+        delay.assign(static_cast<size_t>(lookahead + 1) * channels, 0.0f);
+        window_time.assign(lookahead + 1, 0);
+        window_gain.assign(lookahead + 1, 1.0f);
+        clear();
+    }
 
-    float channel_get_volume(int channel) { return tsf_channel_get_volume(obj, channel); }
+    void clear() {
+        std::fill(delay.begin(), delay.end(), 0.0f);
+        delay_pos = 0;
+        window_head = 0;
+        window_size = 0;
+        time = 0;
+        gain = 1.0f;
+    }
 
-    int channel_get_pitch_wheel(int channel) { return tsf_channel_get_pitchwheel(obj, channel); }
+    void process(float* data, int count) {
+        int size = lookahead + 1;
+        for (int n = 0; n < count; n++) {
+            float* frame = data + n * channels;
+            float peak = 0.0f;
+            for (int c = 0; c < channels; c++) {
+                float v = std::fabs(frame[c]);
+                peak = std::max(peak, v);
+                clipped += v > 1.0f;
+            }
+            float target = peak > threshold ? threshold / peak : 1.0f;
+            // Sliding minimum of target gain over the look-ahead window, as a monotonic queue
+            while (window_size && window_gain[(window_head + window_size - 1) % size] >= target) {
+                window_size--;
+            }
+            int slot = (window_head + window_size) % size;
+            window_time[slot] = time;
+            window_gain[slot] = target;
+            window_size++;
+            if (window_time[window_head] <= time - size) {
+                window_head = (window_head + 1) % size;
+                window_size--;
+            }
+            float wanted = window_gain[window_head];
+            gain += (wanted - gain) * (wanted < gain ? attack_coef : release_coef);
+            min_gain = std::min(min_gain, gain);
+            float* delayed = delay.data() + delay_pos * channels;
+            for (int c = 0; c < channels; c++) {
+                float v = delayed[c];
+                delayed[c] = frame[c];
+                v *= gain;
+                frame[c] = v > threshold ? threshold : (v < -threshold ? -threshold : v);
+            }
+            delay_pos = delay_pos + 1 == size ? 0 : delay_pos + 1;
+            time++;
+        }
+    }
 
-    float channel_get_pitch_range(int channel) { return tsf_channel_get_pitchrange(obj, channel); }
+private:
+    int channels = 2;
+    int lookahead = 0;
+    float attack_coef = 1.0f;
+    float release_coef = 1.0f;
+    float gain = 1.0f;
+    std::vector<float> delay;
+    int delay_pos = 0;
+    std::vector<long long> window_time;
+    std::vector<float> window_gain;
+    int window_head = 0;
+    int window_size = 0;
+    long long time = 0;
+};
+
+// Peak and RMS levels per output channel of the final mix
+class Meters {
+public:
+    // Levels since last read
+    float peak[2] = {};
+    double sum_squares[2] = {};
+    unsigned long long frames = 0;
+    // Highest peak since reset
+    float peak_hold[2] = {};
+    // Samples over 0 dBFS since reset, when there is no limiter
+    unsigned long long clipped = 0;
+
+    void add(const float* data, int count, int channels, bool count_clipped) {
+        for (int c = 0; c < channels; c++) {
+            float block_peak = peak[c];
+            double squares = 0.0;
+            for (int n = 0; n < count; n++) {
+                float v = data[n * channels + c];
+                float a = std::fabs(v);
+                block_peak = std::max(block_peak, a);
+                squares += static_cast<double>(v) * v;
+                if (count_clipped) clipped += a > 1.0f;
+            }
+            peak[c] = block_peak;
+            peak_hold[c] = std::max(peak_hold[c], block_peak);
+            sum_squares[c] += squares;
+        }
+        frames += count;
+    }
 
-    float channel_get_tuning(int channel) { return tsf_channel_get_tuning(obj, channel); }
+    void reset() { *this = Meters(); }
+};
+
+// Locks itself while rendering or changing settings, and each SoundFont while rendering it
+class Mixer {
+public:
+    mutable std::mutex mutex;
+    enum TSFOutputMode output_mode;
+    SampleFormat sample_format;
+    bool dither;
+    // Python references keep SoundFont objects alive while they are mixed
+    py::list soundfont_refs;
+    std::vector<SoundFont*> soundfonts;
+    std::vector<float> scratch;
+    unsigned int dither_state = 0x12345678u;
+    // Polyphase resampler state, SoundFonts render at in_rate and output is at out_rate
+    int in_rate = 0;
+    int out_rate = 0;
+    int phases = 1;
+    int step = 1;
+    int taps = 0;
+    std::vector<float> coeffs;
+    std::vector<float> history;
+    int history_pos = 0;
+    int phase = 0;
+    RenderStats render_stats;
+    // Shared effect buses fed by voice sends (MIDI controllers 91 and 93)
+    bool reverb_enabled = false;
+    bool chorus_enabled = false;
+    Reverb reverb;
+    Chorus chorus;
+    std::vector<float> reverb_send;
+    std::vector<float> chorus_send;
+    // Processing of the final mix
+    bool limiter_enabled = false;
+    bool meters_enabled = false;
+    Limiter limiter;
+    float limiter_threshold_db = -1.0f;
+    float limiter_lookahead_ms = 5.0f;
+    float limiter_release_ms = 50.0f;
+    Meters meters;
+    // SoundFonts replaced while playing, mixed with a gain ramping down to silence over total
+    // frames, then dropped by the next change of SoundFonts
+    struct Fade {
+        SoundFont* soundfont;
+        int remaining;
+        int total;
+    };
+    std::vector<Fade> fades;
+    py::list fade_refs;
+    std::vector<float> fade_block;
+    std::vector<float> fade_reverb;
+    std::vector<float> fade_chorus;
+
+    Mixer(enum TSFOutputMode output_mode, SampleFormat sample_format, bool dither)
+        : output_mode(output_mode), sample_format(sample_format), dither(dither),
+          scratch(MIXER_BLOCK_FRAMES * 2),
+          reverb_send(MIXER_BLOCK_FRAMES), chorus_send(MIXER_BLOCK_FRAMES),
+          fade_block(MIXER_BLOCK_FRAMES * 2), fade_reverb(MIXER_BLOCK_FRAMES), fade_chorus(MIXER_BLOCK_FRAMES)
+    {}
+
+    // Copy with the same effect, resampler, and dither state, but no SoundFonts
+    Mixer(const Mixer& other) : Mixer(other.output_mode, other.sample_format, other.dither) {
+        copy_state(other);
+    }
+
+    void copy_state(const Mixer& other) {
+        if (&other == this) {
+            return;
+        }
+        auto locks = lock_without_gil(mutex, other.mutex);
+        if (other.output_mode != output_mode || other.sample_format != sample_format) {
+            throw std::runtime_error("Could not copy state, mixers must have the same output mode and sample format");
+        }
+        dither = other.dither;
+        dither_state = other.dither_state;
+        in_rate = other.in_rate;
+        out_rate = other.out_rate;
+        phases = other.phases;
+        step = other.step;
+        taps = other.taps;
+        coeffs = other.coeffs;
+        history = other.history;
+        history_pos = other.history_pos;
+        phase = other.phase;
+        reverb_enabled = other.reverb_enabled;
+        chorus_enabled = other.chorus_enabled;
+        reverb = other.reverb;
+        chorus = other.chorus;
+        limiter_enabled = other.limiter_enabled;
+        meters_enabled = other.meters_enabled;
+        limiter = other.limiter;
+        limiter_threshold_db = other.limiter_threshold_db;
+        limiter_lookahead_ms = other.limiter_lookahead_ms;
+        limiter_release_ms = other.limiter_release_ms;
+        meters = other.meters;
+    }
+
+    int output_channels() const { return output_mode == TSF_MONO ? 1 : 2; }
+
+    int frame_size() const { return output_channels() * (sample_format == SampleFormat::Int16 ? sizeof(short) : sizeof(float)); }
+
+    void set_soundfonts(py::list soundfonts) {
+        std::vector<SoundFont*> fonts = checked(soundfonts);
+        auto lock = lock_without_gil(mutex);
+        this->soundfonts = fonts;
+        soundfont_refs = soundfonts;
+        prune_fades();
+    }
+
+    // Set the SoundFonts to mix and fade out one that was removed, in one step between renders,
+    // so no block is rendered with both or neither
+    void crossfade(py::list soundfonts, py::object old, int frames) {
+        std::vector<SoundFont*> fonts = checked(soundfonts);
+        py::list removed;
+        removed.append(old);
+        SoundFont* fading = checked(removed)[0];
+        auto lock = lock_without_gil(mutex);
+        this->soundfonts = fonts;
+        soundfont_refs = soundfonts;
+        prune_fades();
+        if (frames > 0) {
+            fades.push_back({fading, frames, frames});
+            fade_refs.append(old);
+        }
+    }
+
+    int fading() {
+        auto lock = lock_without_gil(mutex);
+        prune_fades();
+        return static_cast<int>(fades.size());
+    }
+
+    void set_resampler(int in_rate, int out_rate, int taps) {
+        auto lock = lock_without_gil(mutex);
+        if (in_rate <= 0 || out_rate <= 0) {
+            throw std::runtime_error("Samplerates must be positive");
+        }
+        if (taps < 2 || taps % 2) {
+            throw std::runtime_error("Resampler taps must be a positive even number");
+        }
+        this->in_rate = in_rate;
+        this->out_rate = out_rate;
+        // Effects run before resampling, at the SoundFont samplerate
+        reverb.setup(in_rate);
+        chorus.setup(in_rate);
+        limiter.setup(out_rate, output_channels(), limiter_threshold_db, limiter_lookahead_ms, limiter_release_ms);
+        history.clear();
+        history_pos = 0;
+        phase = 0;
+        if (in_rate == out_rate) {
+            coeffs.clear();
+            return;
+        }
+        int divisor = gcd(in_rate, out_rate);
+        phases = out_rate / divisor;
+        step = in_rate / divisor;
+        if (phases > RESAMPLER_MAX_PHASES) {
+            throw std::runtime_error("Resampling ratio between samplerates is too complex");
+        }
+        // Lowpass below the lower Nyquist frequency, widen kernel when decimating
+        double cutoff = 0.95 * std::min(in_rate, out_rate) / in_rate;
+        int span = taps * ((in_rate + out_rate - 1) / out_rate);
+        this->taps = span;
+        double beta = 8.0;
+        coeffs.assign(static_cast<size_t>(phases) * span, 0.0f);
+        for (int p = 0; p < phases; p++) {
+            double sum = 0.0;
+            for (int j = 0; j < span; j++) {
+                // Distance from output position to input sample, in input samples
+                double d = static_cast<double>(p) / phases - j + (span / 2 - 1);
+                double x = cutoff * d;
+                double sinc = x == 0.0 ? 1.0 : std::sin(TSF_PI * x) / (TSF_PI * x);
+                double r = d / (span / 2);
+                double window = r <= -1.0 || r >= 1.0 ? 0.0 : bessel_i0(beta * std::sqrt(1.0 - r * r)) / bessel_i0(beta);
+                coeffs[p * span + j] = static_cast<float>(sinc * window);
+                sum += sinc * window;
+            }
+            // Normalize each phase to unity gain at DC
+            for (int j = 0; j < span; j++) {
+                coeffs[p * span + j] = static_cast<float>(coeffs[p * span + j] / sum);
+            }
+        }
+        // Prime history so first output is centered on first input sample
+        history.assign(static_cast<size_t>(span / 2 - 1) * output_channels(), 0.0f);
+        // Reserve the most history ever needed so rendering does not allocate
+        history.reserve(static_cast<size_t>(span + MIXER_BLOCK_FRAMES) * output_channels());
+        history_pos = span / 2 - 1;
+    }
+
+    void set_reverb(bool enabled, float room_size, float damping, float width, float level) {
+        auto lock = lock_without_gil(mutex);
+        if (room_size < 0.0f || room_size > 1.0f || damping < 0.0f || damping > 1.0f || width < 0.0f || width > 1.0f) {
+            throw std::runtime_error("Reverb room_size, damping, and width must be between 0 and 1");
+        }
+        if (level < 0.0f) {
+            throw std::runtime_error("Reverb level must not be negative");
+        }
+        if (enabled && !reverb_enabled) {
+            reverb.clear();
+        }
+        reverb_enabled = enabled;
+        reverb.room_size = room_size;
+        reverb.damping = damping;
+        reverb.width = width;
+        reverb.level = level;
+    }
+
+    // Clear effect delay lines and limiter history, and advance the chorus LFO by the given
+    // number of frames, as if the effects had processed that much silence after being cleared
+    void clear_effects(long long frames) {
+        auto lock = lock_without_gil(mutex);
+        reverb.clear();
+        chorus.skip(frames);
+        limiter.clear();
+        std::fill(history.begin(), history.end(), 0.0f);
+    }
+
+    void set_chorus(bool enabled, float delay_ms, float depth_ms, float rate_hz, float level) {
+        auto lock = lock_without_gil(mutex);
+        if (delay_ms < 0.0f || depth_ms < 0.0f || depth_ms > delay_ms || delay_ms + depth_ms > Chorus::CHORUS_MAX_MS) {
+            throw std::runtime_error("Chorus depth_ms must be between 0 and delay_ms, and delay_ms + depth_ms at most 50");
+        }
+        if (rate_hz < 0.0f || level < 0.0f) {
+            throw std::runtime_error("Chorus rate_hz and level must not be negative");
+        }
+        if (enabled && !chorus_enabled) {
+            chorus.clear();
+        }
+        chorus_enabled = enabled;
+        chorus.delay_ms = delay_ms;
+        chorus.depth_ms = depth_ms;
+        chorus.rate_hz = rate_hz;
+        chorus.level = level;
+    }
+
+    void set_limiter(bool enabled, float threshold_db, float lookahead_ms, float release_ms) {
+        auto lock = lock_without_gil(mutex);
+        if (threshold_db > 0.0f) {
+            throw std::runtime_error("Limiter threshold_db must not be above 0");
+        }
+        if (lookahead_ms < 0.0f || lookahead_ms > 100.0f || release_ms <= 0.0f) {
+            throw std::runtime_error("Limiter lookahead_ms must be between 0 and 100 and release_ms must be positive");
+        }
+        limiter_enabled = enabled;
+        limiter_threshold_db = threshold_db;
+        limiter_lookahead_ms = lookahead_ms;
+        limiter_release_ms = release_ms;
+        limiter.setup(out_rate, output_channels(), threshold_db, lookahead_ms, release_ms);
+    }
+
+    void set_meters(bool enabled) {
+        auto lock = lock_without_gil(mutex);
+        meters_enabled = enabled;
+    }
+
+    py::dict read_meters() {
+        auto lock = lock_without_gil(mutex);
+        int channels = output_channels();
+        py::list peak, rms, peak_hold;
+        for (int c = 0; c < channels; c++) {
+            peak.append(meters.peak[c]);
+            rms.append(meters.frames ? std::sqrt(meters.sum_squares[c] / meters.frames) : 0.0);
+            peak_hold.append(meters.peak_hold[c]);
+        }
+        py::dict d;
+        d["peak"] = peak;
+        d["rms"] = rms;
+        d["frames"] = meters.frames;
+        d["peak_hold"] = peak_hold;
+        d["clipped"] = meters.clipped + limiter.clipped;
+        d["gain_reduction_db"] = limiter.min_gain < 1.0f ? -20.0 * std::log10(limiter.min_gain) : 0.0;
+        // Levels are since last read
+        for (int c = 0; c < channels; c++) {
+            meters.peak[c] = 0.0f;
+            meters.sum_squares[c] = 0.0;
+        }
+        meters.frames = 0;
+        limiter.min_gain = 1.0f;
+        return d;
+    }
+
+    void reset_meters() {
+        auto lock = lock_without_gil(mutex);
+        meters.reset();
+        limiter.min_gain = 1.0f;
+        limiter.clipped = 0;
+    }
+
+    py::dict stats() const { auto lock = lock_without_gil(mutex); return render_stats.to_dict(); }
+
+    void reset_stats() { auto lock = lock_without_gil(mutex); render_stats.reset(); }
+
+    void render(py::buffer buffer, int offset, int samples) {
+        py::buffer_info info = buffer.request(true);
+        py::ssize_t size_bytes = info.size * info.itemsize;
+        int channels = output_channels();
+        if (size_bytes % frame_size()) {
+            throw std::runtime_error("Buffer length does not divide evenly into sample frames");
+        }
+        int frames = static_cast<int>(size_bytes / frame_size());
+        if (samples < 0) {
+            samples = frames - offset;
+        }
+        if (offset < 0 || offset + samples > frames) {
+            throw std::runtime_error("Sample range does not fit in buffer");
+        }
+        // Release the GIL before locking so other threads can run while rendering
+        py::gil_scoped_release release;
+        Lock lock(mutex);
+        RenderTimer timer(render_stats);
+        timer.frames = samples;
+        if (sample_format == SampleFormat::Float32 && output_mode != TSF_STEREO_UNWEAVED) {
+            // Native format, render and mix directly into output
+            float* out = static_cast<float *>(info.ptr) + offset * channels;
+            if (!limiter_enabled && !meters_enabled) {
+                produce(out, samples);
+                return;
+            }
+            // Finish each block while it is still in cache
+            for (int pos = 0; pos < samples; pos += MIXER_BLOCK_FRAMES) {
+                int count = std::min(samples - pos, MIXER_BLOCK_FRAMES);
+                produce(out + pos * channels, count);
+                finish(out + pos * channels, count);
+            }
+            return;
+        }
+        // Mix into scratch block then convert into output format and layout
+        int pos = 0;
+        while (pos < samples) {
+            int count = std::min(samples - pos, MIXER_BLOCK_FRAMES);
+            float* block = scratch.data();
+            produce(block, count);
+            finish(block, count);
+            write(block, info.ptr, frames, offset + pos, count);
+            pos += count;
+        }
+    }
+
+private:
+    bool resampling() const { return !coeffs.empty(); }
+
+    std::vector<SoundFont*> checked(py::list soundfonts) const {
+        std::vector<SoundFont*> fonts;
+        for (py::handle item : soundfonts) {
+            SoundFont* soundfont = item.cast<SoundFont*>();
+            int channels = soundfont->obj->outputmode == TSF_MONO ? 1 : 2;
+            if (channels != output_channels() || soundfont->obj->outputmode == TSF_STEREO_UNWEAVED) {
+                throw std::runtime_error("SoundFont output mode must be StereoInterleaved or Mono matching the mixer channels");
+            }
+            fonts.push_back(soundfont);
+        }
+        return fonts;
+    }
+
+    // Drop SoundFonts that finished fading, needs the GIL and the lock
+    void prune_fades() {
+        py::list refs;
+        std::vector<Fade> kept;
+        for (size_t i = 0; i < fades.size(); i++) {
+            if (fades[i].remaining > 0) {
+                kept.push_back(fades[i]);
+                refs.append(fade_refs[i]);
+            }
+        }
+        fades = kept;
+        fade_refs = refs;
+    }
+
+    // Add SoundFonts that are fading out with a linear ramp down to silence, including their
+    // effect sends when the buses are given
+    void mix_fades(float* out, int count, float* reverb_bus, float* chorus_bus) {
+        int channels = output_channels();
+        for (Fade& fade : fades) {
+            for (int pos = 0; pos < count && fade.remaining > 0; pos += MIXER_BLOCK_FRAMES) {
+                int frames = std::min(count - pos, MIXER_BLOCK_FRAMES);
+                std::fill_n(fade_reverb.data(), frames, 0.0f);
+                std::fill_n(fade_chorus.data(), frames, 0.0f);
+                {
+                    Lock lock(fade.soundfont->mutex);
+                    tsf_set_effect_sends(fade.soundfont->obj, reverb_bus ? fade_reverb.data() : nullptr, chorus_bus ? fade_chorus.data() : nullptr);
+                    tsf_render_float(fade.soundfont->obj, fade_block.data(), frames, 0);
+                    tsf_set_effect_sends(fade.soundfont->obj, nullptr, nullptr);
+                }
+                float step = 1.0f / fade.total;
+                float* block = out + pos * channels;
+                for (int i = 0; i < frames; i++) {
+                    float gain = std::max(fade.remaining - i, 0) * step;
+                    for (int c = 0; c < channels; c++) {
+                        block[i * channels + c] += fade_block[i * channels + c] * gain;
+                    }
+                    if (reverb_bus) {
+                        reverb_bus[pos + i] += fade_reverb[i] * gain;
+                    }
+                    if (chorus_bus) {
+                        chorus_bus[pos + i] += fade_chorus[i] * gain;
+                    }
+                }
+                fade.remaining = std::max(fade.remaining - frames, 0);
+            }
+        }
+    }
+
+    // Limit and meter the final mix
+    void finish(float* block, int count) {
+        if (limiter_enabled) {
+            limiter.process(block, count);
+        }
+        if (meters_enabled) {
+            meters.add(block, count, output_channels(), !limiter_enabled);
+        }
+    }
+
+    void produce(float* out, int count) {
+        if (resampling()) {
+            resample(out, count);
+        } else {
+            mix(out, count);
+        }
+    }
+
+    void mix(float* out, int count) {
+        if (reverb_enabled || chorus_enabled) {
+            mix_effects(out, count);
+            return;
+        }
+        if (soundfonts.empty()) {
+            std::fill_n(out, count * output_channels(), 0.0f);
+        }
+        bool mix = false;
+        for (SoundFont* soundfont : soundfonts) {
+            Lock lock(soundfont->mutex);
+            tsf_render_float(soundfont->obj, out, count, mix ? 1 : 0);
+            mix = true;
+        }
+        if (!fades.empty()) {
+            mix_fades(out, count, nullptr, nullptr);
+        }
+    }
+
+    // Same as mix but voices also add into the send buses, which are processed once per block
+    void mix_effects(float* out, int count) {
+        int channels = output_channels();
+        float* reverb_bus = reverb_enabled ? reverb_send.data() : nullptr;
+        float* chorus_bus = chorus_enabled ? chorus_send.data() : nullptr;
+        for (int pos = 0; pos < count; pos += MIXER_BLOCK_FRAMES) {
+            int frames = std::min(count - pos, MIXER_BLOCK_FRAMES);
+            float* block = out + pos * channels;
+            if (soundfonts.empty()) {
+                std::fill_n(block, frames * channels, 0.0f);
+            }
+            std::fill_n(reverb_send.data(), frames, 0.0f);
+            std::fill_n(chorus_send.data(), frames, 0.0f);
+            bool mix = false;
+            for (SoundFont* soundfont : soundfonts) {
+                Lock lock(soundfont->mutex);
+                tsf_set_effect_sends(soundfont->obj, reverb_bus, chorus_bus);
+                tsf_render_float(soundfont->obj, block, frames, mix ? 1 : 0);
+                tsf_set_effect_sends(soundfont->obj, nullptr, nullptr);
+                mix = true;
+            }
+            if (!fades.empty()) {
+                mix_fades(block, frames, reverb_bus, chorus_bus);
+            }
+            if (reverb_enabled) {
+                reverb.process(reverb_send.data(), block, frames, channels);
+            }
+            if (chorus_enabled) {
+                chorus.process(chorus_send.data(), block, frames, channels);
+            }
+        }
+    }
+
+    void resample(float* out, int count) {
+        int channels = output_channels();
+        for (int n = 0; n < count; n++) {
+            // Make sure all input samples under the filter kernel are mixed
+            int needed = history_pos + taps / 2 + 1;
+            if (static_cast<int>(history.size()) / channels < needed) {
+                // Drop input samples no longer under the kernel
+                int drop = history_pos - (taps / 2 - 1);
+                history.erase(history.begin(), history.begin() + drop * channels);
+                history_pos -= drop;
+                size_t used = history.size();
+                history.resize(used + MIXER_BLOCK_FRAMES * channels);
+                mix(history.data() + used, MIXER_BLOCK_FRAMES);
+            }
+            const float* kernel = coeffs.data() + phase * taps;
+            const float* in = history.data() + (history_pos - (taps / 2 - 1)) * channels;
+            for (int c = 0; c < channels; c++) {
+                float sum = 0.0f;
+                for (int j = 0; j < taps; j++) {
+                    sum += in[j * channels + c] * kernel[j];
+                }
+                out[n * channels + c] = sum;
+            }
+            phase += step;
+            history_pos += phase / phases;
+            phase %= phases;
+        }
+    }
+
+    float next_dither() {
+        // Triangular distribution from two uniform values, spanning +/- 1 LSB
+        unsigned int x = dither_state;
+        x ^= x << 13; x ^= x >> 17; x ^= x << 5;
+        float a = (x & 0xFFFF) * (1.0f / 65536.0f);
+        float b = (x >> 16) * (1.0f / 65536.0f);
+        dither_state = x;
+        return a - b;
+    }
+
+    short to_short(float v) {
+        if (dither) {
+            float scaled = v * 32767.5f + next_dither();
+            int vi = static_cast<int>(scaled < 0.0f ? scaled - 0.5f : scaled + 0.5f);
+            return static_cast<short>(vi < -32768 ? -32768 : (vi > 32767 ? 32767 : vi));
+        }
+        // Same conversion as tsf_render_short
+        return (v < -1.00004566f ? (short)-32768 : (v > 1.00001514f ? (short)32767 : (short)(v * 32767.5f)));
+    }
+
+    void write(const float* block, void* base, int frames, int offset, int count) {
+        int channels = output_channels();
+        bool planar = output_mode == TSF_STEREO_UNWEAVED;
+        if (sample_format == SampleFormat::Float32) {
+            // Only planar float output needs conversion
+            float* left = static_cast<float *>(base) + offset;
+            float* right = left + frames;
+            for (int i = 0; i < count; i++) {
+                left[i] = block[i * 2];
+                right[i] = block[i * 2 + 1];
+            }
+            return;
+        }
+        short* out = static_cast<short *>(base);
+        if (!planar) {
+            out += offset * channels;
+            for (int i = 0; i < count * channels; i++) {
+                out[i] = to_short(block[i]);
+            }
+            return;
+        }
+        short* left = out + offset;
+        short* right = left + frames;
+        for (int i = 0; i < count; i++) {
+            left[i] = to_short(block[i * 2]);
+            right[i] = to_short(block[i * 2 + 1]);
+        }
+    }
 };
 
 enum class MidiMessageType {
@@ -230,69 +1785,341 @@ enum class MidiMessageType {
 };
 
 
-py::list midi_load_memory(py::bytes bytes) {
+// Fill in payload fields of a single message
+static void midi_message_fields(py::dict &d, tml_message *pos) {
+    d["type"] = static_cast<MidiMessageType>(pos->type);
+    d["channel"] = static_cast<int>(pos->channel);
+    switch (pos->type) {
+        case TML_NOTE_OFF:
+            // Fallthrough
+        case TML_NOTE_ON:
+            d["key"] = static_cast<int>(pos->key);
+            d["velocity"] = static_cast<int>(pos->velocity);
+            break;
+        case TML_KEY_PRESSURE:
+            d["key"] = static_cast<int>(pos->key);
+            d["key_pressure"] = static_cast<int>(pos->key_pressure);
+            break;
+        case TML_CONTROL_CHANGE:
+            d["control"] = static_cast<int>(pos->control);
+            d["control_value"] = static_cast<int>(pos->control_value);
+            break;
+        case TML_PROGRAM_CHANGE:
+            d["program"] = static_cast<int>(pos->program);
+            break;
+        case TML_CHANNEL_PRESSURE:
+            d["channel_pressure"] = static_cast<int>(pos->channel_pressure);
+            break;
+        case TML_PITCH_BEND:
+            d["pitch_bend"] = static_cast<int>(pos->pitch_bend);
+            break;
+        case TML_SET_TEMPO:
+            // No payload, updates bpm field for this and subsequent events
+            break;
+        default:
+            // Unknown events don't get any payload
+            break;
+    }
+}
+
+// Count TinySoundFont allocations made by this thread until the scope is left, returns the
+// running count of this thread so callers can take the difference between enter and leave
+unsigned long long render_scope(bool enter) {
+    render_scope_depth += enter ? 1 : -1;
+    return render_allocations;
+}
+
+// Add float32 samples of src into dest starting at float offset, used to overlap-add audio
+// rendered separately
+void accumulate(py::buffer dest, py::buffer src, py::ssize_t offset) {
+    py::buffer_info out = dest.request(true);
+    py::buffer_info in = src.request();
+    py::ssize_t out_count = out.size * out.itemsize / sizeof(float);
+    py::ssize_t in_count = in.size * in.itemsize / sizeof(float);
+    if (offset < 0 || offset > out_count) {
+        throw std::runtime_error("Offset does not fit in buffer");
+    }
+    py::ssize_t count = std::min(in_count, out_count - offset);
+    py::gil_scoped_release release;
+    float* o = static_cast<float*>(out.ptr) + offset;
+    const float* i = static_cast<const float*>(in.ptr);
+    for (py::ssize_t n = 0; n < count; n++) {
+        o[n] += i[n];
+    }
+}
+
+// Largest absolute value of float32 samples, used to detect silence
+float peak(py::buffer src) {
+    py::buffer_info in = src.request();
+    py::ssize_t count = in.size * in.itemsize / sizeof(float);
+    py::gil_scoped_release release;
+    const float* i = static_cast<const float*>(in.ptr);
+    float result = 0.0f;
+    for (py::ssize_t n = 0; n < count; n++) {
+        result = std::max(result, std::fabs(i[n]));
+    }
+    return result;
+}
+
+py::list midi_load_memory(py::bytes bytes, bool ports) {
     py::buffer_info info(py::buffer(bytes).request());
     // Parse contents using TML
-    tml_message *parsed = tml_load_memory(info.ptr, info.size);
+    tml_message *parsed = tml_load_memory_ex(info.ptr, info.size, ports ? TML_LOAD_PORTS : 0, nullptr);
     if (!parsed) {
         throw std::runtime_error(std::string("Could not load MIDI data"));
     }
     py::list result{};
-    int count = tml_get_info(parsed, nullptr, nullptr, nullptr, nullptr, nullptr);
     tml_message *pos = parsed;
     double current_bpm = 10.0;
     while (pos) {
         double t = (pos->time) * 0.001f;
         py::dict d;
         d["t"] = t;
-        d["type"] = static_cast<MidiMessageType>(pos->type);
-        d["channel"] = static_cast<int>(pos->channel);
+        midi_message_fields(d, pos);
+        // Update bpm on tempo change
+        if (pos->type == TML_SET_TEMPO) {
+            double microseconds_per_beat = tml_get_tempo_value(pos);
+            current_bpm = 60e6 / microseconds_per_beat;
+        }
+        d["bpm"] = current_bpm;
+        pos = pos->next;
+        result.append(d);
+    }
+    tml_free(parsed);
+    return result;
+}
+
+py::tuple midi_load_memory_ticks(py::bytes bytes, bool ports) {
+    py::buffer_info info(py::buffer(bytes).request());
+    int division = 0;
+    tml_message *parsed = tml_load_memory_ex(info.ptr, info.size, TML_LOAD_TICKS | (ports ? TML_LOAD_PORTS : 0), &division);
+    if (!parsed) {
+        throw std::runtime_error(std::string("Could not load MIDI data"));
+    }
+    py::list result{};
+    for (tml_message *pos = parsed; pos; pos = pos->next) {
+        py::dict d;
+        d["tick"] = static_cast<unsigned int>(pos->time);
+        midi_message_fields(d, pos);
+        if (pos->type == TML_SET_TEMPO) {
+            d["tempo"] = tml_get_tempo_value(pos);
+        }
+        result.append(d);
+    }
+    tml_free(parsed);
+    return py::make_tuple(division, result);
+}
+
+// Summary of a single MIDI file from midi_analyze
+struct MidiSummary {
+    std::string error;
+    unsigned int duration_ms = 0;
+    int events = 0;
+    int notes = 0;
+    int tempo_changes = 0;
+    int peak_notes = 0;
+    int peak_voices = 0;
+    int peak_events_per_second = 0;
+    std::vector<int> channels;
+    // Encoded as (bank << 8 | program) << 1 | drums
+    std::vector<int> programs;
+};
+
+// Maximum number of channels for MIDI files with ports
+constexpr int ANALYZE_CHANNELS = 256;
+
+// Number of regions of a preset that sound for a key and velocity, each becomes one voice
+static int preset_region_layers(const tsf* f, int preset_index, int key, int velocity) {
+    int count = 0;
+    const struct tsf_preset* preset = &f->presets[preset_index];
+    for (int i = 0; i < preset->regionNum; i++) {
+        const struct tsf_region* region = &preset->regions[i];
+        if (key >= region->lokey && key <= region->hikey && velocity >= region->lovel && velocity <= region->hivel) {
+            count++;
+        }
+    }
+    return count;
+}
+
+// Same preset lookup with fallbacks as tsf_channel_set_presetnumber, returns -1 if nothing found
+static int resolve_preset_index(const tsf* f, int bank, int program, bool drums) {
+    int index = -1;
+    if (drums) {
+        index = tsf_get_presetindex(f, 128 | bank, program);
+        if (index == -1) index = tsf_get_presetindex(f, 128, program);
+        if (index == -1) index = tsf_get_presetindex(f, 128, 0);
+        if (index == -1) index = tsf_get_presetindex(f, bank, program);
+    } else {
+        index = tsf_get_presetindex(f, bank, program);
+    }
+    if (index == -1) index = tsf_get_presetindex(f, 0, program);
+    return index;
+}
+
+// Analyze one MIDI file without touching any Python objects, safe to call from worker threads.
+// Channels follow the same rules as playback through a Synth, the sustain pedal is ignored.
+static MidiSummary midi_analyze_file(const std::string& filename, const tsf* font, bool ports) {
+    MidiSummary summary;
+    std::ifstream file(filename, std::ios::binary);
+    if (!file) {
+        summary.error = "Could not open MIDI file";
+        return summary;
+    }
+    std::vector<char> data((std::istreambuf_iterator<char>(file)), std::istreambuf_iterator<char>());
+    tml_message* parsed = tml_load_memory_ex(data.data(), static_cast<int>(data.size()), ports ? TML_LOAD_PORTS : 0, nullptr);
+    if (!parsed) {
+        summary.error = "Could not load MIDI data";
+        return summary;
+    }
+    struct ChannelState {
+        unsigned short bank = 0;
+        int program = 0;
+        // Preset index selected by last program change, like tsf channels start with preset 0
+        int preset_index = 0;
+        bool used = false;
+    };
+    std::vector<ChannelState> channels(ANALYZE_CHANNELS);
+    // Voices started by each held note per channel and key, oldest first
+    std::unordered_map<int, std::deque<int>> held;
+    std::vector<int> programs;
+    std::vector<unsigned int> times;
+    int notes_held = 0;
+    int voices_held = 0;
+    auto release = [&](int slot) {
+        auto it = held.find(slot);
+        if (it == held.end() || it->second.empty()) return;
+        notes_held--;
+        voices_held -= it->second.front();
+        it->second.pop_front();
+    };
+    auto release_channel = [&](int chan) {
+        for (auto& item : held) {
+            if (item.first / 128 != chan) continue;
+            notes_held -= static_cast<int>(item.second.size());
+            for (int voices : item.second) voices_held -= voices;
+            item.second.clear();
+        }
+    };
+    for (tml_message* pos = parsed; pos; pos = pos->next) {
+        summary.events++;
+        summary.duration_ms = pos->time;
+        times.push_back(pos->time);
+        int chan = pos->channel;
+        ChannelState& c = channels[chan];
         switch (pos->type) {
-            case TML_NOTE_OFF:
-                // Fallthrough
             case TML_NOTE_ON:
-                d["key"] = static_cast<int>(pos->key);
-                d["velocity"] = static_cast<int>(pos->velocity);
-                break;
-            case TML_KEY_PRESSURE:
-                d["key"] = static_cast<int>(pos->key);
-                d["key_pressure"] = static_cast<int>(pos->key_pressure);
+                if (pos->velocity) {
+                    int voices = font ? preset_region_layers(font, c.preset_index, pos->key, pos->velocity) : 0;
+                    held[chan * 128 + pos->key].push_back(voices);
+                    c.used = true;
+                    summary.notes++;
+                    notes_held++;
+                    voices_held += voices;
+                    summary.peak_notes = std::max(summary.peak_notes, notes_held);
+                    summary.peak_voices = std::max(summary.peak_voices, voices_held);
+                    programs.push_back((((c.bank & 0x7FFF) << 8 | c.program) << 1) | (chan % 16 == 9));
+                    break;
+                }
+                // Fallthrough, velocity 0 is a note off
+            case TML_NOTE_OFF:
+                release(chan * 128 + pos->key);
                 break;
             case TML_CONTROL_CHANGE:
-                d["control"] = static_cast<int>(pos->control);
-                d["control_value"] = static_cast<int>(pos->control_value);
+                switch (pos->control) {
+                    case 0: c.bank = static_cast<unsigned short>(0x8000 | pos->control_value); break;
+                    case 32: c.bank = static_cast<unsigned short>((c.bank & 0x8000 ? ((c.bank & 0x7F) << 7) : 0) | pos->control_value); break;
+                    case 121: c.bank = 0; break;
+                    case 120: // Fallthrough
+                    case 123: release_channel(chan); break;
+                }
                 break;
             case TML_PROGRAM_CHANGE:
-                d["program"] = static_cast<int>(pos->program);
-                break;
-            case TML_CHANNEL_PRESSURE:
-                d["channel_pressure"] = static_cast<int>(pos->channel_pressure);
-                break;
-            case TML_PITCH_BEND:
-                d["pitch_bend"] = static_cast<int>(pos->pitch_bend);
+                c.program = pos->program;
+                if (font) {
+                    int index = resolve_preset_index(font, c.bank & 0x7FFF, c.program, chan % 16 == 9);
+                    if (index != -1) c.preset_index = index;
+                }
                 break;
             case TML_SET_TEMPO:
-                // No payload, updates bpm field for this and subsequent events
-                break;
-            default:
-                // Unknown events don't get any payload
+                summary.tempo_changes++;
                 break;
         }
-        // Update bpm on tempo change
-        if (pos->type == TML_SET_TEMPO) {
-            double microseconds_per_beat = tml_get_tempo_value(pos);
-            current_bpm = 60e6 / microseconds_per_beat;
+    }
+    tml_free(parsed);
+    // Largest number of events in any window of one second
+    for (size_t start = 0, end = 0; end < times.size(); end++) {
+        while (times[end] - times[start] >= 1000) start++;
+        summary.peak_events_per_second = std::max(summary.peak_events_per_second, static_cast<int>(end - start + 1));
+    }
+    for (int chan = 0; chan < ANALYZE_CHANNELS; chan++) {
+        if (channels[chan].used) summary.channels.push_back(chan);
+    }
+    std::sort(programs.begin(), programs.end());
+    programs.erase(std::unique(programs.begin(), programs.end()), programs.end());
+    summary.programs = programs;
+    return summary;
+}
+
+py::list midi_analyze(py::list paths, int workers, py::object soundfont, bool ports) {
+    std::vector<std::string> filenames;
+    for (auto path : paths) {
+        filenames.push_back(path.cast<std::string>());
+    }
+    const tsf* font = soundfont.is_none() ? nullptr : soundfont.cast<SoundFont&>().obj;
+    std::vector<MidiSummary> summaries(filenames.size());
+    {
+        py::gil_scoped_release release;
+        std::atomic<size_t> next{0};
+        auto work = [&]() {
+            for (size_t i = next++; i < filenames.size(); i = next++) {
+                summaries[i] = midi_analyze_file(filenames[i], font, ports);
+            }
+        };
+        workers = std::max(1, std::min(workers, static_cast<int>(filenames.size())));
+        std::vector<std::thread> threads;
+        for (int i = 1; i < workers; i++) {
+            threads.emplace_back(work);
         }
-        d["bpm"] = current_bpm;
-        pos = pos->next;
+        work();
+        for (auto& thread : threads) {
+            thread.join();
+        }
+    }
+    py::list result{};
+    for (size_t i = 0; i < summaries.size(); i++) {
+        const MidiSummary& s = summaries[i];
+        py::dict d;
+        d["path"] = filenames[i];
+        d["error"] = s.error.empty() ? py::object(py::none()) : py::object(py::str(s.error));
+        d["duration"] = s.duration_ms * 0.001;
+        d["events"] = s.events;
+        d["notes"] = s.notes;
+        d["tempo_changes"] = s.tempo_changes;
+        py::list channels{};
+        for (int chan : s.channels) channels.append(chan);
+        d["channels"] = channels;
+        py::list programs{};
+        for (int code : s.programs) programs.append(py::make_tuple(code >> 9, (code >> 1) & 0x7F, static_cast<bool>(code & 1)));
+        d["programs"] = programs;
+        d["peak_events_per_second"] = s.peak_events_per_second;
+        d["peak_notes"] = s.peak_notes;
+        d["peak_voices"] = font && s.error.empty() ? py::object(py::int_(s.peak_voices)) : py::object(py::none());
         result.append(d);
     }
-    tml_free(parsed);
     return result;
 }
 
+// Objects lock themselves, so the module is safe to use without the GIL on free-threaded Python
+#if PYBIND11_VERSION_HEX >= 0x020D0000
+PYBIND11_MODULE(_tinysoundfont, m, py::mod_gil_not_used()) {
+#else
 PYBIND11_MODULE(_tinysoundfont, m) {
+#endif
     m.doc() = "TinySoundFont module";
+    // Fill shared lookup tables before any thread can render
+    tsf_exp2_table_init();
+    tsf_sinc_table_init();
+    tsf_set_note_cache_clock(steady_seconds);
     py::enum_<enum TSFOutputMode>(m, "OutputMode")
         .value("StereoInterleaved", TSF_STEREO_INTERLEAVED)
         .value("StereoUnweaved", TSF_STEREO_UNWEAVED)
@@ -308,18 +2135,59 @@ PYBIND11_MODULE(_tinysoundfont, m) {
         .value("PITCH_BEND", MidiMessageType::PITCH_BEND, "Change pitch of existing notes")
         .value("SET_TEMPO", MidiMessageType::SET_TEMPO, "Change tempo of playback")
     ;
-    m.def("_midi_load_memory", &midi_load_memory, "Load MIDI file data in Standard MIDI File format");
+    py::enum_<enum TSFInterpolation>(m, "Interpolation")
+        .value("Nearest", TSF_INTERPOLATION_NONE, "Use nearest sample without interpolation")
+        .value("Linear", TSF_INTERPOLATION_LINEAR, "Linear interpolation between two samples")
+        .value("Cubic", TSF_INTERPOLATION_CUBIC, "4-point cubic Hermite interpolation")
+        .value("Sinc", TSF_INTERPOLATION_SINC, "8-point windowed sinc interpolation")
+    ;
+    py::enum_<SampleFormat>(m, "SampleFormat")
+        .value("Float32", SampleFormat::Float32, "32-bit floating point samples from -1.0 to 1.0")
+        .value("Int16", SampleFormat::Int16, "Signed 16-bit integer samples")
+    ;
+    m.def("_midi_load_memory", &midi_load_memory, "Load MIDI file data in Standard MIDI File format, with ports channels of port N are N*16+channel",
+        "data"_a, "ports"_a=false);
+    m.def("_midi_load_memory_ticks", &midi_load_memory_ticks, "Load MIDI file data in Standard MIDI File format with times in ticks, returns ticks per beat and messages",
+        "data"_a, "ports"_a=false);
+    m.def("_render_scope", &render_scope, "Enter or leave a scope where allocations on this thread are counted, returns count so far",
+        "enter"_a);
+    m.def("_accumulate", &accumulate, "Add float32 samples into a buffer at a float offset, samples past the end are dropped",
+        "dest"_a, "src"_a, "offset"_a=0);
+    m.def("_peak", &peak, "Largest absolute value of float32 samples in a buffer",
+        "src"_a);
+    m.def("_midi_analyze", &midi_analyze, "Summarize MIDI files in parallel, with optional SoundFont to estimate voices",
+        "paths"_a, "workers"_a=1, "soundfont"_a=py::none(), "ports"_a=false);
     py::class_<SoundFont>(m, "SoundFont")
-        // Need bytes constructor first, otherwise bytes would be converted and match string constructor
-        .def(py::init<py::bytes>(),
-            "Load a SoundFont from a memory buffer",
-            "bytes"_a)
+        // Need buffer constructor first, otherwise bytes would be converted and match string constructor
+        .def(py::init<py::buffer>(),
+            "Load a SoundFont from any contiguous buffer without copying it",
+            "buffer"_a)
         .def(py::init<const std::string &>(),
             "Load a SoundFont from a .sf2 filename",
             "filename"_a)
         .def(py::init<const SoundFont &>(),
             "Clone existing SoundFont. This allows loading a soundfont only once, but using it for multiple independent playbacks.",
             "other"_a)
+        .def_static("from_file", &SoundFont::from_file, py::return_value_policy::take_ownership,
+            "Load a SoundFont from a readable binary file object, reading in large chunks",
+            "file"_a)
+        .def_static("attach", &SoundFont::attach, py::return_value_policy::take_ownership,
+            "Create SoundFont using presets and samples exported with export_to in place without copying, keeping owner alive while in use",
+            "buffer"_a, "owner"_a=py::none())
+        .def("export_size", &SoundFont::export_size,
+            "Number of bytes needed by export_to")
+        .def("export_to", &SoundFont::export_to,
+            "Write presets and samples into a writable buffer, for example shared memory",
+            "buffer"_a)
+        .def(py::pickle(
+            [](const SoundFont& soundfont) { return py::make_tuple(soundfont.to_bytes()); },
+            [](py::tuple state) {
+                py::bytes data = state[0];
+                return std::unique_ptr<SoundFont>(SoundFont::attach(data, py::none()));
+            }))
+        .def("copy_state", &SoundFont::copy_state,
+            "Copy playing voices, channel parameters, and output settings from a clone of the same SoundFont",
+            "other"_a)
         .def("reset", &SoundFont::reset,
             "Stop all playing notes immediately and reset all channel parameters")
         .def("get_preset_index", &SoundFont::get_preset_index,
@@ -333,12 +2201,31 @@ PYBIND11_MODULE(_tinysoundfont, m) {
         .def("get_preset_name", py::overload_cast<int, int>(&SoundFont::get_preset_name),
             "Returns the name of a preset by bank and preset number",
             "bank"_a, "number"_a)
+        .def("presets", &SoundFont::presets,
+            "Returns a list of dictionaries describing every preset, with index, bank, preset number, name, number of regions, and size of sample data in bytes")
         .def("set_output", &SoundFont::set_output,
             "Setup the parameters for the voice render methods",
             "output_mode"_a, "samplerate"_a, "global_gain_db"_a)
         .def("set_volume", &SoundFont::set_volume,
             "Set the global gain as a volume factor (1.0 is normal 100%)",
             "global_gain"_a)
+        .def("set_interpolation", &SoundFont::set_interpolation,
+            "Set the interpolation method used when rendering voices",
+            "interpolation"_a)
+        .def("set_fast_math", &SoundFont::set_fast_math,
+            "Use table based pitch, gain and filter conversions and a fixed-point sample position when rendering voices",
+            "enable"_a)
+        .def("fast_math", &SoundFont::fast_math,
+            "Return whether the fast math render path is enabled")
+        .def("set_note_cache", &SoundFont::set_note_cache,
+            "Store rendered audio of repeated non-looping notes, using at most max_bytes of memory (0 disables)",
+            "max_bytes"_a)
+        .def("preallocate_channels", &SoundFont::preallocate_channels,
+            "Allocate state for channels 0 to channels - 1 so playing on them does not allocate",
+            "channels"_a)
+        .def("warm", &SoundFont::warm,
+            "Touch sample data used by presets so it is resident in memory, optionally locking it, returns dict with bytes and locked_bytes",
+            "indices"_a, "lock"_a=false)
         .def("set_max_voices", &SoundFont::set_max_voices,
             "Set the maximum number of voices to play simultaneously. Depending on the soundfond, one note can cause many new voices to be started, so don't keep this number too low or otherwise sounds may not play.",
             "max_voices"_a)
@@ -356,10 +2243,30 @@ PYBIND11_MODULE(_tinysoundfont, m) {
         .def("note_off", py::overload_cast<int, int, int>(&SoundFont::note_off),
             "Stop playing a note",
             "bank"_a, "number"_a, "key"_a)
+        .def("active_voice_count", &SoundFont::active_voice_count,
+            "Returns the number of active voices")
+        .def("voices_off", py::overload_cast<>(&SoundFont::voices_off),
+            "Stop all voices immediately without release, keeping channel state")
+        .def("voices_off", py::overload_cast<bool>(&SoundFont::voices_off),
+            "Stop voices of held notes, or voices that are releasing, immediately without release",
+            "held"_a)
+        .def("copy_channels", &SoundFont::copy_channels,
+            "Copy parameters of channels from another SoundFont, matching presets by bank and preset number",
+            "other"_a, "channels"_a)
+        .def("stats", &SoundFont::stats,
+            "Returns a dictionary of voice, load, and render statistics")
+        .def("reset_stats", &SoundFont::reset_stats,
+            "Reset voice and render statistics (peak voices restarts from the current active voices)")
         .def("render", &SoundFont::render,
             "Render output samples into a buffer",
             "buffer"_a,
             "mix"_a = false)
+        .def("render_channels", &SoundFont::render_channels,
+            "Render output samples of each channel into its own stem of a buffer of size (stems, samples, channels)",
+            "buffer"_a,
+            "offset"_a = 0,
+            "samples"_a = -1,
+            "mix"_a = false)
         .def("channel_set_preset_index", &SoundFont::channel_set_preset_index,
             "Set preset index for a channel",
             "channel"_a, "index"_a)
@@ -424,4 +2331,58 @@ PYBIND11_MODULE(_tinysoundfont, m) {
             "Get current tuning value set on the channel, in semitones, (0.0 is standard A440 tuning)",
             "channel"_a)
     ;
+    py::class_<Mixer>(m, "Mixer")
+        .def(py::init<enum TSFOutputMode, SampleFormat, bool>(),
+            "Create a mixer that renders SoundFonts together into a single output format",
+            "output_mode"_a, "sample_format"_a, "dither"_a = false)
+        .def(py::init<const Mixer &>(),
+            "Copy a mixer including effect and resampler state, the copy has no SoundFonts set",
+            "other"_a)
+        .def("copy_state", &Mixer::copy_state,
+            "Copy effect, resampler, and dither state from another mixer with the same output mode and sample format",
+            "other"_a)
+        .def("frame_size", &Mixer::frame_size,
+            "Returns the size in bytes of one output sample frame")
+        .def("set_soundfonts", &Mixer::set_soundfonts,
+            "Set the list of SoundFont objects to render and mix together",
+            "soundfonts"_a)
+        .def("crossfade", &Mixer::crossfade,
+            "Set the list of SoundFont objects to mix and fade out a removed SoundFont over a number of frames",
+            "soundfonts"_a, "old"_a, "frames"_a)
+        .def("fading", &Mixer::fading,
+            "Returns the number of removed SoundFonts still fading out")
+        .def("set_resampler", &Mixer::set_resampler,
+            "Resample mixed SoundFont output rendered at in_rate to out_rate with a polyphase filter (equal rates disable resampling)",
+            "in_rate"_a, "out_rate"_a, "taps"_a = 32)
+        .def("set_reverb", &Mixer::set_reverb,
+            "Enable or disable the shared reverb bus fed by MIDI controller 91 and set its parameters",
+            "enabled"_a, "room_size"_a = 0.5f, "damping"_a = 0.5f, "width"_a = 1.0f, "level"_a = 1.0f)
+        .def("set_chorus", &Mixer::set_chorus,
+            "Enable or disable the shared chorus bus fed by MIDI controller 93 and set its parameters",
+            "enabled"_a, "delay_ms"_a = 12.0f, "depth_ms"_a = 4.0f, "rate_hz"_a = 0.4f, "level"_a = 1.0f)
+        .def("clear_effects", &Mixer::clear_effects,
+            "Clear effect and limiter history, keeping the chorus LFO in step as if frames of silence were processed",
+            "frames"_a)
+        .def_readonly("limiter_enabled", &Mixer::limiter_enabled,
+            "Whether the limiter is enabled")
+        .def("set_limiter", &Mixer::set_limiter,
+            "Enable or disable the look-ahead peak limiter on the final mix and set its parameters",
+            "enabled"_a, "threshold_db"_a = -1.0f, "lookahead_ms"_a = 5.0f, "release_ms"_a = 50.0f)
+        .def("set_meters", &Mixer::set_meters,
+            "Enable or disable peak and RMS metering of the final mix",
+            "enabled"_a)
+        .def("meters", &Mixer::read_meters,
+            "Returns a dictionary of output levels since the last call, and peak hold and clip count since reset_meters")
+        .def("reset_meters", &Mixer::reset_meters,
+            "Reset peak hold and clip count")
+        .def("stats", &Mixer::stats,
+            "Returns a dictionary of render statistics")
+        .def("reset_stats", &Mixer::reset_stats,
+            "Reset render statistics")
+        .def("render", &Mixer::render,
+            "Render and mix output samples into a buffer, converting to the output format",
+            "buffer"_a,
+            "offset"_a = 0,
+            "samples"_a = -1)
+    ;
 }
@@ -124,6 +124,24 @@ TMLDEF tml_message* tml_load_filename(const char* filename);
 // Load a MIDI file from a block of memory
 TMLDEF tml_message* tml_load_memory(const void* buffer, int size);
 
+// Load a MIDI file from a block of memory but keep message times in ticks
+// instead of converting them to milliseconds. If division is not NULL it
+// will be set to the number of ticks per beat (quarter note).
+TMLDEF tml_message* tml_load_memory_ticks(const void* buffer, int size, int* division);
+
+// Options for tml_load_memory_ex
+enum TMLLoadFlags
+{
+	// Keep message times in ticks instead of milliseconds
+	TML_LOAD_TICKS = 1,
+	// Use MIDI port meta events to put channels of port N at N*16+channel
+	TML_LOAD_PORTS = 2
+};
+
+// Load a MIDI file from a block of memory with options from TMLLoadFlags.
+// If division is not NULL it will be set to the number of ticks per beat.
+TMLDEF tml_message* tml_load_memory_ex(const void* buffer, int size, int flags, int* division);
+
 // Get infos about this loaded MIDI file, returns the note count
 // NULL can be passed for any output value pointer if not needed.
 //   used_channels:   Will be set to how many channels play notes
@@ -252,11 +270,13 @@ struct tml_parser
 {
 	unsigned char *buf, *buf_end; 
 	int last_status, message_array_size, message_count;
+	int port, use_ports;
 };
 
 enum TMLSystemType
 {
 	TML_TEXT  = 0x01, TML_COPYRIGHT    = 0x02, TML_TRACK_NAME     = 0x03, TML_INST_NAME     = 0x04, TML_LYRIC           = 0x05, TML_MARKER       = 0x06, TML_CUE_POINT = 0x07,
+	TML_MIDI_PORT = 0x21,
 	TML_EOT   = 0x2f, TML_SMPTE_OFFSET = 0x54, TML_TIME_SIGNATURE = 0x58, TML_KEY_SIGNATURE = 0x59, TML_SEQUENCER_EVENT = 0x7f,
 	TML_SYSEX = 0xf0, TML_TIME_CODE    = 0xf1, TML_SONG_POSITION  = 0xf2, TML_SONG_SELECT   = 0xf3, TML_TUNE_REQUEST    = 0xf6, TML_EOX          = 0xf7, TML_SYNC      = 0xf8,
 	TML_TICK  = 0xf9, TML_START        = 0xfa, TML_CONTINUE       = 0xfb, TML_STOP          = 0xfc, TML_ACTIVE_SENSING  = 0xfe, TML_SYSTEM_RESET = 0xff
@@ -337,6 +357,12 @@ static int tml_parsemessage(tml_message** f, struct tml_parser* p)
 				((struct tml_tempomsg*)evt)->Tempo[2] = metadata[2];
 				break;
 
+			case TML_MIDI_PORT:
+				// Channels of this track belong to the port, up to 16 ports fit in the channel byte
+				if (buflen == 1 && metadata[0] < 16) p->port = metadata[0];
+				evt->type = 0;
+				break;
+
 			default:
 				evt->type = 0;
 		}
@@ -346,7 +372,7 @@ static int tml_parsemessage(tml_message** f, struct tml_parser* p)
 		int param; 
 		if ((param = tml_readbyte(p)) < 0) { TML_WARN("Unexpected end of file"); return -1; }
 		evt->key = (param & 0x7f);
-		evt->channel = (status & 0x0f);
+		evt->channel = (status & 0x0f) + (p->use_ports ? p->port * 16 : 0);
 		switch (evt->type = (status & 0xf0))
 		{
 			case TML_NOTE_OFF:
@@ -381,13 +407,14 @@ static int tml_parsemessage(tml_message** f, struct tml_parser* p)
 	return evt->type;
 }
 
-TMLDEF tml_message* tml_load(struct tml_stream* stream)
+static tml_message* tml_load_ex(struct tml_stream* stream, int flags, int* out_division)
 {
 	int num_tracks, division, trackbufsize = 0;
 	unsigned char midi_header[14], *trackbuf = TML_NULL;
 	struct tml_message* messages = TML_NULL;
 	struct tml_track *tracks, *t, *tracksEnd;
-	struct tml_parser p = { TML_NULL, TML_NULL, 0, 0, 0 };
+	struct tml_parser p = { TML_NULL, TML_NULL, 0, 0, 0, 0, 0 };
+	p.use_ports = ((flags & TML_LOAD_PORTS) != 0);
 
 	// Parse MIDI header
 	if (stream->read(stream->data, midi_header, 14) != 14) { TML_ERROR("Unexpected end of file"); return messages; }
@@ -397,6 +424,7 @@ TMLDEF tml_message* tml_load(struct tml_stream* stream)
 	num_tracks = (int)(midi_header[10] << 8) | midi_header[11];
 	division = (int)(midi_header[12] << 8) | midi_header[13]; //division is ticks per beat (quarter-note)
 	if (num_tracks <= 0 && division <= 0) { TML_ERROR("Doesn't look like a MIDI file: invalid track or division values"); return messages; }
+	if (out_division) *out_division = division;
 
 	// Allocate temporary tracks array for parsing
 	tracks = (struct tml_track*)TML_MALLOC(sizeof(struct tml_track) * num_tracks);
@@ -419,6 +447,7 @@ TMLDEF tml_message* tml_load(struct tml_stream* stream)
 		if (stream->read(stream->data, trackbuf, track_length) != track_length) { TML_WARN("Unexpected end of file"); break; }
 
 		t->Idx = p.message_count;
+		p.port = 0;
 		for (p.buf_end = (p.buf = trackbuf) + track_length; p.buf != p.buf_end;)
 		{
 			int type = tml_parsemessage(&messages, &p);
@@ -457,7 +486,7 @@ TMLDEF tml_message* tml_load(struct tml_stream* stream)
 					}
 					if (Msg->type)
 					{
-						Msg->time = msec;
+						Msg->time = ((flags & TML_LOAD_TICKS) ? ticks : (unsigned int)msec);
 						if (PrevMessage) { PrevMessage->next = Msg; PrevMessage = Msg; }
 						else { Swap = *Msg; *Msg = *messages; *messages = Swap; PrevMessage = messages; }
 					}
@@ -483,6 +512,26 @@ TMLDEF tml_message* tml_load(struct tml_stream* stream)
 	return messages;
 }
 
+TMLDEF tml_message* tml_load(struct tml_stream* stream)
+{
+	return tml_load_ex(stream, 0, TML_NULL);
+}
+
+TMLDEF tml_message* tml_load_memory_ticks(const void* buffer, int size, int* division)
+{
+	return tml_load_memory_ex(buffer, size, TML_LOAD_TICKS, division);
+}
+
+TMLDEF tml_message* tml_load_memory_ex(const void* buffer, int size, int flags, int* division)
+{
+	struct tml_stream stream = { TML_NULL, (int(*)(void*,void*,unsigned int))&tml_stream_memory_read };
+	struct tml_stream_memory f = { 0, 0, 0 };
+	f.buffer = (const char*)buffer;
+	f.total = size;
+	stream.data = &f;
+	return tml_load_ex(&stream, flags, division);
+}
+
 TMLDEF tml_message* tml_load_tsf_stream(struct tsf_stream* stream)
 {
 	return tml_load((struct tml_stream*)stream);
@@ -492,7 +541,7 @@ TMLDEF int tml_get_info(tml_message* Msg, int* out_used_channels, int* out_used_
 {
 	int used_programs = 0, used_channels = 0, total_notes = 0;
 	unsigned int time_first_note = 0xffffffff, time_length = 0;
-	unsigned char channels[16] = { 0 }, programs[128] = { 0 };
+	unsigned char channels[256] = { 0 }, programs[128] = { 0 }; //channels of all ports with TML_LOAD_PORTS
 	for (;Msg; Msg = Msg->next)
 	{
 		time_length = Msg->time;
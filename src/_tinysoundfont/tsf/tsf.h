@@ -95,9 +95,28 @@ TSFDEF tsf* tsf_load(struct tsf_stream* stream);
 // (This function isn't thread-safe without locking.)
 TSFDEF tsf* tsf_copy(tsf* f);
 
+// Copy all playing voices, channel state and output settings from another instance
+// that shares the same soundfont (the original or any tsf_copy of it).
+// Together with tsf_copy this clones the complete playback state of an instance.
+// Copied voices do not use the note cache of the source, so instances can render on separate threads.
+// (tsf_copy_state returns 0 if the soundfont is not shared or allocation failed, otherwise 1)
+TSFDEF int tsf_copy_state(tsf* f, tsf* source);
+
 // Free the memory related to this tsf instance
 TSFDEF void tsf_close(tsf* f);
 
+// Write the loaded preset tables and sample data into one block of memory without pointers,
+// so it can be placed in memory shared with other processes.
+// Returns the number of bytes written, or the number of bytes needed if buffer is NULL
+// (returns 0 if size is too small).
+TSFDEF size_t tsf_export(const tsf* f, void* buffer, size_t size);
+
+// Create a new instance from a block written by tsf_export, using its regions and sample
+// data in place without copying. The block must stay valid and unchanged until this
+// instance and all its copies are closed. The block must be aligned to 8 bytes.
+// (tsf_load_exported returns NULL if the block is invalid or was exported by a different build)
+TSFDEF tsf* tsf_load_exported(const void* buffer, size_t size);
+
 // Stop all playing notes immediately and reset all channel parameters
 TSFDEF void tsf_reset(tsf* f);
 
@@ -157,6 +176,34 @@ TSFDEF void tsf_set_output(tsf* f, enum TSFOutputMode outputmode, int samplerate
 //   global_gain: the desired volume where 1.0 is 100%
 TSFDEF void tsf_set_volume(tsf* f, float global_gain);
 
+// Supported sample interpolation methods used by the render methods
+enum TSFInterpolation
+{
+	// Use nearest sample without interpolation (cheapest, most aliasing)
+	TSF_INTERPOLATION_NONE,
+	// Linear interpolation between two samples (default)
+	TSF_INTERPOLATION_LINEAR,
+	// 4-point cubic Hermite interpolation
+	TSF_INTERPOLATION_CUBIC,
+	// 8-point windowed sinc interpolation (most expensive, least aliasing)
+	TSF_INTERPOLATION_SINC
+};
+
+// Set the interpolation method used when rendering voices
+TSFDEF void tsf_set_interpolation(tsf* f, enum TSFInterpolation interpolation);
+
+// Use table based approximations of pitch, gain and filter conversions and a
+// 32.32 fixed-point sample position when rendering voices (faster, slightly less accurate)
+// Default is off unless TSF_FASTMATH_DEFAULT is defined to 1
+TSFDEF void tsf_set_fast_math(tsf* f, int enable);
+
+// Set mono buffers that receive the reverb and chorus send signal of every voice
+// The send level of each voice comes from its channel (MIDI controllers 91 and 93)
+// Sends are added starting at the first sample of each buffer by every call of
+// tsf_render_float, so the buffers must hold at least as many samples as are rendered
+//   reverb, chorus: send buffers, or NULL to disable a send (default both disabled)
+TSFDEF void tsf_set_effect_sends(tsf* f, float* reverb, float* chorus);
+
 // Set the maximum number of voices to play simultaneously
 // Depending on the soundfond, one note can cause many new voices to be started,
 // so don't keep this number too low or otherwise sounds may not play.
@@ -186,6 +233,37 @@ TSFDEF void tsf_note_off_all(tsf* f);
 // Returns the number of active voices
 TSFDEF int tsf_active_voice_count(tsf* f);
 
+// Voice allocation statistics since loading or the last tsf_reset_stats
+//   peak: highest number of active voices right after starting a note
+//   stolen: voices killed in their release phase to make room for a new note
+//   dropped: voices not started because no voice was available
+TSFDEF void tsf_get_voice_stats(tsf* f, int* peak, unsigned int* stolen, unsigned int* dropped);
+TSFDEF void tsf_reset_stats(tsf* f);
+
+// Cache the resampled and filtered audio of voices that play a non-looping region without
+// pitch or filter modulation on a channel with neutral pitch wheel and tuning. Repeated notes
+// of such regions (typically drums and one-shots) then mix the stored audio instead of
+// resampling again. The first voice of a sound stores its output while it plays, so starting
+// a note never renders ahead. Output is the same as without the cache.
+//   max_bytes: memory budget, least recently used audio is dropped to stay under it (0 to disable)
+//   (tsf_set_note_cache returns 0 if allocation failed, otherwise 1)
+TSFDEF int tsf_set_note_cache(tsf* f, unsigned int max_bytes);
+
+// Note cache statistics since enabling it or the last tsf_reset_stats
+//   hits, misses: notes of cacheable regions that found or did not find stored audio
+//   evictions: stored audio dropped to stay within the memory budget
+//   samples: voice samples mixed from stored audio instead of being rendered
+//   bytes, entries: current memory use and number of stored sounds
+TSFDEF void tsf_get_note_cache_stats(tsf* f, unsigned int* hits, unsigned int* misses, unsigned int* evictions, unsigned long long* samples, unsigned int* bytes, int* entries);
+
+// Time spent rendering voice samples that were stored in the note cache, to estimate the time
+// saved by mixing stored samples. Blocks are only timed after a clock function returning
+// seconds is set with tsf_set_note_cache_clock (shared by all instances, NULL to stop timing).
+//   fill_samples: voice samples rendered and stored
+//   fill_seconds: time spent rendering them
+TSFDEF void tsf_set_note_cache_clock(double (*clock)(void));
+TSFDEF void tsf_get_note_cache_fill_stats(tsf* f, unsigned long long* fill_samples, double* fill_seconds);
+
 // Render output samples into a buffer
 // You can either render as signed 16-bit values (tsf_render_short) or
 // as 32-bit float values (tsf_render_float)
@@ -272,6 +350,16 @@ TSFDEF float tsf_channel_get_tuning(tsf* f, int channel);
 // Grace release time for quick voice off (avoid clicking noise)
 #define TSF_FASTRELEASETIME 0.01f
 
+// Whether newly loaded instances use the fast math render path (see tsf_set_fast_math)
+#ifndef TSF_FASTMATH_DEFAULT
+#define TSF_FASTMATH_DEFAULT 0
+#endif
+
+// Number of entries per octave in the table used by fast math exponential conversions
+#ifndef TSF_FASTMATH_EXP2TABLE
+#define TSF_FASTMATH_EXP2TABLE 1024
+#endif
+
 #if !defined(TSF_MALLOC) || !defined(TSF_FREE) || !defined(TSF_REALLOC)
 #  include <stdlib.h>
 #  define TSF_MALLOC  malloc
@@ -300,6 +388,11 @@ TSFDEF float tsf_channel_get_tuning(tsf* f, int channel);
 #  define TSF_LOG10   log10
 #  define TSF_SQRTF   sqrtf
 #endif
+#if !defined(TSF_SIN) || !defined(TSF_COS)
+#  include <math.h>
+#  define TSF_SIN     sin
+#  define TSF_COS     cos
+#endif
 
 #ifndef TSF_NO_STDIO
 #  include <stdio.h>
@@ -321,6 +414,7 @@ typedef unsigned char tsf_u8;
 typedef unsigned short tsf_u16;
 typedef signed short tsf_s16;
 typedef unsigned int tsf_u32;
+typedef unsigned long long tsf_u64;
 typedef char tsf_char20[20];
 
 #define TSF_FourCCEquals(value1, value2) (value1[0] == value2[0] && value1[1] == value2[1] && value1[2] == value2[2] && value1[3] == value2[3])
@@ -341,6 +435,17 @@ struct tsf
 	float outSampleRate;
 	float globalGainDB;
 	int* refCount;
+
+	unsigned int fontSampleCount;
+	enum TSFInterpolation interpolation;
+
+	int voicesPeak;
+	unsigned int voicesStolen, voicesDropped;
+	TSF_BOOL fastMath;
+	float *sendReverb, *sendChorus;
+	struct tsf_note_cache* noteCache;
+	// Regions and samples belong to a block from tsf_export and are not freed
+	TSF_BOOL externalData;
 };
 
 #ifndef TSF_NO_STDIO
@@ -446,6 +551,38 @@ struct tsf_preset
 	int regionNum;
 };
 
+struct tsf_note_cache_entry
+{
+	struct tsf_region* region;
+	double pitchRatio;
+	float sampleRate;
+	enum TSFInterpolation interpolation;
+	TSF_BOOL fastMath;
+	// References from the cache list and from playing voices, all of the same instance
+	int refCount;
+	// Samples stored so far out of capacity, complete once the end of the sample was stored
+	unsigned int length, capacity, lastUse;
+	TSF_BOOL complete;
+	// Set while a voice stores its output here, and voice state after the last stored sample
+	// so voices reaching the end of stored audio of an incomplete entry continue from there
+	TSF_BOOL filling;
+	double resumePosition, resumeZ1, resumeZ2;
+	float* samples;
+	struct tsf_note_cache_entry* next;
+};
+
+struct tsf_note_cache
+{
+	struct tsf_note_cache_entry* entries;
+	unsigned int maxBytes, bytes, useClock;
+	unsigned int hits, misses, evictions;
+	unsigned long long samples, fillSamples;
+	double fillSeconds;
+	int entryNum;
+};
+
+static double (*tsf_note_cache_clock)(void) = TSF_NULL;
+
 struct tsf_voice
 {
 	int playingPreset, playingKey, playingChannel;
@@ -457,12 +594,17 @@ struct tsf_voice
 	struct tsf_voice_envelope ampenv, modenv;
 	struct tsf_voice_lowpass lowpass;
 	struct tsf_voice_lfo modlfo, viblfo;
+	// Stored audio played instead of rendering, and read position in it
+	struct tsf_note_cache_entry* cache;
+	unsigned int cachePos;
+	// Stored audio this voice is adding its output to
+	struct tsf_note_cache_entry* fill;
 };
 
 struct tsf_channel
 {
 	unsigned short presetIndex, bank, pitchWheel, midiPan, midiVolume, midiExpression, midiRPN, midiData;
-	float panOffset, gainDB, pitchRange, tuning;
+	float panOffset, gainDB, pitchRange, tuning, reverbSend, chorusSend;
 };
 
 struct tsf_channels
@@ -478,6 +620,31 @@ static float tsf_cents2Hertz(float cents) { return 8.176f * TSF_POWF(2.0f, cents
 static float tsf_decibelsToGain(float db) { return (db > -100.f ? TSF_POWF(10.0f, db * 0.05f) : 0); }
 static float tsf_gainToDecibels(float gain) { return (gain <= .00001f ? -100.f : (float)(20.0 * TSF_LOG10(gain))); }
 
+// Table based 2^x with linear interpolation inside one octave, used by the fast math render path
+static float tsf_exp2_table[TSF_FASTMATH_EXP2TABLE + 1];
+static TSF_BOOL tsf_exp2_table_ready;
+static void tsf_exp2_table_init(void)
+{
+	int i;
+	if (tsf_exp2_table_ready) return;
+	for (i = 0; i <= TSF_FASTMATH_EXP2TABLE; i++) tsf_exp2_table[i] = (float)TSF_POW(2.0, (double)i / TSF_FASTMATH_EXP2TABLE);
+	tsf_exp2_table_ready = TSF_TRUE;
+}
+static float tsf_fast_exp2(float x)
+{
+	int octave, index; float pos, mantissa;
+	if (x < -126.0f) return 0;
+	if (x > 127.0f) x = 127.0f;
+	octave = (int)x; if (x < octave) octave--;
+	pos = (x - octave) * TSF_FASTMATH_EXP2TABLE;
+	index = (int)pos;
+	mantissa = tsf_exp2_table[index] + (tsf_exp2_table[index + 1] - tsf_exp2_table[index]) * (pos - index);
+	return ldexpf(mantissa, octave);
+}
+static double tsf_fast_timecents2Secsd(double timecents) { return tsf_fast_exp2((float)(timecents / 1200.0)); }
+static float tsf_fast_cents2Hertz(float cents) { return 8.176f * tsf_fast_exp2(cents / 1200.0f); }
+static float tsf_fast_decibelsToGain(float db) { return (db > -100.f ? tsf_fast_exp2(db * 0.166096404744f) : 0); }
+
 static TSF_BOOL tsf_riffchunk_read(struct tsf_riffchunk* parent, struct tsf_riffchunk* chunk, struct tsf_stream* stream)
 {
 	TSF_BOOL IsRiff, IsList;
@@ -997,6 +1164,32 @@ static int tsf_load_samples(void** pRawBuffer, float** pFloatBuffer, unsigned in
 	#endif
 }
 
+#ifdef STB_VORBIS_INCLUDE_STB_VORBIS_H
+// Returns 1 if no sample header is marked as compressed, so sample data is plain 16-bit PCM
+static int tsf_samples_are_pcm(const struct tsf_hydra *hydra)
+{
+	int i;
+	for (i = 0; i < hydra->shdrNum; i++)
+		if (hydra->shdrs[i].sampleType & 0x30) return 0;
+	return 1;
+}
+
+// Grow the raw PCM buffer and convert it to float from the end backwards, so the sample
+// data does not need a second buffer while converting (gives the same result as tsf_decode_sf3_samples)
+static int tsf_convert_samples_inplace(void** pRawBuffer, float** pFloatBuffer, unsigned int* pSmplCount)
+{
+	float *res, *out; const short *in;
+	tsf_u32 num = *pSmplCount / (tsf_u32)sizeof(short);
+	if (!(res = (float*)TSF_REALLOC(*pRawBuffer, num * sizeof(float)))) return 0;
+	*pRawBuffer = TSF_NULL;
+	for (out = res + num, in = (short*)res + num; out != res;)
+		*(--out) = (float)(*(--in) / 32767.0);
+	*pFloatBuffer = res;
+	*pSmplCount = num;
+	return 1;
+}
+#endif
+
 static int tsf_voice_envelope_release_samples(struct tsf_voice_envelope* e, float outSampleRate)
 {
 	return (int)((e->parameters.release <= 0 ? TSF_FASTRELEASETIME : e->parameters.release) * outSampleRate);
@@ -1167,9 +1360,52 @@ static void tsf_voice_lfo_process(struct tsf_voice_lfo* e, int blockSamples)
 	else if (e->level < -1.0f) { e->delta = -e->delta; e->level = -2.0f - e->level; }
 }
 
+static void tsf_note_cache_release(struct tsf_note_cache_entry* e)
+{
+	if (--e->refCount) return;
+	TSF_FREE(e->samples);
+	TSF_FREE(e);
+}
+
+static void tsf_note_cache_free(struct tsf_note_cache* c)
+{
+	struct tsf_note_cache_entry* e = c->entries;
+	while (e)
+	{
+		struct tsf_note_cache_entry* next = e->next;
+		tsf_note_cache_release(e);
+		e = next;
+	}
+	TSF_FREE(c);
+}
+
+// Stop adding the output of a voice to stored audio, what was stored so far stays usable
+static void tsf_note_cache_stop_fill(struct tsf_voice* v)
+{
+	if (!v->fill) return;
+	v->fill->filling = TSF_FALSE;
+	tsf_note_cache_release(v->fill);
+	v->fill = TSF_NULL;
+}
+
+// Add a block of mono output of the voice filling an entry, along with the state after it
+static void tsf_note_cache_store(struct tsf_voice* v, const float* block, int count, TSF_BOOL sampleEnd, double position, const struct tsf_voice_lowpass* lowpass)
+{
+	struct tsf_note_cache_entry* e = v->fill;
+	if (e->length + count > e->capacity) { tsf_note_cache_stop_fill(v); return; }
+	TSF_MEMCPY(e->samples + e->length, block, count * sizeof(float));
+	e->length += count;
+	e->resumePosition = position;
+	e->resumeZ1 = lowpass->z1;
+	e->resumeZ2 = lowpass->z2;
+	if (sampleEnd) { e->complete = TSF_TRUE; tsf_note_cache_stop_fill(v); }
+}
+
 static void tsf_voice_kill(struct tsf_voice* v)
 {
 	v->playingPreset = -1;
+	if (v->cache) { tsf_note_cache_release(v->cache); v->cache = TSF_NULL; }
+	tsf_note_cache_stop_fill(v);
 }
 
 static void tsf_voice_end(tsf* f, struct tsf_voice* v)
@@ -1212,6 +1448,126 @@ static void tsf_voice_calcpitchratio(struct tsf_voice* v, float pitchShift, floa
 	v->pitchOutputFactor = v->region->sample_rate / (tsf_timecents2Secsd(v->region->pitch_keycenter * 100.0) * outSampleRate);
 }
 
+#define TSF_SINC_TAPS 8
+#define TSF_SINC_PHASES 256
+static float tsf_sinc_table[(TSF_SINC_PHASES + 1) * TSF_SINC_TAPS];
+static TSF_BOOL tsf_sinc_table_ready;
+
+static void tsf_sinc_table_init(void)
+{
+	// Blackman windowed sinc kernel, one set of taps per fractional phase (plus one extra phase for interpolation)
+	int phase, tap;
+	if (tsf_sinc_table_ready) return;
+	for (phase = 0; phase <= TSF_SINC_PHASES; phase++)
+	{
+		double frac = (double)phase / TSF_SINC_PHASES, sum = 0;
+		for (tap = 0; tap < TSF_SINC_TAPS; tap++)
+		{
+			double x = tap - (TSF_SINC_TAPS / 2 - 1) - frac, w = (x + TSF_SINC_TAPS / 2) / TSF_SINC_TAPS;
+			double sinc = (x == 0 ? 1.0 : TSF_SIN(TSF_PI * x) / (TSF_PI * x));
+			double window = (w <= 0 || w >= 1 ? 0.0 : 0.42 - 0.5 * TSF_COS(2 * TSF_PI * w) + 0.08 * TSF_COS(4 * TSF_PI * w));
+			tsf_sinc_table[phase * TSF_SINC_TAPS + tap] = (float)(sinc * window);
+			sum += sinc * window;
+		}
+		// Normalize to unity gain at DC
+		for (tap = 0; tap < TSF_SINC_TAPS; tap++) tsf_sinc_table[phase * TSF_SINC_TAPS + tap] = (float)(tsf_sinc_table[phase * TSF_SINC_TAPS + tap] / sum);
+	}
+	tsf_sinc_table_ready = TSF_TRUE;
+}
+
+// Get sample index `pos + offset` wrapping around the loop (if looping) and clamping to the sample data
+static unsigned int tsf_voice_sample_index(tsf* f, unsigned int pos, int offset, TSF_BOOL isLooping, unsigned int loopStart, unsigned int loopEnd)
+{
+	long idx = (long)pos + offset;
+	if (isLooping) while (idx > (long)loopEnd) idx -= (long)(loopEnd - loopStart + 1);
+	if (idx < 0) idx = 0;
+	if (idx >= (long)f->fontSampleCount) idx = (long)f->fontSampleCount - 1;
+	return (unsigned int)idx;
+}
+
+// Interpolate one voice sample at integer position ipos plus fraction alpha
+static float tsf_voice_interpolate_sample(tsf* f, unsigned int ipos, float alpha, TSF_BOOL isLooping, unsigned int loopStart, unsigned int loopEnd)
+{
+	const float* input = f->fontSamples;
+	switch (f->interpolation)
+	{
+		case TSF_INTERPOLATION_NONE:
+			return input[alpha < 0.5f ? ipos : tsf_voice_sample_index(f, ipos, 1, isLooping, loopStart, loopEnd)];
+		case TSF_INTERPOLATION_LINEAR:
+		{
+			unsigned int nextPos = (ipos >= loopEnd && isLooping ? loopStart : ipos + 1);
+			return input[ipos] * (1.0f - alpha) + input[nextPos] * alpha;
+		}
+		case TSF_INTERPOLATION_CUBIC:
+		{
+			float xm1 = input[tsf_voice_sample_index(f, ipos, -1, isLooping, loopStart, loopEnd)], x0 = input[ipos];
+			float x1 = input[tsf_voice_sample_index(f, ipos, 1, isLooping, loopStart, loopEnd)];
+			float x2 = input[tsf_voice_sample_index(f, ipos, 2, isLooping, loopStart, loopEnd)];
+			float c1 = 0.5f * (x1 - xm1), c2 = xm1 - 2.5f * x0 + 2.0f * x1 - 0.5f * x2, c3 = 0.5f * (x2 - xm1) + 1.5f * (x0 - x1);
+			return ((c3 * alpha + c2) * alpha + c1) * alpha + x0;
+		}
+		default:
+		{
+			float phase = alpha * TSF_SINC_PHASES, mix, sum = 0;
+			int iphase = (int)phase, tap;
+			const float *k0 = &tsf_sinc_table[iphase * TSF_SINC_TAPS], *k1 = k0 + TSF_SINC_TAPS;
+			mix = phase - iphase;
+			for (tap = 0; tap < TSF_SINC_TAPS; tap++)
+			{
+				float x = input[tsf_voice_sample_index(f, ipos, tap - (TSF_SINC_TAPS / 2 - 1), isLooping, loopStart, loopEnd)];
+				sum += x * (k0[tap] + (k1[tap] - k0[tap]) * mix);
+			}
+			return sum;
+		}
+	}
+}
+
+// Interpolate a block of mono voice samples, returns the number of samples before the sample end was reached
+// Used for all non-linear methods, and for all methods with fast math where the position is 32.32 fixed-point
+static int tsf_voice_interpolate(tsf* f, float* block, int blockSamples, double* sourceSamplePosition, double pitchRatio, double sampleEnd, TSF_BOOL isLooping, unsigned int loopStart, unsigned int loopEnd)
+{
+	int n = 0;
+	if (f->fastMath)
+	{
+		const double scale = 4294967296.0;
+		tsf_u64 pos = (tsf_u64)(*sourceSamplePosition * scale), step = (tsf_u64)(pitchRatio * scale), end = (tsf_u64)(sampleEnd * scale);
+		tsf_u64 loopEndFixed = ((tsf_u64)loopEnd + 1) << 32, loopLength = ((tsf_u64)(loopEnd - loopStart) + 1) << 32;
+		if (f->interpolation == TSF_INTERPOLATION_LINEAR)
+		{
+			// Common case without the per sample dispatch
+			const float* input = f->fontSamples;
+			for (; n < blockSamples && pos < end; n++)
+			{
+				unsigned int ipos = (unsigned int)(pos >> 32), nextPos = (ipos >= loopEnd && isLooping ? loopStart : ipos + 1);
+				float alpha = (float)(pos & 0xFFFFFFFFu) * (1.0f / 4294967296.0f);
+				block[n] = input[ipos] + (input[nextPos] - input[ipos]) * alpha;
+				pos += step;
+				if (pos >= loopEndFixed && isLooping) pos -= loopLength;
+			}
+		}
+		for (; n < blockSamples && pos < end; n++)
+		{
+			block[n] = tsf_voice_interpolate_sample(f, (unsigned int)(pos >> 32), (float)(pos & 0xFFFFFFFFu) * (1.0f / 4294967296.0f), isLooping, loopStart, loopEnd);
+			pos += step;
+			if (pos >= loopEndFixed && isLooping) pos -= loopLength;
+		}
+		*sourceSamplePosition = pos / scale;
+	}
+	else
+	{
+		double pos = *sourceSamplePosition, loopEndDbl = (double)loopEnd + 1.0, loopLength = (loopEnd - loopStart + 1.0);
+		for (; n < blockSamples && pos < sampleEnd; n++)
+		{
+			unsigned int ipos = (unsigned int)pos;
+			block[n] = tsf_voice_interpolate_sample(f, ipos, (float)(pos - ipos), isLooping, loopStart, loopEnd);
+			pos += pitchRatio;
+			if (pos >= loopEndDbl && isLooping) pos -= loopLength;
+		}
+		*sourceSamplePosition = pos;
+	}
+	return n;
+}
+
 static void tsf_voice_render(tsf* f, struct tsf_voice* v, float* outputBuffer, int numSamples)
 {
 	struct tsf_region* region = v->region;
@@ -1239,6 +1595,20 @@ static void tsf_voice_render(tsf* f, struct tsf_voice* v, float* outputBuffer, i
 	TSF_BOOL dynamicGain = (region->modLfoToVolume != 0);
 	float noteGain = 0, tmpModLfoToVolume;
 
+	// Filter coefficients are only recomputed when the cutoff changes
+	TSF_BOOL fastMath = f->fastMath;
+	float lastFres = -1;
+
+	// Effect sends of the channel, voices with sends always use the block path
+	float reverbSend = 0, chorusSend = 0;
+	float *sendReverb = f->sendReverb, *sendChorus = f->sendChorus;
+	if (v->playingChannel >= 0 && f->channels && v->playingChannel < f->channels->channelNum)
+	{
+		struct tsf_channel* c = &f->channels->channels[v->playingChannel];
+		if (sendReverb) reverbSend = c->reverbSend;
+		if (sendChorus) chorusSend = c->chorusSend;
+	}
+
 	if (dynamicLowpass) tmpInitialFilterFc = (float)region->initialFilterFc, tmpModLfoToFilterFc = (float)region->modLfoToFilterFc, tmpModEnvToFilterFc = (float)region->modEnvToFilterFc;
 	else tmpInitialFilterFc = 0, tmpModLfoToFilterFc = 0, tmpModEnvToFilterFc = 0;
 
@@ -1257,16 +1627,28 @@ static void tsf_voice_render(tsf* f, struct tsf_voice* v, float* outputBuffer, i
 		if (dynamicLowpass)
 		{
 			float fres = tmpInitialFilterFc + v->modlfo.level * tmpModLfoToFilterFc + v->modenv.level * tmpModEnvToFilterFc;
-			float lowpassFc = (fres <= 13500 ? tsf_cents2Hertz(fres) / tmpSampleRate : 1.0f);
-			tmpLowpass.active = (lowpassFc < 0.499f);
-			if (tmpLowpass.active) tsf_voice_lowpass_setup(&tmpLowpass, lowpassFc);
+			// With fast math, round cutoff to whole cents so small modulations reuse the filter setup
+			if (fastMath) fres = (float)(int)(fres + (fres < 0 ? -0.5f : 0.5f));
+			if (fres != lastFres)
+			{
+				float lowpassFc = (fres <= 13500 ? (fastMath ? tsf_fast_cents2Hertz(fres) : tsf_cents2Hertz(fres)) / tmpSampleRate : 1.0f);
+				tmpLowpass.active = (lowpassFc < 0.499f);
+				if (tmpLowpass.active) tsf_voice_lowpass_setup(&tmpLowpass, lowpassFc);
+				lastFres = fres;
+			}
 		}
 
 		if (dynamicPitchRatio)
-			pitchRatio = tsf_timecents2Secsd(v->pitchInputTimecents + (v->modlfo.level * tmpModLfoToPitch + v->viblfo.level * tmpVibLfoToPitch + v->modenv.level * tmpModEnvToPitch)) * v->pitchOutputFactor;
+		{
+			double timecents = v->pitchInputTimecents + (v->modlfo.level * tmpModLfoToPitch + v->viblfo.level * tmpVibLfoToPitch + v->modenv.level * tmpModEnvToPitch);
+			pitchRatio = (fastMath ? tsf_fast_timecents2Secsd(timecents) : tsf_timecents2Secsd(timecents)) * v->pitchOutputFactor;
+		}
 
 		if (dynamicGain)
-			noteGain = tsf_decibelsToGain(v->noteGainDB + (v->modlfo.level * tmpModLfoToVolume));
+		{
+			float db = v->noteGainDB + (v->modlfo.level * tmpModLfoToVolume);
+			noteGain = (fastMath ? tsf_fast_decibelsToGain(db) : tsf_decibelsToGain(db));
+		}
 
 		gainMono = noteGain * v->ampenv.level;
 
@@ -1278,7 +1660,79 @@ static void tsf_voice_render(tsf* f, struct tsf_voice* v, float* outputBuffer, i
 		if (updateModLFO) tsf_voice_lfo_process(&v->modlfo, blockSamples);
 		if (updateVibLFO) tsf_voice_lfo_process(&v->viblfo, blockSamples);
 
-		switch (f->outputmode)
+		if (f->interpolation != TSF_INTERPOLATION_LINEAR || fastMath || reverbSend || chorusSend || v->cache || v->fill)
+		{
+			// Interpolate whole block of mono samples (or take them from the note cache), then filter and mix to output
+			float blockBuffer[TSF_RENDER_EFFECTSAMPLEBLOCK];
+			const float* block = blockBuffer;
+			int i, count;
+			if (v->cache)
+			{
+				struct tsf_note_cache_entry* e = v->cache;
+				unsigned int remaining = e->length - v->cachePos;
+				count = (remaining < (unsigned int)blockSamples ? (int)remaining : blockSamples);
+				block = e->samples + v->cachePos;
+				v->cachePos += count;
+				f->noteCache->samples += count;
+				if (count < blockSamples && !e->complete)
+				{
+					// Stored audio ends before the sample, continue rendering from the state stored
+					// with it, and keep storing if no other voice is
+					int rest;
+					TSF_MEMCPY(blockBuffer, block, count * sizeof(float));
+					block = blockBuffer;
+					tmpSourceSamplePosition = e->resumePosition;
+					tmpLowpass.z1 = e->resumeZ1;
+					tmpLowpass.z2 = e->resumeZ2;
+					v->cache = TSF_NULL;
+					if (!e->filling) { e->filling = TSF_TRUE; v->fill = e; }
+					else tsf_note_cache_release(e);
+					rest = tsf_voice_interpolate(f, blockBuffer + count, blockSamples - count, &tmpSourceSamplePosition, pitchRatio, tmpSampleEndDbl, isLooping, tmpLoopStart, tmpLoopEnd);
+					if (tmpLowpass.active) for (i = count; i < count + rest; i++) blockBuffer[i] = tsf_voice_lowpass_process(&tmpLowpass, blockBuffer[i]);
+					if (v->fill) tsf_note_cache_store(v, blockBuffer + count, rest, rest < blockSamples - count || tmpSourceSamplePosition >= tmpSampleEndDbl, tmpSourceSamplePosition, &tmpLowpass);
+					count += rest;
+				}
+			}
+			else
+			{
+				double start = (v->fill && tsf_note_cache_clock ? tsf_note_cache_clock() : 0);
+				count = tsf_voice_interpolate(f, blockBuffer, blockSamples, &tmpSourceSamplePosition, pitchRatio, tmpSampleEndDbl, isLooping, tmpLoopStart, tmpLoopEnd);
+				if (tmpLowpass.active) for (i = 0; i < count; i++) blockBuffer[i] = tsf_voice_lowpass_process(&tmpLowpass, blockBuffer[i]);
+				if (v->fill)
+				{
+					if (tsf_note_cache_clock)
+					{
+						f->noteCache->fillSeconds += tsf_note_cache_clock() - start;
+						f->noteCache->fillSamples += count;
+					}
+					tsf_note_cache_store(v, blockBuffer, count, count < blockSamples || tmpSourceSamplePosition >= tmpSampleEndDbl, tmpSourceSamplePosition, &tmpLowpass);
+				}
+			}
+			gainLeft = gainMono * v->panFactorLeft, gainRight = gainMono * v->panFactorRight;
+			switch (f->outputmode)
+			{
+				case TSF_STEREO_INTERLEAVED:
+					for (i = 0; i < count; i++) { *outL++ += block[i] * gainLeft; *outL++ += block[i] * gainRight; }
+					break;
+				case TSF_STEREO_UNWEAVED:
+					for (i = 0; i < count; i++) { *outL++ += block[i] * gainLeft; *outR++ += block[i] * gainRight; }
+					break;
+				case TSF_MONO:
+					for (i = 0; i < count; i++) *outL++ += block[i] * gainMono;
+					break;
+			}
+			if (reverbSend)
+			{
+				float gainSend = gainMono * reverbSend;
+				for (i = 0; i < count; i++) *sendReverb++ += block[i] * gainSend;
+			}
+			if (chorusSend)
+			{
+				float gainSend = gainMono * chorusSend;
+				for (i = 0; i < count; i++) *sendChorus++ += block[i] * gainSend;
+			}
+		}
+		else switch (f->outputmode)
 		{
 			case TSF_STEREO_INTERLEAVED:
 				gainLeft = gainMono * v->panFactorLeft, gainRight = gainMono * v->panFactorRight;
@@ -1342,7 +1796,7 @@ static void tsf_voice_render(tsf* f, struct tsf_voice* v, float* outputBuffer, i
 				break;
 		}
 
-		if (tmpSourceSamplePosition >= tmpSampleEndDbl || v->ampenv.segment == TSF_SEGMENT_DONE)
+		if ((v->cache ? v->cache->complete && v->cachePos >= v->cache->length : tmpSourceSamplePosition >= tmpSampleEndDbl) || v->ampenv.segment == TSF_SEGMENT_DONE)
 		{
 			tsf_voice_kill(v);
 			return;
@@ -1427,13 +1881,20 @@ TSFDEF tsf* tsf_load(struct tsf_stream* stream)
 	else
 	{
 		#ifdef STB_VORBIS_INCLUDE_STB_VORBIS_H
-		if (!floatBuffer && !tsf_decode_sf3_samples(rawBuffer, &floatBuffer, &smplCount, &hydra)) goto out_of_memory;
+		if (!floatBuffer && tsf_samples_are_pcm(&hydra))
+		{
+			if (!tsf_convert_samples_inplace(&rawBuffer, &floatBuffer, &smplCount)) goto out_of_memory;
+		}
+		else if (!floatBuffer && !tsf_decode_sf3_samples(rawBuffer, &floatBuffer, &smplCount, &hydra)) goto out_of_memory;
 		#endif
 		res = (tsf*)TSF_MALLOC(sizeof(tsf));
 		if (res) TSF_MEMSET(res, 0, sizeof(tsf));
 		if (!res || !tsf_load_presets(res, &hydra, smplCount)) goto out_of_memory;
 		res->outSampleRate = 44100.0f;
 		res->fontSamples = floatBuffer;
+		res->fontSampleCount = smplCount;
+		res->interpolation = TSF_INTERPOLATION_LINEAR;
+		tsf_set_fast_math(res, TSF_FASTMATH_DEFAULT);
 		floatBuffer = TSF_NULL; // don't free below
 	}
 	if (0)
@@ -1466,26 +1927,177 @@ TSFDEF tsf* tsf_copy(tsf* f)
 	res->voices = TSF_NULL;
 	res->voiceNum = 0;
 	res->channels = TSF_NULL;
+	res->voicesPeak = 0;
+	res->voicesStolen = res->voicesDropped = 0;
+	res->sendReverb = res->sendChorus = TSF_NULL;
+	res->noteCache = TSF_NULL;
 	(*res->refCount)++;
 	return res;
 }
 
+static unsigned int tsf_note_cache_render(tsf* f, struct tsf_voice* v, float* out, unsigned int maxSamples);
+
+TSFDEF int tsf_copy_state(tsf* f, tsf* source)
+{
+	struct tsf_voice *newVoices, *v, *vEnd;
+	struct tsf_channels* newChannels = TSF_NULL;
+	if (f == source) return 1;
+	if (f->presets != source->presets) return 0;
+	if (source->channels)
+	{
+		size_t channelsSize = sizeof(struct tsf_channels) + sizeof(struct tsf_channel) * (source->channels->channelNum - 1);
+		newChannels = (struct tsf_channels*)TSF_MALLOC(channelsSize);
+		if (!newChannels) return 0;
+		TSF_MEMCPY(newChannels, source->channels, channelsSize);
+	}
+	if (source->noteCache && !f->noteCache && !tsf_set_note_cache(f, source->noteCache->maxBytes)) { TSF_FREE(newChannels); return 0; }
+	for (v = f->voices, vEnd = v + f->voiceNum; v != vEnd; v++)
+	{
+		if (v->cache) { tsf_note_cache_release(v->cache); v->cache = TSF_NULL; }
+		tsf_note_cache_stop_fill(v);
+	}
+	newVoices = (struct tsf_voice*)TSF_REALLOC(f->voices, (source->voiceNum ? source->voiceNum : 1) * sizeof(struct tsf_voice));
+	if (!newVoices) { TSF_FREE(newChannels); return 0; }
+	if (source->voiceNum) TSF_MEMCPY(newVoices, source->voices, source->voiceNum * sizeof(struct tsf_voice));
+	// Only the source keeps storing
+	for (v = newVoices, vEnd = v + source->voiceNum; v != vEnd; v++) v->fill = TSF_NULL;
+	TSF_FREE(f->channels);
+	f->channels = newChannels;
+	f->voices = newVoices;
+	f->voiceNum = source->voiceNum;
+	f->maxVoiceNum = source->maxVoiceNum;
+	f->voicePlayIndex = source->voicePlayIndex;
+	f->outputmode = source->outputmode;
+	f->outSampleRate = source->outSampleRate;
+	f->globalGainDB = source->globalGainDB;
+	f->interpolation = source->interpolation;
+	f->fastMath = source->fastMath;
+	// Stored audio of the source is not shared, the copies may render on other threads while the
+	// source changes or frees it, so copied voices continue with normal rendering at the same position
+	for (v = f->voices, vEnd = v + f->voiceNum; v != vEnd; v++)
+	{
+		if (!v->cache) continue;
+		tsf_note_cache_render(f, v, TSF_NULL, v->cachePos);
+		v->cache = TSF_NULL;
+	}
+	return 1;
+}
+
 TSFDEF void tsf_close(tsf* f)
 {
 	if (!f) return;
 	if (!f->refCount || !--(*f->refCount))
 	{
 		struct tsf_preset *preset = f->presets, *presetEnd = preset + f->presetNum;
-		for (; preset != presetEnd; preset++) TSF_FREE(preset->regions);
+		if (!f->externalData)
+		{
+			for (; preset != presetEnd; preset++) TSF_FREE(preset->regions);
+			TSF_FREE(f->fontSamples);
+		}
 		TSF_FREE(f->presets);
-		TSF_FREE(f->fontSamples);
 		TSF_FREE(f->refCount);
 	}
+	if (f->voices)
+	{
+		struct tsf_voice *v = f->voices, *vEnd = v + f->voiceNum;
+		for (; v != vEnd; v++)
+		{
+			if (v->cache) tsf_note_cache_release(v->cache);
+			if (v->fill) tsf_note_cache_release(v->fill);
+		}
+	}
+	if (f->noteCache) tsf_note_cache_free(f->noteCache);
 	TSF_FREE(f->channels);
 	TSF_FREE(f->voices);
 	TSF_FREE(f);
 }
 
+struct tsf_export_header
+{
+	char magic[8];
+	unsigned int presetSize, regionSize, presetNum, regionNum, fontSampleCount;
+	unsigned int regionsOffset, samplesOffset;
+};
+
+static const char tsf_export_magic[8] = { 'T', 'S', 'F', 'E', 'X', 'P', '0', '1' };
+
+static size_t tsf_export_align(size_t n) { return (n + 15) & ~(size_t)15; }
+
+TSFDEF size_t tsf_export(const tsf* f, void* buffer, size_t size)
+{
+	struct tsf_export_header header;
+	struct tsf_preset* presets;
+	struct tsf_region* regions;
+	size_t total;
+	int i, regionNum = 0;
+	for (i = 0; i != f->presetNum; i++) regionNum += f->presets[i].regionNum;
+	TSF_MEMCPY(header.magic, tsf_export_magic, sizeof(header.magic));
+	header.presetSize = (unsigned int)sizeof(struct tsf_preset);
+	header.regionSize = (unsigned int)sizeof(struct tsf_region);
+	header.presetNum = (unsigned int)f->presetNum;
+	header.regionNum = (unsigned int)regionNum;
+	header.fontSampleCount = f->fontSampleCount;
+	header.regionsOffset = (unsigned int)tsf_export_align(sizeof(header) + f->presetNum * sizeof(struct tsf_preset));
+	header.samplesOffset = (unsigned int)tsf_export_align(header.regionsOffset + regionNum * sizeof(struct tsf_region));
+	total = header.samplesOffset + (size_t)f->fontSampleCount * sizeof(float);
+	if (!buffer) return total;
+	if (size < total) return 0;
+	TSF_MEMCPY(buffer, &header, sizeof(header));
+	presets = (struct tsf_preset*)((char*)buffer + sizeof(header));
+	regions = (struct tsf_region*)((char*)buffer + header.regionsOffset);
+	for (i = 0; i != f->presetNum; i++)
+	{
+		// Regions of all presets follow each other in order, pointers are set up when loading
+		presets[i] = f->presets[i];
+		presets[i].regions = TSF_NULL;
+		TSF_MEMCPY(regions, f->presets[i].regions, f->presets[i].regionNum * sizeof(struct tsf_region));
+		regions += f->presets[i].regionNum;
+	}
+	TSF_MEMCPY((char*)buffer + header.samplesOffset, f->fontSamples, (size_t)f->fontSampleCount * sizeof(float));
+	return total;
+}
+
+TSFDEF tsf* tsf_load_exported(const void* buffer, size_t size)
+{
+	struct tsf_export_header header;
+	struct tsf_region* regions;
+	tsf* res;
+	int i;
+	if (!buffer || ((size_t)buffer & 7) || size < sizeof(header)) return TSF_NULL;
+	TSF_MEMCPY(&header, buffer, sizeof(header));
+	for (i = 0; i != (int)sizeof(header.magic); i++) if (header.magic[i] != tsf_export_magic[i]) return TSF_NULL;
+	if (header.presetSize != sizeof(struct tsf_preset) || header.regionSize != sizeof(struct tsf_region)
+		|| header.regionsOffset < sizeof(header) + header.presetNum * sizeof(struct tsf_preset)
+		|| header.samplesOffset < header.regionsOffset + header.regionNum * sizeof(struct tsf_region)
+		|| size < header.samplesOffset + (size_t)header.fontSampleCount * sizeof(float)) return TSF_NULL;
+	res = (tsf*)TSF_MALLOC(sizeof(tsf));
+	if (!res) return TSF_NULL;
+	TSF_MEMSET(res, 0, sizeof(tsf));
+	res->presets = (struct tsf_preset*)TSF_MALLOC(header.presetNum * sizeof(struct tsf_preset) + 1);
+	if (!res->presets) { TSF_FREE(res); return TSF_NULL; }
+	TSF_MEMCPY(res->presets, (const char*)buffer + sizeof(header), header.presetNum * sizeof(struct tsf_preset));
+	res->presetNum = (int)header.presetNum;
+	regions = (struct tsf_region*)((const char*)buffer + header.regionsOffset);
+	for (i = 0; i != res->presetNum; i++)
+	{
+		if (regions + res->presets[i].regionNum > (struct tsf_region*)((const char*)buffer + header.regionsOffset) + header.regionNum)
+		{
+			TSF_FREE(res->presets);
+			TSF_FREE(res);
+			return TSF_NULL;
+		}
+		res->presets[i].regions = regions;
+		regions += res->presets[i].regionNum;
+	}
+	res->externalData = 1;
+	res->outSampleRate = 44100.0f;
+	res->fontSamples = (float*)((const char*)buffer + header.samplesOffset);
+	res->fontSampleCount = header.fontSampleCount;
+	res->interpolation = TSF_INTERPOLATION_LINEAR;
+	tsf_set_fast_math(res, TSF_FASTMATH_DEFAULT);
+	return res;
+}
+
 TSFDEF void tsf_reset(tsf* f)
 {
 	struct tsf_voice *v = f->voices, *vEnd = v + f->voiceNum;
@@ -1532,6 +2144,24 @@ TSFDEF void tsf_set_volume(tsf* f, float global_volume)
 	f->globalGainDB = (global_volume == 1.0f ? 0 : -tsf_gainToDecibels(1.0f / global_volume));
 }
 
+TSFDEF void tsf_set_interpolation(tsf* f, enum TSFInterpolation interpolation)
+{
+	if (interpolation == TSF_INTERPOLATION_SINC) tsf_sinc_table_init();
+	f->interpolation = interpolation;
+}
+
+TSFDEF void tsf_set_fast_math(tsf* f, int enable)
+{
+	if (enable) tsf_exp2_table_init();
+	f->fastMath = (enable ? TSF_TRUE : TSF_FALSE);
+}
+
+TSFDEF void tsf_set_effect_sends(tsf* f, float* reverb, float* chorus)
+{
+	f->sendReverb = reverb;
+	f->sendChorus = chorus;
+}
+
 TSFDEF int tsf_set_max_voices(tsf* f, int max_voices)
 {
 	int i = f->voiceNum;
@@ -1541,10 +2171,170 @@ TSFDEF int tsf_set_max_voices(tsf* f, int max_voices)
 	f->voices = newVoices;
 	f->voiceNum = f->maxVoiceNum = newVoiceNum;
 	for (; i < max_voices; i++)
+	{
 		f->voices[i].playingPreset = -1;
+		f->voices[i].cache = f->voices[i].fill = TSF_NULL;
+	}
 	return 1;
 }
 
+// Render the complete mono output of a voice from its start without envelope, as stored in the note cache
+// Blocks have the same size as in tsf_voice_render so fast math positions round the same way
+static unsigned int tsf_note_cache_render(tsf* f, struct tsf_voice* v, float* out, unsigned int maxSamples)
+{
+	double pos = v->region->offset, pitchRatio = tsf_timecents2Secsd(v->pitchInputTimecents) * v->pitchOutputFactor;
+	struct tsf_voice_lowpass lowpass = v->lowpass;
+	float block[TSF_RENDER_EFFECTSAMPLEBLOCK];
+	unsigned int done = 0;
+	lowpass.z1 = lowpass.z2 = 0;
+	while (done < maxSamples)
+	{
+		int i, blockSamples = (maxSamples - done > TSF_RENDER_EFFECTSAMPLEBLOCK ? TSF_RENDER_EFFECTSAMPLEBLOCK : (int)(maxSamples - done));
+		int count = tsf_voice_interpolate(f, block, blockSamples, &pos, pitchRatio, (double)v->region->end, TSF_FALSE, 0, 0);
+		if (lowpass.active) for (i = 0; i < count; i++) block[i] = tsf_voice_lowpass_process(&lowpass, block[i]);
+		if (out) TSF_MEMCPY(out + done, block, count * sizeof(float));
+		done += count;
+		if (count < blockSamples) break;
+	}
+	v->sourceSamplePosition = pos;
+	v->lowpass.z1 = lowpass.z1;
+	v->lowpass.z2 = lowpass.z2;
+	return done;
+}
+
+// Switch a voice playing from the note cache back to normal rendering at the same position,
+// and stop storing its output
+static void tsf_voice_uncache(tsf* f, struct tsf_voice* v)
+{
+	tsf_note_cache_stop_fill(v);
+	if (!v->cache) return;
+	tsf_note_cache_render(f, v, TSF_NULL, v->cachePos);
+	tsf_note_cache_release(v->cache);
+	v->cache = TSF_NULL;
+}
+
+static void tsf_note_cache_evict(struct tsf_note_cache* c, unsigned int neededBytes)
+{
+	while (c->entries && c->bytes + neededBytes > c->maxBytes)
+	{
+		struct tsf_note_cache_entry **e, **oldest = &c->entries, *victim;
+		for (e = &c->entries; *e; e = &(*e)->next)
+			if ((*e)->lastUse < (*oldest)->lastUse) oldest = e;
+		victim = *oldest;
+		*oldest = victim->next;
+		c->bytes -= victim->capacity * (unsigned int)sizeof(float);
+		c->entryNum--;
+		c->evictions++;
+		tsf_note_cache_release(victim);
+	}
+}
+
+// Find stored audio for a newly started voice to play from (sets cache), or create it for the
+// voice to store its output in while playing (sets fill), leaves both unset if neither is possible
+static void tsf_note_cache_lookup(tsf* f, struct tsf_voice* v)
+{
+	struct tsf_note_cache* c = f->noteCache;
+	struct tsf_region* region = v->region;
+	struct tsf_note_cache_entry* e;
+	double pitchRatio, maxLength;
+	float* samples;
+
+	if (v->loopStart < v->loopEnd) return;
+	if (region->modLfoToPitch || region->modEnvToPitch || region->vibLfoToPitch || region->modLfoToFilterFc || region->modEnvToFilterFc) return;
+	if (f->channels && v->playingChannel >= 0 && v->playingChannel < f->channels->channelNum)
+	{
+		struct tsf_channel* channel = &f->channels->channels[v->playingChannel];
+		if (channel->pitchWheel != 8192 || channel->tuning != 0) return;
+	}
+
+	pitchRatio = tsf_timecents2Secsd(v->pitchInputTimecents) * v->pitchOutputFactor;
+	for (e = c->entries; e; e = e->next)
+	{
+		if (e->region == region && e->pitchRatio == pitchRatio && e->sampleRate == f->outSampleRate && e->interpolation == f->interpolation && e->fastMath == f->fastMath)
+		{
+			e->lastUse = ++c->useClock;
+			if (e->length || e->complete) { c->hits++; v->cache = e; }
+			else if (e->filling) { c->misses++; return; }
+			else { c->misses++; e->filling = TSF_TRUE; v->fill = e; }
+			e->refCount++;
+			return;
+		}
+	}
+	c->misses++;
+
+	// Upper bound of output samples until the sample end is reached
+	maxLength = (region->end > region->offset ? (region->end - region->offset) / pitchRatio + 2.0 : 1.0);
+	if (maxLength * sizeof(float) > c->maxBytes) return;
+	samples = (float*)TSF_MALLOC((size_t)maxLength * sizeof(float));
+	if (!samples) return;
+	e = (struct tsf_note_cache_entry*)TSF_MALLOC(sizeof(struct tsf_note_cache_entry));
+	if (!e) { TSF_FREE(samples); return; }
+	e->capacity = (unsigned int)maxLength;
+	tsf_note_cache_evict(c, e->capacity * (unsigned int)sizeof(float));
+	e->region = region;
+	e->pitchRatio = pitchRatio;
+	e->sampleRate = f->outSampleRate;
+	e->interpolation = f->interpolation;
+	e->fastMath = f->fastMath;
+	e->samples = samples;
+	e->length = 0;
+	e->complete = TSF_FALSE;
+	e->filling = TSF_TRUE;
+	e->resumePosition = region->offset;
+	e->resumeZ1 = e->resumeZ2 = 0;
+	e->lastUse = ++c->useClock;
+	e->refCount = 2;
+	e->next = c->entries;
+	c->entries = e;
+	c->bytes += e->capacity * (unsigned int)sizeof(float);
+	c->entryNum++;
+	v->fill = e;
+}
+
+TSFDEF int tsf_set_note_cache(tsf* f, unsigned int max_bytes)
+{
+	if (!max_bytes)
+	{
+		struct tsf_voice *v = f->voices, *vEnd = v + f->voiceNum;
+		for (; v != vEnd; v++) if (v->playingPreset != -1) tsf_voice_uncache(f, v);
+		if (f->noteCache) tsf_note_cache_free(f->noteCache);
+		f->noteCache = TSF_NULL;
+		return 1;
+	}
+	if (!f->noteCache)
+	{
+		f->noteCache = (struct tsf_note_cache*)TSF_MALLOC(sizeof(struct tsf_note_cache));
+		if (!f->noteCache) return 0;
+		TSF_MEMSET(f->noteCache, 0, sizeof(struct tsf_note_cache));
+	}
+	f->noteCache->maxBytes = max_bytes;
+	tsf_note_cache_evict(f->noteCache, 0);
+	return 1;
+}
+
+TSFDEF void tsf_get_note_cache_stats(tsf* f, unsigned int* hits, unsigned int* misses, unsigned int* evictions, unsigned long long* samples, unsigned int* bytes, int* entries)
+{
+	struct tsf_note_cache empty, *c = f->noteCache;
+	if (!c) { TSF_MEMSET(&empty, 0, sizeof(empty)); c = &empty; }
+	if (hits) *hits = c->hits;
+	if (misses) *misses = c->misses;
+	if (evictions) *evictions = c->evictions;
+	if (samples) *samples = c->samples;
+	if (bytes) *bytes = c->bytes;
+	if (entries) *entries = c->entryNum;
+}
+
+TSFDEF void tsf_set_note_cache_clock(double (*clock)(void))
+{
+	tsf_note_cache_clock = clock;
+}
+
+TSFDEF void tsf_get_note_cache_fill_stats(tsf* f, unsigned long long* fill_samples, double* fill_seconds)
+{
+	if (fill_samples) *fill_samples = (f->noteCache ? f->noteCache->fillSamples : 0);
+	if (fill_seconds) *fill_seconds = (f->noteCache ? f->noteCache->fillSeconds : 0);
+}
+
 TSFDEF int tsf_note_on(tsf* f, int preset_index, int key, float vel)
 {
 	short midiVelocity = (short)(vel * 127);
@@ -1590,8 +2380,12 @@ TSFDEF int tsf_note_on(tsf* f, int preset_index, int key, float vel)
 					}
 				}
 				if (!voice)
+				{
+					f->voicesDropped++;
 					continue;
+				}
 				tsf_voice_kill(voice);
+				f->voicesStolen++;
 			}
 			else
 			{
@@ -1603,9 +2397,13 @@ TSFDEF int tsf_note_on(tsf* f, int preset_index, int key, float vel)
 				f->voices = newVoices;
 				voice = &f->voices[f->voiceNum - 4];
 				voice[1].playingPreset = voice[2].playingPreset = voice[3].playingPreset = -1;
+				voice[0].cache = voice[1].cache = voice[2].cache = voice[3].cache = TSF_NULL;
+				voice[0].fill = voice[1].fill = voice[2].fill = voice[3].fill = TSF_NULL;
 			}
 		}
 
+		if (voice->cache) { tsf_note_cache_release(voice->cache); voice->cache = TSF_NULL; }
+		tsf_note_cache_stop_fill(voice);
 		voice->region = region;
 		voice->playingPreset = preset_index;
 		voice->playingKey = key;
@@ -1647,6 +2445,14 @@ TSFDEF int tsf_note_on(tsf* f, int preset_index, int key, float vel)
 		// Setup LFO filters.
 		tsf_voice_lfo_setup(&voice->modlfo, region->delayModLFO, region->freqModLFO, f->outSampleRate);
 		tsf_voice_lfo_setup(&voice->viblfo, region->delayVibLFO, region->freqVibLFO, f->outSampleRate);
+
+		voice->cachePos = 0;
+		if (f->noteCache) tsf_note_cache_lookup(f, voice);
+	}
+	if (f->voiceNum > f->voicesPeak)
+	{
+		int active = tsf_active_voice_count(f);
+		if (active > f->voicesPeak) f->voicesPeak = active;
 	}
 	return 1;
 }
@@ -1701,6 +2507,20 @@ TSFDEF int tsf_active_voice_count(tsf* f)
 	return count;
 }
 
+TSFDEF void tsf_get_voice_stats(tsf* f, int* peak, unsigned int* stolen, unsigned int* dropped)
+{
+	if (peak) *peak = f->voicesPeak;
+	if (stolen) *stolen = f->voicesStolen;
+	if (dropped) *dropped = f->voicesDropped;
+}
+
+TSFDEF void tsf_reset_stats(tsf* f)
+{
+	f->voicesPeak = tsf_active_voice_count(f);
+	f->voicesStolen = f->voicesDropped = 0;
+	if (f->noteCache) f->noteCache->hits = f->noteCache->misses = f->noteCache->evictions = 0, f->noteCache->samples = f->noteCache->fillSamples = 0, f->noteCache->fillSeconds = 0;
+}
+
 TSFDEF void tsf_render_short(tsf* f, short* buffer, int samples, int flag_mixing)
 {
 	float outputSamples[TSF_RENDER_SHORTBUFFERBLOCK];
@@ -1782,6 +2602,7 @@ static struct tsf_channel* tsf_channel_init(tsf* f, int channel)
 		c->gainDB = 0.0f;
 		c->pitchRange = 2.0f;
 		c->tuning = 0.0f;
+		c->reverbSend = c->chorusSend = 0.0f;
 	}
 	return &f->channels->channels[channel];
 }
@@ -1792,7 +2613,10 @@ static void tsf_channel_applypitch(tsf* f, int channel, struct tsf_channel* c)
 	float pitchShift = (c->pitchWheel == 8192 ? c->tuning : ((c->pitchWheel / 16383.0f * c->pitchRange * 2.0f) - c->pitchRange + c->tuning));
 	for (v = f->voices, vEnd = v + f->voiceNum; v != vEnd; v++)
 		if (v->playingPreset != -1 && v->playingChannel == channel)
+		{
+			tsf_voice_uncache(f, v);
 			tsf_voice_calcpitchratio(v, pitchShift, f->outSampleRate);
+		}
 }
 
 TSFDEF int tsf_channel_set_presetindex(tsf* f, int channel, int preset_index)
@@ -1969,6 +2793,8 @@ TSFDEF int tsf_channel_midi_control(tsf* f, int channel, int controller, int con
 		case 100 /*RPN_LSB*/         : c->midiRPN = (unsigned short)(((c->midiRPN == 0xFFFF ? 0 : c->midiRPN) & 0x3F80) |  control_value); return 1;
 		case  98 /*NRPN_LSB*/        : c->midiRPN = 0xFFFF; return 1;
 		case  99 /*NRPN_MSB*/        : c->midiRPN = 0xFFFF; return 1;
+		case  91 /*REVERB_SEND*/     : c->reverbSend = control_value / 127.0f; return 1;
+		case  93 /*CHORUS_SEND*/     : c->chorusSend = control_value / 127.0f; return 1;
 		case 120 /*ALL_SOUND_OFF*/   : tsf_channel_sounds_off_all(f, channel); return 1;
 		case 123 /*ALL_NOTES_OFF*/   : tsf_channel_note_off_all(f, channel);   return 1;
 		case 121 /*ALL_CTRL_OFF*/    :
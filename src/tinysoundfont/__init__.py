@@ -1,7 +1,18 @@
 from .synth import (
     Synth as Synth,
+    SynthState as SynthState,
+    SharedSoundFont as SharedSoundFont,
     SoundFontException as SoundFontException,
 )
+from .sink import (
+    Sink as Sink,
+    PyAudioSink as PyAudioSink,
+    FileSink as FileSink,
+    VirtualSink as VirtualSink,
+)
 from .sequencer import (
     Sequencer as Sequencer,
 )
+from .subset import (
+    subset as subset,
+)
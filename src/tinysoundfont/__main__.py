@@ -1,9 +1,12 @@
 import argparse
+import concurrent.futures
+import json
 import sys
 import time
 
 from .synth import Synth
 from .sequencer import Sequencer
+from .subset import subset
 
 
 def endswith_any(value, suffixes):
@@ -21,6 +24,17 @@ def is_soundfont(filename):
     return endswith_any(filename, [".sf2", ".SF2", ".sf3", ".SF3", ".sfo", ".SFO"])
 
 
+def soundfont_info(filename):
+    # Load SoundFont and return dictionary of preset information, or error
+    try:
+        synth = Synth()
+        sfid = synth.sfload(filename)
+        presets = sorted(synth.sfpresets(sfid), key=lambda p: (p["bank"], p["preset"]))
+        return {"filename": filename, "presets": presets}
+    except Exception as err:
+        return {"filename": filename, "error": str(err)}
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="tinysoundfont-tool",
@@ -33,7 +47,23 @@ def main():
     )
     parser.add_argument("--test", action="store_true", help="Play test SoundFont file")
     parser.add_argument(
-        "--info", action="store_true", help="Show information about SoundFont file"
+        "--info", action="store_true", help="Show information about SoundFont files"
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Output --info as JSON with all preset details",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of SoundFont files to process in parallel for --info",
+    )
+    parser.add_argument(
+        "--subset",
+        metavar="OUTPUT",
+        help="Write SoundFont with only the presets used by the MIDI files and --bank/--preset pairs to OUTPUT",
     )
     parser.add_argument(
         "--key",
@@ -82,7 +112,7 @@ def main():
         "--buffer_size",
         type=int,
         default=2048,
-        help="Set pyaudio buffer size for playback, or 0 for automatic sizing for lowest latency",
+        help="Set buffer size for playback, or 0 for automatic sizing for lowest latency",
     )
     parser.add_argument(
         "filename",
@@ -92,27 +122,45 @@ def main():
     args = parser.parse_args()
 
     midi_filename = None
+    midi_filenames = []
     soundfont_filename = None
+    soundfont_filenames = []
     for filename in args.filename:
         if is_midi(filename):
             midi_filename = filename
+            midi_filenames.append(filename)
         if is_soundfont(filename):
             soundfont_filename = filename
+            soundfont_filenames.append(filename)
 
     if args.info:
         if soundfont_filename is None:
-            print(
-                "No SoundFont file found, a SoundFont file is required for MIDI playback"
-            )
+            print("No SoundFont file found, a SoundFont file is required for --info")
             return -2
-        print(f"Info for SoundFont {soundfont_filename}")
-        synth = Synth(samplerate=args.samplerate, gain=args.gain)
-        sfid = synth.sfload(soundfont_filename)
-        for bank in range(127):
-            for preset in range(127):
-                name = synth.sfpreset_name(sfid, bank, preset)
-                if name is not None:
-                    print(f"{bank} - {preset} : {name}")
+        if args.jobs > 1 and len(soundfont_filenames) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                infos = list(executor.map(soundfont_info, soundfont_filenames))
+        else:
+            infos = [soundfont_info(filename) for filename in soundfont_filenames]
+        if args.json:
+            print(json.dumps(infos, indent=2))
+        else:
+            for info in infos:
+                print(f"Info for SoundFont {info['filename']}")
+                if "error" in info:
+                    print(f"Error: {info['error']}")
+                    continue
+                for preset in info["presets"]:
+                    print(f"{preset['bank']} - {preset['preset']} : {preset['name']}")
+        return -4 if any("error" in info for info in infos) else 0
+
+    if args.subset:
+        if soundfont_filename is None:
+            print("No SoundFont file found, a SoundFont file is required for --subset")
+            return -2
+        presets = list(zip(args.bank or [0] * len(args.preset), args.preset))
+        data = subset(soundfont_filename, midi_files=midi_filenames, presets=presets, output=args.subset)
+        print(f"Wrote {args.subset} ({len(data)} bytes) from SoundFont {soundfont_filename}")
         return 0
 
     if args.test:
@@ -181,4 +229,5 @@ def main():
     return -3
 
 
-sys.exit(main())
+if __name__ == "__main__":
+    sys.exit(main())
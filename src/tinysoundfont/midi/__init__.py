@@ -7,10 +7,12 @@
 # This code is licensed under the MIT license (see LICENSE for details)
 #
 
-from .._tinysoundfont import _midi_load_memory
+from .._tinysoundfont import _midi_analyze, _midi_load_memory, _midi_load_memory_ticks
 from .._tinysoundfont import MidiMessageType
-from dataclasses import dataclass
-from typing import Callable, Dict, List, Optional
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+import os
 
 
 @dataclass
@@ -81,6 +83,8 @@ class Event:
     :param t: Time when event is scheduled, in absolute seconds
     :param channel: Channel to use for event
     :param persistent: Whether to keep event in event list after playing
+    :param tick: Position of event in MIDI ticks, or `None` if event is only
+        scheduled in seconds
 
     """
 
@@ -88,6 +92,94 @@ class Event:
     t: float = 0
     channel: int = 0
     persistent: bool = True
+    tick: Optional[int] = None
+
+
+@dataclass
+class TempoMap:
+    """
+    Tempo changes of a song, for converting between MIDI ticks and seconds.
+
+    :param division: Number of ticks per beat (quarter note)
+    :param ticks: Tick position of each tempo change in increasing order,
+        starting with 0
+    :param tempos: Tempo starting at each tick position, in microseconds per
+        beat
+    """
+
+    division: int = 480
+    ticks: List[int] = field(default_factory=lambda: [0])
+    tempos: List[int] = field(default_factory=lambda: [500000])
+
+    def __post_init__(self):
+        # Time in seconds at the start of each tempo change
+        self._starts = [0.0]
+        for i in range(1, len(self.ticks)):
+            self._starts.append(
+                self._starts[-1] + (self.ticks[i] - self.ticks[i - 1]) * self.seconds_per_tick(i - 1)
+            )
+
+    def seconds_per_tick(self, index: int) -> float:
+        """Get length of a single tick for one tempo.
+
+        :param index: Index of tempo change in `ticks` and `tempos`
+        :returns: Seconds per tick
+        """
+        return self.tempos[index] / (1e6 * self.division)
+
+    def seconds(self, tick: float) -> float:
+        """Convert tick position to time.
+
+        :param tick: Position in ticks
+        :returns: Time in seconds from start of song
+        """
+        index = max(bisect_right(self.ticks, tick) - 1, 0)
+        return self._starts[index] + (tick - self.ticks[index]) * self.seconds_per_tick(index)
+
+    def tick(self, seconds: float) -> float:
+        """Convert time to tick position.
+
+        :param seconds: Time in seconds from start of song
+        :returns: Position in ticks, possibly fractional
+        """
+        index = max(bisect_right(self._starts, seconds) - 1, 0)
+        return self.ticks[index] + (seconds - self._starts[index]) / self.seconds_per_tick(index)
+
+
+@dataclass
+class Summary:
+    """
+    Summary of a MIDI file from :meth:`analyze`.
+
+    :param path: Filename of MIDI file
+    :param error: Description of why the file could not be analyzed, or
+        `None` if successful (all other fields are empty on error)
+    :param duration: Time of last event, in seconds
+    :param events: Number of MIDI events
+    :param notes: Number of notes played
+    :param tempo_changes: Number of tempo change events
+    :param channels: Channels that played notes, in increasing order
+    :param programs: Tuples of `(bank, program, is_drums)` of channels when
+        playing notes, in increasing order
+    :param peak_events_per_second: Largest number of events within any one
+        second
+    :param peak_notes: Largest number of notes held down at the same time
+    :param peak_voices: Largest number of voices needed by held notes with
+        the layering of regions in the SoundFont, or `None` if analyzed
+        without a SoundFont
+    """
+
+    path: str
+    error: Optional[str] = None
+    duration: float = 0.0
+    events: int = 0
+    notes: int = 0
+    tempo_changes: int = 0
+    channels: List[int] = field(default_factory=list)
+    programs: List[Tuple[int, int, bool]] = field(default_factory=list)
+    peak_events_per_second: int = 0
+    peak_notes: int = 0
+    peak_voices: Optional[int] = None
 
 
 def event_from_dict(item: Dict) -> Optional[Event]:
@@ -145,6 +237,7 @@ def load_memory(
     delta_time: float = 0,
     filter: Optional[Callable[[List[Event]], Optional[bool]]] = None,
     persistent: bool = True,
+    ports: bool = False,
 ) -> List[Event]:
     """Load MIDI data and turn into list of events.
 
@@ -155,6 +248,8 @@ def load_memory(
     :param persistent: Whether to keep events in queue after playing,
         allowing for seeking back to start or arbitrary positions after
         playback has started (default True)
+    :param ports: Whether to use MIDI port meta events of tracks, putting
+        channel N of port P at channel P * 16 + N (default False)
 
     :returns: List of events from MIDI data, possibly filtered
 
@@ -165,7 +260,7 @@ def load_memory(
 
     See also: :meth:`load`
     """
-    midi_data = _midi_load_memory(data)
+    midi_data = _midi_load_memory(data, ports)
     events = []
     for item in midi_data:
         event = event_from_dict(item)
@@ -184,11 +279,68 @@ def load_memory(
     return events
 
 
+def load_memory_ticks(
+    data: bytes,
+    filter: Optional[Callable[[List[Event]], Optional[bool]]] = None,
+    persistent: bool = True,
+    ports: bool = False,
+) -> Tuple[List[Event], TempoMap]:
+    """Load MIDI data and turn into list of events with tick positions.
+
+    :param data: MIDI data, in Standard MIDI format
+    :param filter: Optional function that takes in individual events and can
+        modify them or filter them out (default None)
+    :param persistent: Whether to keep events in queue after playing,
+        allowing for seeking back to start or arbitrary positions after
+        playback has started (default True)
+    :param ports: Whether to use MIDI port meta events of tracks, putting
+        channel N of port P at channel P * 16 + N (default False)
+
+    :returns: List of events from MIDI data, possibly filtered, and the tempo
+        map of the song
+
+    Events have `tick` set to their position in MIDI ticks, and `t` set to the
+    time in seconds at the tempo of the song. Passing the events and tempo map
+    to :meth:`Sequencer.add` schedules events by tick, so playback rate can
+    be changed with :meth:`Sequencer.set_rate` without reloading. Filters
+    that move events in time should change `tick`.
+
+    See also: :meth:`load_ticks`, :meth:`load_memory`
+    """
+    division, midi_data = _midi_load_memory_ticks(data, ports)
+    ticks = [0]
+    tempos = [500000]
+    for item in midi_data:
+        if item["type"] == MidiMessageType.SET_TEMPO:
+            if item["tick"] == ticks[-1]:
+                tempos[-1] = item["tempo"]
+            else:
+                ticks.append(item["tick"])
+                tempos.append(item["tempo"])
+    tempo_map = TempoMap(division, ticks, tempos)
+    events = []
+    for item in midi_data:
+        item["t"] = tempo_map.seconds(item["tick"])
+        event = event_from_dict(item)
+        if event is None:
+            continue
+        event.tick = item["tick"]
+        event.persistent = persistent
+        if filter is not None:
+            if filter(event):
+                event = None
+        if event is not None:
+            events.append(event)
+    events.sort(key=lambda e: e.tick)
+    return events, tempo_map
+
+
 def load(
     filename: str,
     delta_time: float = 0,
     filter: Optional[Callable[[List[Event]], Optional[bool]]] = None,
     persistent: bool = True,
+    ports: bool = False,
 ) -> List[Event]:
     """Load MIDI file and turn into list of events.
 
@@ -200,6 +352,8 @@ def load(
     :param persistent: Whether to keep events in queue after playing,
         allowing for seeking back to start or arbitrary positions after
         playback has started (default True)
+    :param ports: Whether to use MIDI port meta events of tracks, putting
+        channel N of port P at channel P * 16 + N (default False)
 
     :returns: List of events from MIDI data, possibly filtered
 
@@ -213,5 +367,73 @@ def load(
     with open(filename, "rb") as fin:
         data = fin.read()
         return load_memory(
-            data, delta_time=delta_time, filter=filter, persistent=persistent
+            data, delta_time=delta_time, filter=filter, persistent=persistent, ports=ports
         )
+
+
+def load_ticks(
+    filename: str,
+    filter: Optional[Callable[[List[Event]], Optional[bool]]] = None,
+    persistent: bool = True,
+    ports: bool = False,
+) -> Tuple[List[Event], TempoMap]:
+    """Load MIDI file and turn into list of events with tick positions.
+
+    :param filename: Filename to load MIDI data from, in Standard MIDI
+        format
+    :param filter: Optional function that takes in individual events and can
+        modify them or filter them out (default None)
+    :param persistent: Whether to keep events in queue after playing,
+        allowing for seeking back to start or arbitrary positions after
+        playback has started (default True)
+    :param ports: Whether to use MIDI port meta events of tracks, putting
+        channel N of port P at channel P * 16 + N (default False)
+
+    :returns: List of events from MIDI data, possibly filtered, and the tempo
+        map of the song
+
+    See also: :meth:`load_memory_ticks`
+    """
+    with open(filename, "rb") as fin:
+        data = fin.read()
+        return load_memory_ticks(data, filter=filter, persistent=persistent, ports=ports)
+
+
+def analyze(
+    paths: List[str],
+    workers: Optional[int] = None,
+    synth=None,
+    sfid: int = 0,
+    ports: bool = False,
+) -> List[Summary]:
+    """Summarize MIDI files without loading their events into Python.
+
+    :param paths: Filenames of MIDI files, in Standard MIDI format
+    :param workers: Number of threads analyzing files in parallel, or `None`
+        to use all available cores (default None)
+    :param synth: Optional :class:`Synth` with a loaded SoundFont used to
+        estimate voice demand (default None)
+    :param sfid: SoundFont id in `synth` to use (default 0)
+    :param ports: Whether to use MIDI port meta events of tracks, putting
+        channel N of port P at channel P * 16 + N (default False)
+
+    :returns: One summary per file in the same order as `paths`
+    :raises SoundFontException: If `synth` is given and `sfid` is not a
+        loaded SoundFont
+
+    Files that cannot be read or parsed do not raise, their summary has the
+    `error` field set instead.
+
+    Notes, programs and voices follow the same rules as playing the file
+    with a :class:`Sequencer`: bank select, program changes with MIDI drums
+    on channel 9 of each port and the preset fallbacks of the SoundFont.
+    Each held note needs one voice per matching region of its preset. Voices
+    of released notes still fading out are not counted, so leave some
+    headroom when choosing `max_voices` for :meth:`Synth.sfload`. The
+    sustain pedal is ignored like in playback.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    soundfont = None if synth is None else synth._get_soundfont(sfid)
+    summaries = _midi_analyze([os.fspath(path) for path in paths], workers, soundfont, ports)
+    return [Summary(**item) for item in summaries]
@@ -8,11 +8,13 @@
 #
 
 from collections import deque
-from typing import List
-from .synth import Synth
+from typing import Dict, List, Optional
+from .synth import Synth, SoundFontException, CHANNELS_PER_PORT
 from .midi import (
     load,
+    load_ticks,
     Event,
+    TempoMap,
     NoteOn,
     NoteOff,
     ControlChange,
@@ -26,42 +28,126 @@ class Sequencer:
     """A Sequencer schedules MIDI events over time.
 
     :param synth: The synthesizer object to send events to.
+    :param sample_clock: If `True`, keep time as an integer count of output
+        samples instead of floating point seconds (default `False`)
+    :param channel_map: Dictionary mapping event channels to synth channels
+        (default no mapping), see :meth:`set_channel_map`
+    :param port: MIDI port to play events on, channel N of events plays on
+        channel `port` * 16 + N of the synth unless it is in `channel_map`
+        (default 0)
+
+    With `sample_clock` event times are converted once to sample positions
+    when events are added, rounding to the nearest sample. Events then
+    trigger exactly on their sample and time does not drift over long
+    sessions.
+
+    Events added with a :class:`midi.TempoMap` are scheduled by MIDI tick
+    instead of by time, and the playback rate can be changed at any time with
+    :meth:`set_rate`.
+
+    Any number of sequencers can play into the same :class:`Synth`, for
+    example a backing track together with short loops. Each sequencer keeps
+    its own time, pause state, loop, and channel map.
     """
 
-    def __init__(self, synth: Synth):
+    def __init__(
+        self,
+        synth: Synth,
+        sample_clock: bool = False,
+        channel_map: Optional[Dict[int, int]] = None,
+        port: int = 0,
+    ):
         self.synth = synth
+        self.sample_clock = sample_clock
         self.time = 0.0
         self.paused = False
         # events stores events for future, ordered by time
-        # Queue has items (t, event)
         self.events = deque()
+        # With sample clock, position in samples and sample position of each event
+        self.frame = 0
+        self.frames = deque()
+        # With tempo map, position in ticks and playback rate
+        self.tempo_map = None
+        self.tick = 0.0
+        self.rate = 1.0
+        self._anchor()
+        # Optional (start, end) times in seconds to repeat
+        self.loop = None
+        # Maps channels of events to channels of the synth
+        self.channel_map = dict(channel_map or {})
+        self.port = port
+        # Synth channels events have been sent to, for turning off notes
+        self._channels = set()
+        # Index of first event not yet played, earlier events are persistent
+        self._cursor = 0
+        # Position in current block of Synth output, and position and
+        # distance in samples of next event
+        self._pos = 0
+        self._next = None
+        self._next_wait = 0
+        # Cleared to drop note ons while moving without rendering audio, the
+        # dropped notes are kept in _held by channel and key until their note off
+        self._note_ons = True
+        self._held = {}
+        synth._sequencers.append(self)
+
+    def detach(self):
+        """Stop sending events to the synth.
+
+        The sequencer keeps its events and position. Notes that are still
+        playing are not turned off, call :meth:`notes_off` first if needed.
+        """
+        self.synth._sequencers.remove(self)
 
-        def seq_callback(delta: float) -> float:
-            if self.paused:
-                return delta
-            return self.process(delta)
-
-        self.synth.callback = seq_callback
-
-    def add(self, events: List[Event]):
+    def add(self, events: List[Event], tempo_map: Optional[TempoMap] = None):
         """Add a list of MIDI events to queue for sending.
 
         :param events: List of MIDI events
+        :param tempo_map: Tempo map for scheduling events by `tick` instead of
+            by time, or `None` (default `None`)
+
+        :raises: `SoundFontException` if events with and without tempo map
+            are mixed
 
         See :func:`midi.load` for generating the list of events.
+        See :func:`midi.load_ticks` for generating events with tempo map.
         See :func:`midi_load` for directly loading a MIDI file.
+
+        A sequencer has a single tempo map for all events. Adding events with
+        a new tempo map replaces the previous tempo map.
         """
+        if tempo_map is None and self.tempo_map is not None:
+            raise SoundFontException("Events must be added with tempo map")
+        if tempo_map is not None:
+            if self.tempo_map is None and len(self.events) > 0:
+                raise SoundFontException("Events must be added without tempo map")
+            if any(event.tick is None for event in events):
+                raise SoundFontException("Events added with tempo map must have tick")
+            self.tempo_map = tempo_map
+            self.tick = tempo_map.tick(self.time)
+            self._anchor()
         self.events.extend(events)
+        if self.sample_clock and self.tempo_map is None:
+            samplerate = self.synth.samplerate
+            self.frames.extend(round(event.t * samplerate) for event in events)
 
-    def midi_load(self, filename: str, **kwargs):
+    def midi_load(self, filename: str, tempo_map: bool = False, **kwargs):
         """Load MIDI file and schedule events.
 
         :param filename: Filename to load MIDI data from, in Standard MIDI
             format
+        :param tempo_map: If `True`, schedule events by MIDI tick using the
+            tempo map of the file, so :meth:`set_rate` can be used (default
+            `False`)
 
-        Any additional keyword arguments are passed to :func:`midi.load`. See
-        :func:`midi.load` for documentation on additional keyword arguments.
+        Any additional keyword arguments are passed to :func:`midi.load`, or
+        :func:`midi.load_ticks` with `tempo_map`. See :func:`midi.load` for
+        documentation on additional keyword arguments.
         """
+        if tempo_map:
+            events, song_tempo_map = load_ticks(filename, **kwargs)
+            self.add(events, tempo_map=song_tempo_map)
+            return
         events = load(filename, **kwargs)
         self.add(events)
 
@@ -92,9 +178,67 @@ class Sequencer:
         still have time to decay. If needed you can call :meth:`sounds_off`
         to stop all playing sounds immediately.
         """
-        self.time = time
+        self._seek(time)
         self.notes_off()
 
+    def set_loop(self, start: float = 0.0, end: Optional[float] = None):
+        """Repeat part of the events forever.
+
+        :param start: Time in seconds to jump back to (default 0.0)
+        :param end: Time in seconds where playback jumps back to `start`, or
+            `None` to stop looping (default `None`)
+
+        :raises: `SoundFontException` if `end` is not after `start`
+
+        Looping works like calling :meth:`set_time` at the exact end time, so
+        playing notes are turned off and only `persistent` events play again.
+        """
+        if end is None:
+            self.loop = None
+            return
+        if not end > start:
+            raise SoundFontException("Loop end must be after loop start")
+        self.loop = (start, end)
+
+    def set_channel_map(self, channel_map: Dict[int, int]):
+        """Send events for some channels to different channels of the synth.
+
+        :param channel_map: Dictionary mapping event channels to synth
+            channels, channels not in the dictionary are not changed
+
+        For example `{0: 4}` plays events for channel 0 on channel 4 of the
+        synth. This keeps several sequencers playing into one :class:`Synth`
+        from interfering with each other.
+        """
+        self.channel_map = dict(channel_map)
+
+    def set_rate(self, rate: float):
+        """Set playback rate of events scheduled with a tempo map.
+
+        :param rate: Speed relative to the tempo of the song, for example
+            `2.0` plays twice as fast (must be positive)
+
+        :raises: `SoundFontException` if the sequencer has no tempo map or the
+            rate is not positive
+
+        Changing the rate takes effect immediately and does not depend on the
+        number of scheduled events. Note that :meth:`get_time` still reports
+        the position in the song at its own tempo.
+        """
+        if self.tempo_map is None:
+            raise SoundFontException("Playback rate needs events added with tempo map")
+        if not rate > 0:
+            raise SoundFontException("Playback rate must be positive")
+        self._anchor()
+        self.rate = rate
+
+    def get_rate(self) -> float:
+        """Get playback rate of events scheduled with a tempo map.
+
+        :return: Speed relative to the tempo of the song
+        """
+        return self.rate
+
     def pause(self, pause_value=True):
         """Pause or unpause playback.
 
@@ -110,12 +254,20 @@ class Sequencer:
         self.notes_off()
 
     def notes_off(self):
-        """Send NOTE_OFF for all currently playing notes of the Synth object."""
-        self.synth.notes_off()
+        """Send NOTE_OFF for all currently playing notes of the Synth object.
+
+        Only channels that this sequencer has sent events to are affected.
+        """
+        for chan in sorted(self._channels):
+            self.synth.notes_off(chan)
 
     def sounds_off(self):
-        """Turn off all sounds of the Synth object."""
-        self.synth.sounds_off()
+        """Turn off all sounds of the Synth object.
+
+        Only channels that this sequencer has sent events to are affected.
+        """
+        for chan in sorted(self._channels):
+            self.synth.sounds_off(chan)
 
     def is_empty(self) -> bool:
         """Return True if there are no more events scheduled.
@@ -129,6 +281,12 @@ class Sequencer:
         """
         if len(self.events) == 0:
             return True
+        if self.loop is not None:
+            return False
+        if self.tempo_map is not None:
+            return self.events[-1].tick < self.tick
+        if self.sample_clock:
+            return self.frames[-1] < self.frame
         if self.events[-1].t < self.time:
             return True
         return False
@@ -142,17 +300,26 @@ class Sequencer:
 
         """
         synth = self.synth
-        channel = event.channel
+        channel = self.channel_map.get(event.channel, event.channel + self.port * CHANNELS_PER_PORT)
+        self._channels.add(channel)
         match event.action:
             case NoteOn(key, velocity):
-                synth.noteon(channel, key, velocity)
+                if self._note_ons or velocity == 0:
+                    synth.noteon(channel, key, velocity)
+                if not self._note_ons:
+                    if velocity:
+                        self._held[channel, key] = velocity
+                    else:
+                        self._held.pop((channel, key), None)
             case NoteOff(key):
                 synth.noteoff(channel, key)
+                self._held.pop((channel, key), None)
             case ControlChange(control, control_value):
                 synth.control_change(channel, control, control_value)
             case ProgramChange(program):
                 try:
-                    synth.program_change(channel, program, channel == DRUM_CHANNEL)
+                    # Each port has its own drum channel
+                    synth.program_change(channel, program, event.channel % CHANNELS_PER_PORT == DRUM_CHANNEL)
                 except Exception:
                     pass
             case PitchBend(pitch_bend):
@@ -164,37 +331,190 @@ class Sequencer:
         :param delta: How many seconds to advance time
         :returns: How far time was actually advanced (may be smaller than `delta`)
 
+        The :class:`Synth` calls the sequencer while generating output, so
+        this method is only needed to drive a sequencer by hand. Loops are
+        ignored.
         """
-        # Need to send all events with time <= self.time if not persistent
-        # Persistent events only send events with time == self.time
-        pos = 0
-        while pos < len(self.events):
-            # Look at earliest event in deque
-            event = self.events[pos]
-            t = event.t
-            if t < self.time:
-                # Send it if it is not persistent, otherwise ignore
-                if event.persistent:
-                    pos += 1
-                else:
-                    self.events.popleft()
-                    self.send(event)
-                continue
-            if t > self.time:
-                # Don't do event yet or remove it, need to wait until its time
-                true_delta = min(delta, t - self.time)
-                self.time += true_delta
-                return true_delta
-            # If we get here, t == self.time
-            # Head event needs to be done
+        key = self._send_due()
+        if key is not None and not self.sample_clock:
+            wait = (key - self.time) / self.rate
+            if wait < delta:
+                self._jump(key)
+                return wait
+        self._advance(round(delta * self.synth.samplerate) if self.sample_clock else delta)
+        return delta
+
+    def process_frames(self, count: int) -> int:
+        """Advance sample clock and send any events that need to be sent to the Synth.
+
+        :param count: How many samples to advance time
+        :returns: How many samples time was actually advanced (may be smaller
+            than `count`)
+
+        This is the integer version of :meth:`process` used with
+        `sample_clock`.
+        """
+        key = self._send_due()
+        if key is not None:
+            count = min(count, key - self.frame)
+        self._advance(count)
+        return count
+
+    def _anchor(self):
+        # Remember position where rate last changed, sample clock positions
+        # are computed from here so they do not drift
+        self._anchor_frame = self.frame
+        self._anchor_time = self.time
+
+    def _frame_at(self, seconds: float) -> int:
+        # Sample clock position of song time with tempo map
+        return self._anchor_frame + round((seconds - self._anchor_time) * self.synth.samplerate / self.rate)
+
+    def _key(self, index: int):
+        # Position of event in samples with sample clock, otherwise song time
+        if self.tempo_map is not None:
+            t = self.tempo_map.seconds(self.events[index].tick)
+            return self._frame_at(t) if self.sample_clock else t
+        if self.sample_clock:
+            return self.frames[index]
+        return self.events[index].t
+
+    def _loop_key(self):
+        if self.loop is None:
+            return None
+        end = self.loop[1]
+        if not self.sample_clock:
+            return end
+        if self.tempo_map is not None:
+            return self._frame_at(end)
+        return round(end * self.synth.samplerate)
+
+    def _now(self):
+        return self.frame if self.sample_clock else self.time
+
+    def _frames_until(self, key) -> int:
+        if self.sample_clock:
+            return key - self.frame
+        # Round up so every step makes progress
+        return int((key - self.time) / self.rate * self.synth.samplerate + 0.999)
+
+    def _update_time(self):
+        if self.sample_clock:
+            if self.tempo_map is not None:
+                self.time = self._anchor_time + (self.frame - self._anchor_frame) * self.rate / self.synth.samplerate
+            else:
+                self.time = self.frame / self.synth.samplerate
+        if self.tempo_map is not None:
+            self.tick = self.tempo_map.tick(self.time)
+
+    def _jump(self, key):
+        # Move exactly to position of next event
+        if self.sample_clock:
+            self.frame = key
+        else:
+            self.time = key
+        self._update_time()
+
+    def _advance(self, amount):
+        # Move forward by samples with sample clock, otherwise by seconds
+        if self.sample_clock:
+            self.frame += amount
+        else:
+            self.time += amount * self.rate
+        self._update_time()
+
+    def _seek(self, time: float):
+        if self.tempo_map is not None:
+            self.tick = self.tempo_map.tick(time)
+        elif self.sample_clock:
+            self.frame = round(time * self.synth.samplerate)
+            time = self.frame / self.synth.samplerate
+        self.time = time
+        self._anchor()
+        self._cursor = 0
+        self._next = None
+
+    def _send_due(self):
+        # Send events due now, return position of next event or None
+        events = self.events
+        now = self._now()
+        while self._cursor < len(events):
+            key = self._key(self._cursor)
+            if key > now:
+                return key
+            event = events[self._cursor]
+            # Events in the past are only sent if not persistent, persistent
+            # events only when their time is reached exactly
             if event.persistent:
-                pos += 1
+                self._cursor += 1
+                if key < now:
+                    continue
+            elif self._cursor == 0:
+                events.popleft()
+                if self.frames:
+                    self.frames.popleft()
             else:
-                self.events.popleft()
-                # Don't change pos here, the popleft shifts pos to be next event
-            # Now do it
+                del events[self._cursor]
+                if self.frames:
+                    del self.frames[self._cursor]
             self.send(event)
-        # If we get here that means events are done
-        # Advance full time
-        self.time += delta
-        return delta
+            self.synth._block_events += 1
+        return None
+
+    def _move(self, count: int):
+        # Advance by samples of output, landing exactly on next event if reached
+        if count <= 0:
+            return
+        if self._next is not None and count >= self._next_wait:
+            self._jump(self._next)
+        else:
+            self._advance(count if self.sample_clock else count / self.synth.samplerate)
+        self._next = None
+
+    def _step(self, pos: int) -> Optional[int]:
+        # Called by Synth at block position pos, returns block position of
+        # next event or None
+        if self.paused:
+            self._pos = pos
+            return None
+        self._move(pos - self._pos)
+        self._pos = pos
+        while True:
+            key = self._send_due()
+            loop_key = self._loop_key()
+            if loop_key is not None and (key is None or loop_key <= key):
+                if self._now() >= loop_key:
+                    self._seek(self.loop[0])
+                    self.notes_off()
+                    continue
+                key = loop_key
+            if key is None:
+                return None
+            wait = self._frames_until(key)
+            if wait <= 0:
+                self._jump(key)
+                continue
+            self._next = key
+            self._next_wait = wait
+            return pos + wait
+
+    def _end_block(self, samples: int):
+        if not self.paused:
+            self._move(samples - self._pos)
+        self._pos = 0
+
+    def _state(self):
+        state = dict(vars(self))
+        del state["synth"]
+        state["events"] = list(self.events)
+        state["frames"] = list(self.frames)
+        state["channel_map"] = dict(self.channel_map)
+        state["_channels"] = set(self._channels)
+        return state
+
+    def _restore(self, state):
+        vars(self).update(state)
+        self.events = deque(state["events"])
+        self.frames = deque(state["frames"])
+        self.channel_map = dict(state["channel_map"])
+        self._channels = set(state["_channels"])
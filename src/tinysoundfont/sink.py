@@ -0,0 +1,380 @@
+#
+# Python bindings for TinySoundFont
+# https://github.com/nwhitehead/tinysoundfont-pybind
+#
+# Copyright (C) 2024 Nathan Whitehead
+#
+# This code is licensed under the MIT license (see LICENSE for details)
+#
+
+import os
+import queue
+import struct
+import threading
+import time
+from typing import BinaryIO, Optional, Union
+from .synth import Synth, SoundFontException
+
+# Block size used when a sink is started with `buffer_size` 0
+DEFAULT_BUFFER_SIZE = 512
+
+
+class Sink:
+    """Destination for audio generated by :meth:`Synth.start`.
+
+    A sink pulls blocks of samples from the synthesizer with
+    :meth:`Synth.generate` until it is closed. Subclasses implement
+    :meth:`open` and :meth:`close`, and call `synth._sink_generate()` to
+    generate each block so deadline misses are counted in :meth:`Synth.stats`.
+
+    See also: :class:`PyAudioSink`, :class:`FileSink`, :class:`VirtualSink`
+    """
+
+    def open(self, synth: Synth, buffer_size: int):
+        """Start pulling audio from the synthesizer.
+
+        :param synth: Synthesizer to generate audio from
+        :param buffer_size: Number of samples in each block, or 0 for the
+            default of the sink
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Stop pulling audio and release resources of the sink."""
+        raise NotImplementedError
+
+
+class PyAudioSink(Sink):
+    """Play audio on a sound device with `pyaudio`.
+
+    :param kwargs: Extra keyword arguments passed to the `pyaudio` stream
+        constructor, such as `output_device_index`
+
+    This is the sink used by :meth:`Synth.start` when no sink is given.
+    The `pyaudio` module is only imported when the sink is opened, install it
+    with `pip install tinysoundfont[audio]`. Playback of `"planar"` layout is
+    not supported.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.p = None
+        self.stream = None
+
+    def open(self, synth: Synth, buffer_size: int):
+        if synth.output_channels == 2 and synth.layout == "planar":
+            raise SoundFontException("Playback requires interleaved layout")
+        # Import pyaudio here so if this sink is not used there is no dependency
+        try:
+            import pyaudio
+        except ImportError as err:
+            raise ImportError(
+                "PyAudioSink needs pyaudio, install it with: pip install tinysoundfont[audio]"
+            ) from err
+
+        def callback(in_data, frame_count, time_info, status):
+            buffer = synth._sink_generate(frame_count, bool(status & pyaudio.paOutputUnderflow))
+            # PyAudio needs actual bytes, not just memoryview
+            return (bytes(buffer), pyaudio.paContinue)
+
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(
+            format=pyaudio.paInt16 if synth.output_format == "int16" else pyaudio.paFloat32,
+            channels=synth.output_channels,
+            rate=synth.samplerate,
+            output=True,
+            stream_callback=callback,
+            frames_per_buffer=buffer_size,
+            **self.kwargs
+        )
+
+    def close(self):
+        if self.p is not None and self.stream is not None:
+            self.stream.close()
+            self.p.terminate()
+        self.p = None
+        self.stream = None
+
+
+def _wav_header(synth: Synth, data_bytes: int) -> bytes:
+    # Canonical 44 byte header, float32 output uses WAVE_FORMAT_IEEE_FLOAT
+    bits = 16 if synth.output_format == "int16" else 32
+    tag = 1 if synth.output_format == "int16" else 3
+    block_align = synth.output_channels * bits // 8
+    return b"".join(
+        [
+            b"RIFF",
+            struct.pack("<I", min(36 + data_bytes, 0xFFFFFFFF)),
+            b"WAVEfmt ",
+            struct.pack(
+                "<IHHIIHH",
+                16,
+                tag,
+                synth.output_channels,
+                synth.samplerate,
+                synth.samplerate * block_align,
+                block_align,
+                bits,
+            ),
+            b"data",
+            struct.pack("<I", min(data_bytes, 0xFFFFFFFF)),
+        ]
+    )
+
+
+class FileSink(Sink):
+    """Write generated audio to a file or pipe from background threads.
+
+    :param file: Filename, or binary file object such as an open pipe or
+        `sys.stdout.buffer`
+    :param wav: If `True` write a WAV header before the samples, `None` to
+        write WAV only for filenames ending in `.wav` (default `None`)
+    :param realtime: If `True` generate audio at the speed it would play,
+        otherwise as fast as possible (default `False`)
+    :param bulk_size: Number of bytes gathered before each write (default 256 KiB)
+
+    One thread generates blocks of `buffer_size` samples into a bulk buffer
+    while a second thread writes the previous bulk buffer, so slow files or
+    pipes do not stall generation until both buffers are full. Each bulk
+    buffer is written with a single call.
+
+    When the file can seek, the sizes in the WAV header are corrected on
+    :meth:`close`, for pipes they are left at the maximum which most readers
+    treat as unknown length. WAV output requires `"interleaved"` layout.
+    Filenames are closed by the sink, file objects are only flushed.
+
+    Errors while writing, such as the reader of a pipe exiting, stop the sink
+    and are raised again from :meth:`Synth.stop`.
+    """
+
+    def __init__(
+        self,
+        file: Union[str, os.PathLike, BinaryIO],
+        wav: Optional[bool] = None,
+        realtime: bool = False,
+        bulk_size: int = 1 << 18,
+    ):
+        self.file = file
+        self.wav = wav
+        self.realtime = realtime
+        self.bulk_size = bulk_size
+        # Number of sample bytes written so far
+        self.bytes_written = 0
+        self._f = None
+        self._owned = False
+        self._error = None
+        self._threads = []
+
+    def open(self, synth: Synth, buffer_size: int):
+        named = isinstance(self.file, (str, os.PathLike))
+        if self.wav is None:
+            wav = named and str(self.file).lower().endswith(".wav")
+        else:
+            wav = self.wav
+        if wav and synth.output_channels == 2 and synth.layout == "planar":
+            raise SoundFontException("WAV output requires interleaved layout")
+        self._f = open(self.file, "wb") if named else self.file
+        self._owned = named
+        self._synth = synth
+        self._header_pos = self._f.tell() if wav and self._f.seekable() else None
+        if wav:
+            self._f.write(_wav_header(synth, 0xFFFFFFFF))
+        self.bytes_written = 0
+        self._error = None
+        self._stop = threading.Event()
+        # One bulk buffer waiting here and one being written
+        self._queue = queue.Queue(maxsize=1)
+        self._threads = [
+            threading.Thread(target=self._render, args=(buffer_size or DEFAULT_BUFFER_SIZE,), daemon=True),
+            threading.Thread(target=self._write, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _render(self, buffer_size: int):
+        synth = self._synth
+        block = memoryview(bytearray(buffer_size * synth._mixer.frame_size()))
+        bulk = bytearray()
+        frames = 0
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set() and self._error is None:
+                synth._sink_generate(buffer_size, buffer=block)
+                bulk += block
+                frames += buffer_size
+                if len(bulk) >= self.bulk_size:
+                    self._put(bulk)
+                    bulk = bytearray()
+                if self.realtime:
+                    delay = start + frames / synth.samplerate - time.perf_counter()
+                    if delay > 0:
+                        self._stop.wait(delay)
+        except Exception as err:
+            self._error = err
+        finally:
+            if bulk:
+                self._put(bulk)
+            self._put(None)
+
+    def _put(self, item):
+        # Give up waiting for space if the writer failed
+        while self._error is None:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _write(self):
+        try:
+            while True:
+                try:
+                    bulk = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    # The renderer failed and queues nothing more
+                    if self._error is not None:
+                        break
+                    continue
+                if bulk is None:
+                    break
+                view = memoryview(bulk)
+                while view:
+                    # Unbuffered files and pipes may write only part of the
+                    # data, some file-like objects do not return a count
+                    count = self._f.write(view)
+                    count = len(view) if count is None else count
+                    self.bytes_written += count
+                    view = view[count:]
+        except Exception as err:
+            self._error = err
+
+    def close(self):
+        if self._threads:
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+        f, self._f = self._f, None
+        if f is None:
+            return
+        try:
+            if self._error is None:
+                if self._header_pos is not None:
+                    end = f.tell()
+                    f.seek(self._header_pos)
+                    f.write(_wav_header(self._synth, self.bytes_written))
+                    f.seek(end)
+                f.flush()
+        finally:
+            if self._owned:
+                f.close()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+class VirtualSink(Sink):
+    """Generate audio against a virtual clock without a sound device.
+
+    :param threaded: If `True` generate audio as fast as possible in a
+        background thread, otherwise only while :meth:`sleep` is called
+        (default `False`)
+    :param keep: If `True` keep all generated audio in :attr:`data`
+        (default `False`)
+
+    Use this sink for headless servers and tests. Replace calls to
+    :func:`time.sleep` after :meth:`Synth.start` with :meth:`sleep` to let
+    virtual time pass. Without a thread, generation happens inside
+    :meth:`sleep` in blocks of `buffer_size` samples, so results are
+    deterministic and as many seconds of audio as requested are generated
+    no matter how long it takes.
+
+    With `threaded`, audio is generated continuously and :meth:`sleep` waits
+    until the background thread has generated enough audio, which is useful
+    to exercise code that changes the synthesizer from other threads. Errors
+    while generating, such as an exception in the synthesizer callback, stop
+    the thread and are raised again from :meth:`sleep` and :meth:`Synth.stop`.
+    """
+
+    def __init__(self, threaded: bool = False, keep: bool = False):
+        self.threaded = threaded
+        self.keep = keep
+        # Generated audio when `keep` is set
+        self.data = bytearray()
+        # Number of samples generated so far
+        self.frames = 0
+        self._synth = None
+        self._closed = True
+        self._thread = None
+        self._error = None
+        self._condition = threading.Condition()
+
+    @property
+    def time(self) -> float:
+        """Virtual time in seconds since the sink was opened."""
+        if self._synth is None:
+            return 0.0
+        return self.frames / self._synth.samplerate
+
+    def open(self, synth: Synth, buffer_size: int):
+        self._synth = synth
+        self._buffer_size = buffer_size or DEFAULT_BUFFER_SIZE
+        self._block = memoryview(bytearray(self._buffer_size * synth._mixer.frame_size()))
+        self.frames = 0
+        self.data = bytearray()
+        self._error = None
+        self._closed = False
+        if self.threaded:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _pull(self, frames: int):
+        block = self._block if frames == self._buffer_size else None
+        buffer = self._synth._sink_generate(frames, buffer=block)
+        if self.keep:
+            self.data += buffer
+        with self._condition:
+            self.frames += frames
+            self._condition.notify_all()
+
+    def _run(self):
+        try:
+            while not self._closed:
+                self._pull(self._buffer_size)
+        except Exception as err:
+            with self._condition:
+                self._error = err
+                self._closed = True
+                self._condition.notify_all()
+
+    def sleep(self, seconds: float):
+        """Let virtual time pass.
+
+        :param seconds: Amount of virtual time in seconds
+
+        :raises: `SoundFontException` if the sink is not open
+        """
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise SoundFontException("Sink is not open, call Synth.start first")
+        target = self.frames + round(seconds * self._synth.samplerate)
+        if self._thread is None:
+            while self.frames < target:
+                self._pull(min(self._buffer_size, target - self.frames))
+            return
+        with self._condition:
+            self._condition.wait_for(lambda: self.frames >= target or self._closed)
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._closed = True
+        if self._thread is not None:
+            with self._condition:
+                self._condition.notify_all()
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
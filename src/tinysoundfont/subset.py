@@ -0,0 +1,300 @@
+#
+# Python bindings for TinySoundFont
+# https://github.com/nwhitehead/tinysoundfont-pybind
+#
+# Copyright (C) 2024 Nathan Whitehead
+#
+# This code is licensed under the MIT license (see LICENSE for details)
+#
+
+import struct
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .midi import load, ControlChange, NoteOn, ProgramChange
+from .synth import SoundFontException
+
+DRUM_CHANNEL = 9
+
+# Generator operators that refer to other records
+GEN_INSTRUMENT = 41
+GEN_SAMPLE_ID = 53
+
+# Number of zero samples required after each sample in sf2 files
+SAMPLE_GUARD = 46
+
+# Sample type flags
+SAMPLE_COMPRESSED = 0x10
+SAMPLE_ROM = 0x8000
+
+PHDR = struct.Struct("<20sHHHIII")
+BAG = struct.Struct("<HH")
+MOD_SIZE = 10
+GEN = struct.Struct("<HH")
+INST = struct.Struct("<20sH")
+SHDR = struct.Struct("<20sIIIIIBbHH")
+
+
+def _chunks(data: bytes, start: int, end: int) -> Iterable[Tuple[bytes, int, int]]:
+    # Yield (id, data start, data end) for RIFF chunks in range
+    pos = start
+    while pos + 8 <= end:
+        chunk_id = data[pos : pos + 4]
+        (size,) = struct.unpack_from("<I", data, pos + 4)
+        yield chunk_id, pos + 8, min(pos + 8 + size, end)
+        pos += 8 + size + (size & 1)
+
+
+def _chunk(chunk_id: bytes, payload: bytes) -> bytes:
+    pad = b"\0" if len(payload) & 1 else b""
+    return chunk_id + struct.pack("<I", len(payload)) + payload + pad
+
+
+def _records(payload: bytes, record: struct.Struct) -> List[tuple]:
+    return [record.unpack_from(payload, i) for i in range(0, len(payload) - record.size + 1, record.size)]
+
+
+def _parse(data: bytes) -> Dict:
+    if data[:4] != b"RIFF" or data[8:12] != b"sfbk":
+        raise SoundFontException("Not a SoundFont file")
+    # Minimal INFO list in case the file has none, version 2.1 with a name
+    info = b"INFO" + _chunk(b"ifil", struct.pack("<HH", 2, 1)) + _chunk(b"INAM", b"Subset\0\0")
+    font = {"info": info, "smpl": None, "sm24": None}
+    for chunk_id, start, end in _chunks(data, 12, len(data)):
+        if chunk_id != b"LIST":
+            continue
+        list_type = data[start : start + 4]
+        if list_type == b"INFO":
+            font["info"] = data[start:end]
+        for sub_id, sub_start, sub_end in _chunks(data, start + 4, end):
+            font[sub_id.decode("latin-1")] = data[sub_start:sub_end]
+    if "smpo" in font:
+        raise SoundFontException(
+            "Cannot subset .sfo SoundFonts with a single compressed sample stream, subset the original sf2 instead"
+        )
+    for name in ("phdr", "pbag", "pmod", "pgen", "inst", "ibag", "imod", "igen", "shdr"):
+        if name not in font:
+            raise SoundFontException(f"Invalid SoundFont, missing {name} chunk")
+    if font["smpl"] is None:
+        raise SoundFontException("Invalid SoundFont, missing sample data")
+    return font
+
+
+def _resolve(presets: List[tuple], bank: int, program: int, drums: bool) -> Optional[int]:
+    # Same fallbacks as TinySoundFont uses when selecting a program on a channel
+    def find(b, p):
+        for index, record in enumerate(presets):
+            if record[2] == b and record[1] == p:
+                return index
+        return None
+
+    candidates = []
+    if drums:
+        candidates += [(128 | bank, program), (128, program), (128, 0)]
+    candidates += [(bank, program), (0, program)]
+    for candidate in candidates:
+        index = find(*candidate)
+        if index is not None:
+            return index
+    return None
+
+
+def _scan_midi(presets: List[tuple], filename: str) -> Set[int]:
+    # Follow bank select and program changes, keeping presets that play notes
+    used = set()
+    # Channels start out on the lowest bank/preset, which TinySoundFont sorts first
+    default = min(range(len(presets)), key=lambda i: (presets[i][2], presets[i][1]))
+    current = {}
+    bank = {}
+    for event in load(filename):
+        chan = event.channel
+        match event.action:
+            case ControlChange(0, value):
+                # Bank select MSB alone acts like LSB
+                bank[chan] = 0x8000 | value
+            case ControlChange(32, value):
+                msb = bank.get(chan, 0)
+                bank[chan] = (((msb & 0x7F) << 7) if msb & 0x8000 else 0) | value
+            case ProgramChange(program):
+                index = _resolve(presets, bank.get(chan, 0) & 0x7FFF, program, chan == DRUM_CHANNEL)
+                if index is not None:
+                    current[chan] = index
+            case NoteOn(_, velocity) if velocity > 0:
+                used.add(current.get(chan, default))
+    return used
+
+
+def subset(
+    soundfont: str | bytes,
+    midi_files: Optional[List[str]] = None,
+    presets: Optional[List[Tuple[int, int]]] = None,
+    output: Optional[str] = None,
+) -> bytes:
+    """Build a smaller SoundFont containing only the presets that are needed.
+
+    :param soundfont: filename of sf2/sf3 SoundFont or bytes of its contents
+    :param midi_files: list of MIDI filenames to scan for presets that play
+        notes (default None)
+    :param presets: list of `(bank, preset)` tuples of presets to keep
+        (default None)
+    :param output: filename to write the new SoundFont to, or None to only
+        return it (default None)
+
+    :raises: `SoundFontException` if the SoundFont cannot be subset or a
+        preset in `presets` does not exist
+
+    :return: bytes of the new SoundFont, which can be passed directly to
+        :meth:`Synth.sfload`
+
+    MIDI files are scanned for bank select and program change events on every
+    channel (using drum rules on channel 10) following the same preset fallbacks
+    as :meth:`Synth.program_change`. Only presets that are active when notes
+    play are kept. The new SoundFont has only the instruments and samples those
+    presets use, so it loads faster and uses less memory.
+
+    Files in sf3 format keep their compressed samples. Files in the .sfo
+    format store all samples in one compressed stream and cannot be subset.
+    """
+    if isinstance(soundfont, str):
+        with open(soundfont, "rb") as f:
+            data = f.read()
+    else:
+        data = bytes(soundfont)
+    font = _parse(data)
+
+    phdrs = _records(font["phdr"], PHDR)
+    pbags = _records(font["pbag"], BAG)
+    pgens = _records(font["pgen"], GEN)
+    insts = _records(font["inst"], INST)
+    ibags = _records(font["ibag"], BAG)
+    igens = _records(font["igen"], GEN)
+    shdrs = _records(font["shdr"], SHDR)
+    # Last record of each list is a terminal record
+    preset_records = phdrs[:-1]
+
+    keep_presets = set()
+    for filename in midi_files or []:
+        keep_presets |= _scan_midi(preset_records, filename)
+    for bank, preset in presets or []:
+        matches = [i for i, p in enumerate(preset_records) if p[2] == bank and p[1] == preset]
+        if not matches:
+            raise SoundFontException(f"Preset {bank}:{preset} does not exist in SoundFont")
+        keep_presets.update(matches)
+    if not keep_presets:
+        raise SoundFontException("No presets selected for subset")
+    keep_presets = sorted(keep_presets)
+
+    # Find instruments used by kept presets and samples used by those instruments
+    def zone_gens(bags, gens, bag_start, bag_end):
+        return gens[bags[bag_start][0] : bags[bag_end][0]]
+
+    keep_insts = sorted(
+        {
+            amount
+            for i in keep_presets
+            for oper, amount in zone_gens(pbags, pgens, phdrs[i][3], phdrs[i + 1][3])
+            if oper == GEN_INSTRUMENT and amount < len(insts) - 1
+        }
+    )
+    keep_samples = {
+        amount
+        for i in keep_insts
+        for oper, amount in zone_gens(ibags, igens, insts[i][1], insts[i + 1][1])
+        if oper == GEN_SAMPLE_ID and amount < len(shdrs) - 1
+    }
+    # Stereo samples are linked to their other channel
+    for i in list(keep_samples):
+        link = shdrs[i][8]
+        if shdrs[i][9] & 0x6 and link < len(shdrs) - 1:
+            keep_samples.add(link)
+    keep_samples = sorted(keep_samples)
+
+    # Copy sample data of kept samples
+    smpl = font["smpl"]
+    sm24 = font["sm24"]
+    new_smpl = bytearray()
+    new_sm24 = bytearray()
+    new_shdrs = []
+    compressed = [shdrs[i][9] & SAMPLE_COMPRESSED != 0 for i in keep_samples]
+    if any(compressed) and not all(compressed):
+        raise SoundFontException("Cannot subset SoundFont mixing compressed and uncompressed samples")
+    for i in keep_samples:
+        name, start, end, loop_start, loop_end, rate, pitch, correction, link, kind = shdrs[i]
+        if kind & SAMPLE_ROM:
+            new_shdrs.append((name, 0, 0, 0, 0, rate, pitch, correction, link, kind))
+        elif kind & SAMPLE_COMPRESSED:
+            # Offsets are bytes of compressed data, loops are relative to sample start
+            new_start = len(new_smpl)
+            new_smpl += smpl[start:end]
+            new_shdrs.append((name, new_start, len(new_smpl), loop_start, loop_end, rate, pitch, correction, link, kind))
+        else:
+            # Offsets are 16-bit sample positions, copy past end if loop extends further
+            copy_end = max(end, loop_end)
+            shift = len(new_smpl) // 2 - start
+            new_smpl += smpl[start * 2 : copy_end * 2]
+            new_smpl += bytes(SAMPLE_GUARD * 2)
+            if sm24 is not None:
+                new_sm24 += sm24[start:copy_end]
+                new_sm24 += bytes(SAMPLE_GUARD)
+            new_shdrs.append(
+                (name, start + shift, end + shift, loop_start + shift, loop_end + shift, rate, pitch, correction, link, kind)
+            )
+    sample_map = {old: new for new, old in enumerate(keep_samples)}
+    new_shdrs = [
+        record[:8] + (sample_map.get(record[8], 0),) + record[9:] for record in new_shdrs
+    ]
+    new_shdrs.append((b"EOS",) + (0,) * 9)
+
+    def rebuild(records, bag_field, bags, gens, mods, keep, ref_oper, ref_map):
+        # Copy bags, generators and modulators of kept records with remapped references
+        new_records, new_bags, new_gens, new_mods = [], [], [], bytearray()
+        for i in keep:
+            record = records[i]
+            new_records.append(record[:bag_field] + (len(new_bags),) + record[bag_field + 1 :])
+            first_bag, last_bag = record[bag_field], records[i + 1][bag_field]
+            for bag in range(first_bag, last_bag):
+                new_bags.append((len(new_gens), len(new_mods) // MOD_SIZE))
+                for oper, amount in gens[bags[bag][0] : bags[bag + 1][0]]:
+                    if oper == ref_oper:
+                        amount = ref_map[amount]
+                    new_gens.append((oper, amount))
+                new_mods += mods[bags[bag][1] * MOD_SIZE : bags[bag + 1][1] * MOD_SIZE]
+        new_bags.append((len(new_gens), len(new_mods) // MOD_SIZE))
+        new_gens.append((0, 0))
+        new_mods += bytes(MOD_SIZE)
+        return new_records, new_bags, new_gens, bytes(new_mods)
+
+    new_insts, new_ibags, new_igens, new_imods = rebuild(
+        insts, 1, ibags, igens, font["imod"], keep_insts, GEN_SAMPLE_ID, sample_map
+    )
+    new_insts.append((b"EOI", len(new_ibags) - 1))
+    inst_map = {old: new for new, old in enumerate(keep_insts)}
+    new_phdrs, new_pbags, new_pgens, new_pmods = rebuild(
+        phdrs, 3, pbags, pgens, font["pmod"], keep_presets, GEN_INSTRUMENT, inst_map
+    )
+    new_phdrs.append((b"EOP", 0, 0, len(new_pbags) - 1, 0, 0, 0))
+
+    def pack(record, items):
+        return b"".join(record.pack(*item) for item in items)
+
+    pdta = b"pdta" + b"".join(
+        [
+            _chunk(b"phdr", pack(PHDR, new_phdrs)),
+            _chunk(b"pbag", pack(BAG, new_pbags)),
+            _chunk(b"pmod", new_pmods),
+            _chunk(b"pgen", pack(GEN, new_pgens)),
+            _chunk(b"inst", pack(INST, new_insts)),
+            _chunk(b"ibag", pack(BAG, new_ibags)),
+            _chunk(b"imod", new_imods),
+            _chunk(b"igen", pack(GEN, new_igens)),
+            _chunk(b"shdr", pack(SHDR, new_shdrs)),
+        ]
+    )
+    sdta = b"sdta" + _chunk(b"smpl", bytes(new_smpl))
+    if sm24 is not None:
+        sdta += _chunk(b"sm24", bytes(new_sm24))
+    body = b"sfbk" + _chunk(b"LIST", font["info"]) + _chunk(b"LIST", sdta) + _chunk(b"LIST", pdta)
+    result = _chunk(b"RIFF", body)
+    if output is not None:
+        with open(output, "wb") as f:
+            f.write(result)
+    return result
@@ -9,9 +9,38 @@
 
 from . import _tinysoundfont
 
-from typing import Optional
-
-MAX_CHANNELS = 16
+import concurrent.futures
+import copy
+import heapq
+import os
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, BinaryIO, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .sink import Sink
+
+# Channels of one MIDI port, channel N of port P is P * 16 + N
+CHANNELS_PER_PORT = 16
+
+# Tail of each segment of `generate_parallel` is rendered in blocks of this
+# many samples until no voices play and output peak is below silence level, or
+# the overlap window has been rendered
+PARALLEL_TAIL_BLOCK = 4096
+PARALLEL_SILENCE = 1e-6
+
+SAMPLE_FORMATS = {
+    "float32": _tinysoundfont.SampleFormat.Float32,
+    "int16": _tinysoundfont.SampleFormat.Int16,
+}
+
+INTERPOLATIONS = {
+    "none": _tinysoundfont.Interpolation.Nearest,
+    "linear": _tinysoundfont.Interpolation.Linear,
+    "cubic": _tinysoundfont.Interpolation.Cubic,
+    "sinc": _tinysoundfont.Interpolation.Sinc,
+}
 
 
 class SoundFontException(Exception):
@@ -20,32 +49,255 @@ class SoundFontException(Exception):
     pass
 
 
+class SynthState:
+    """Saved playback state of a :class:`Synth`, created by
+    :meth:`Synth.snapshot` and used by :meth:`Synth.restore`.
+
+    A state holds clones of the loaded SoundFonts that share sample data with
+    the original SoundFonts, so taking a snapshot does not copy samples.
+    """
+
+    def __init__(self, synth: "Synth"):
+        self._config = synth._config()
+        self.soundfonts = {
+            sfid: _clone_soundfont(soundfont)
+            for sfid, soundfont in synth.soundfonts.items()
+        }
+        self._mixer = _tinysoundfont.Mixer(synth._mixer)
+        self.channel = dict(synth.channel)
+        self.next_sfid = synth.next_sfid
+        self.sequencers = [seq._state() for seq in synth._sequencers]
+
+
+class SharedSoundFont:
+    """Loaded SoundFont placed in shared memory, created by
+    :meth:`Synth.sfshare` and loaded with :meth:`Synth.sfload`.
+
+    Pickling a shared SoundFont only sends the name of the shared memory
+    block, so it can be passed to worker processes cheaply. Loading it in any
+    process uses the presets and samples in place without parsing or copying.
+
+    The process that created the shared SoundFont should call :meth:`unlink`
+    when no process needs to load it anymore.
+    """
+
+    def __init__(self, name: str, size: int, shm=None):
+        self.name = name
+        self.size = size
+        self._shm = shm
+
+    def __getstate__(self):
+        return {"name": self.name, "size": self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state["name"], state["size"])
+
+    def _attach(self):
+        if self._shm is None:
+            self._shm = _attach_shared_memory(self.name)
+        # The loaded SoundFont keeps this object and the shared memory alive
+        return _tinysoundfont.SoundFont.attach(self._shm.buf[: self.size], self)
+
+    def close(self):
+        """Close access to the shared memory from this process.
+
+        :raises: `SoundFontException` if SoundFonts loaded from it are still
+            in use in this process
+        """
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                raise SoundFontException("Shared SoundFont is still in use")
+            self._shm = None
+
+    def unlink(self):
+        """Remove the shared memory block once all processes have closed it.
+
+        Processes that already loaded the SoundFont can keep using it.
+        """
+        shm = self._shm if self._shm is not None else _attach_shared_memory(self.name)
+        if sys.version_info < (3, 13) and os.name == "posix":
+            # Attaching in other processes sharing the resource tracker may
+            # have removed its entry, which unlink expects to find
+            from multiprocessing import resource_tracker
+
+            resource_tracker.register(shm._name, "shared_memory")
+        shm.unlink()
+
+
+# Names of shared memory blocks created by this process
+_created_shared_memory = set()
+
+
+def _attach_shared_memory(name):
+    # Imported here so multiprocessing is only needed when sharing
+    from multiprocessing import shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block with the resource
+        # tracker, which would remove it when this process exits
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        # The tracker keeps one entry per block, which belongs to the creator
+        # when this process made it
+        if os.name == "posix" and name not in _created_shared_memory:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _clone_soundfont(soundfont):
+    # Shares sample data, copies voices and channels
+    clone = _tinysoundfont.SoundFont(soundfont)
+    clone.copy_state(soundfont)
+    return clone
+
+
 class Synth:
     """Create new synthesizer object to control sound generation.
 
     :param gain: scale factor for audio output, in relative dB (default 0.0)
     :param samplerate: output samplerate in Hz (default 44100)
+    :param output_format: sample format of generated audio, either `"float32"`
+        or `"int16"` (default `"float32"`)
+    :param channels: number of output channels, 1 for mono or 2 for stereo
+        (default 2)
+    :param layout: how stereo samples are ordered in generated audio, either
+        `"interleaved"` for alternating left/right samples or `"planar"` for
+        all left samples followed by all right samples (default
+        `"interleaved"`)
+    :param dither: whether to add triangular dither when converting to
+        `"int16"` output (default False)
+    :param interpolation: how voice samples are interpolated when pitched,
+        one of `"none"`, `"linear"`, `"cubic"`, or `"sinc"` (default
+        `"linear"`)
+    :param internal_samplerate: samplerate in Hz that SoundFonts are rendered
+        at before being resampled to `samplerate`, or None to render directly
+        at `samplerate` (default None)
+    :param fast_math: whether voices use table based pitch, gain, and filter
+        conversions and a fixed-point sample position, or None to use the
+        default chosen when building the module (default None)
+    :param note_cache: memory budget in bytes for storing rendered audio of
+        repeated one-shot notes in each SoundFont, or 0 to disable (default 0)
+    :param midi_channels: number of MIDI channels, use multiples of 16 for
+        several MIDI ports (default 16)
+    :param realtime: whether to allocate all voices and channels when loading
+        SoundFonts so that playing does not allocate memory (default False)
 
     If you need to mix many simultaneous voices you may need to turn down the
     `gain` to avoid clipping. Some SoundFonts also require gain adjustment to
     avoid being too loud or too quiet.
+
+    All loaded SoundFonts are mixed together natively. Conversion to `"int16"`
+    output and to `"planar"` layout happens block by block while mixing, so
+    there is no need to convert generated buffers afterwards.
+
+    Higher quality `interpolation` reduces aliasing on notes pitched far above
+    their recorded pitch at the cost of more CPU per voice. Setting
+    `internal_samplerate` above `samplerate` oversamples all voices and then
+    resamples the mix once with a polyphase filter, while setting it below
+    `samplerate` saves CPU for every voice. Enabling `fast_math` lowers the
+    cost of voices with modulated pitch, volume, or filter, with errors well
+    below audible levels, but output is no longer bit-identical.
+
+    A `note_cache` helps with drum tracks and other material that repeats the
+    same one-shot notes many times. Notes of non-looping regions without
+    pitch or filter modulation, played on channels with neutral pitch wheel
+    and tuning, are resampled and filtered once and then mixed from stored
+    audio with the same output. The least recently used sounds are dropped
+    when the budget is reached.
+
+    With more than 16 `midi_channels`, channel 16 is the first channel of the
+    second MIDI port and so on. All channels share the same voices and loaded
+    SoundFonts and are rendered in one pass.
+
+    In `realtime` mode :meth:`sfload` allocates state for all
+    `midi_channels` and requires a fixed `max_voices`, and the note cache
+    (which stores audio while playing) is not available. Together with
+    :meth:`warm` this keeps native rendering and event handling free of
+    memory allocation and page faults.
     """
 
+    # Routing tables are read with single lookups so readers never need the
+    # lock, changes to them are made while holding `_lock`
+
     def _get_soundfont(self, sfid):
-        if sfid not in self.soundfonts:
+        soundfont = self.soundfonts.get(sfid)
+        if soundfont is None:
             raise SoundFontException("Invalid SoundFont id")
-        return self.soundfonts[sfid]
+        return soundfont
 
     def _get_sfid(self, chan):
-        if chan not in self.channel:
+        sfid = self.channel.get(chan)
+        if sfid is None:
             raise SoundFontException("Invalid channel (channel not assigned)")
-        return self.channel[chan]
+        return sfid
 
-    def __init__(self, gain: float = 0, samplerate: int = 44100):
-        self.p = None
-        self.stream = None
+    def __init__(
+        self,
+        gain: float = 0,
+        samplerate: int = 44100,
+        output_format: str = "float32",
+        channels: int = 2,
+        layout: str = "interleaved",
+        dither: bool = False,
+        interpolation: str = "linear",
+        internal_samplerate: Optional[int] = None,
+        fast_math: Optional[bool] = None,
+        note_cache: int = 0,
+        midi_channels: int = CHANNELS_PER_PORT,
+        realtime: bool = False,
+    ):
+        if output_format not in SAMPLE_FORMATS:
+            raise SoundFontException("Invalid output format, must be float32 or int16")
+        if channels not in (1, 2):
+            raise SoundFontException("Invalid channels, must be 1 or 2")
+        if midi_channels < 1:
+            raise SoundFontException("Invalid number of MIDI channels, must be at least 1")
+        if realtime and note_cache:
+            raise SoundFontException("Note cache allocates while playing, not available in realtime mode")
+        if layout not in ("interleaved", "planar"):
+            raise SoundFontException("Invalid layout, must be interleaved or planar")
+        if interpolation not in INTERPOLATIONS:
+            raise SoundFontException(
+                "Invalid interpolation, must be none, linear, cubic, or sinc"
+            )
+        self.sink = None
         self.gain = gain
         self.samplerate = samplerate
+        self.output_format = output_format
+        self.output_channels = channels
+        self.layout = layout
+        self.interpolation = interpolation
+        self.fast_math = fast_math
+        self.note_cache = note_cache
+        self.midi_channels = midi_channels
+        self.realtime = realtime
+        self.internal_samplerate = (
+            samplerate if internal_samplerate is None else internal_samplerate
+        )
+        if channels == 1:
+            output_mode = _tinysoundfont.OutputMode.Mono
+        elif layout == "planar":
+            output_mode = _tinysoundfont.OutputMode.StereoUnweaved
+        else:
+            output_mode = _tinysoundfont.OutputMode.StereoInterleaved
+        # All SoundFonts render interleaved, the mixer converts layout
+        self._soundfont_output_mode = (
+            _tinysoundfont.OutputMode.Mono
+            if channels == 1
+            else _tinysoundfont.OutputMode.StereoInterleaved
+        )
+        self._mixer = _tinysoundfont.Mixer(
+            output_mode, SAMPLE_FORMATS[output_format], dither
+        )
+        try:
+            self._mixer.set_resampler(self.internal_samplerate, samplerate)
+        except RuntimeError as err:
+            raise SoundFontException(str(err))
         # soundfonts maps sfid numbers to SoundFont objects
         self.soundfonts = {}
         # Unique identifier creator for this Synth
@@ -53,19 +305,47 @@ class Synth:
         # Keep track of which SoundFont to use for different channels
         # Dictionary of channel -> sfid
         self.channel = {}
+        # Guards changes to `soundfonts` and `channel` from several threads
+        self._lock = threading.RLock()
         # Function to call to perform actions during audio callback
         self.callback = None
+        # Sequencers sending events, in order they were connected
+        self._sequencers = []
+        # Statistics not collected natively
+        self._deadline_misses = 0
+        self._block_events = 0
+        self._sequencer_blocks = 0
+        self._sequencer_events = 0
+        self._max_block_events = 0
+        self._render_allocations = 0
 
     def sfload(
-        self, filename_or_bytes: str | bytes, gain: float = 0.0, max_voices: int = 256
+        self,
+        filename_or_bytes: "str | os.PathLike | bytes | BinaryIO | SharedSoundFont",
+        gain: float = 0.0,
+        max_voices: int = 256,
+        interpolation: Optional[str] = None,
+        fast_math: Optional[bool] = None,
+        note_cache: Optional[int] = None,
     ) -> int:
         """Load SoundFont and return its ID
 
         :param filename_or_bytes: either a filename containing sf2/sf3/sfo
-            SoundFont data or bytes object
+            SoundFont data, an object supporting the buffer protocol holding
+            the data (`bytes`, `bytearray`, `memoryview`, `mmap`, NumPy
+            array), a readable binary file object, or
+            :class:`SharedSoundFont`
         :param gain: gain adjustment for this SoundFont, in relative dB (default
             0.0)
         :param max_voices: maximum number of simultaneous voices (default 256)
+        :param interpolation: interpolation method for this SoundFont, or None
+            to use the `interpolation` of the Synth (default None)
+        :param fast_math: whether to use the fast math render path for this
+            SoundFont, or None to use the `fast_math` of the Synth (default
+            None)
+        :param note_cache: note cache memory budget in bytes for this
+            SoundFont, or None to use the `note_cache` of the Synth (default
+            None)
 
         :return: ID of SoundFont to be used by other methods such as
             :func:`program_select`
@@ -73,26 +353,195 @@ class Synth:
         When deciding on the value for `max_voices`, one note in a SoundFont may
         use more than one voice. Playing multiple notes also uses more voices.
         If more voices are required than are available, older voices will be cut
-        off.
+        off. A `max_voices` of 0 lets the number of voices grow as needed, which
+        is not allowed in `realtime` mode.
+
+        Buffers are read in place without copying. File objects, such as a
+        member of a zip file, are read in large chunks with sample data going
+        directly into its final place, so memory used while loading stays
+        close to the size of the loaded SoundFont.
+
+        Loading runs without holding the GIL, so audio playback and other
+        threads continue while a large SoundFont is parsed and decoded. Use
+        :meth:`sfload_async` to load without blocking the caller.
 
         See also: :meth:`program_select`, :meth:`sfpreset_name`,
-        :meth:`sfunload`
+        :meth:`sfunload`, :meth:`sfreplace`
         """
-        soundfont = _tinysoundfont.SoundFont(filename_or_bytes)
+        soundfont = self._sfopen(filename_or_bytes, gain, max_voices, interpolation, fast_math, note_cache)
+        with self._lock:
+            sfid = self.next_sfid
+            self.next_sfid += 1
+            # Replace routing tables instead of changing them, so threads
+            # iterating over them without the lock see a consistent version
+            self.soundfonts = {**self.soundfonts, sfid: soundfont}
+            self._mixer.set_soundfonts(list(self.soundfonts.values()))
+            # Set any unassigned channels to use this SoundFont
+            channel = dict(self.channel)
+            for chan in range(self.midi_channels):
+                if chan not in channel:
+                    channel[chan] = sfid
+            self.channel = channel
+        return sfid
+
+    def _sfopen(self, filename_or_bytes, gain, max_voices, interpolation, fast_math, note_cache):
+        # Load and configure a native SoundFont without adding it
+        if interpolation is None:
+            interpolation = self.interpolation
+        if interpolation not in INTERPOLATIONS:
+            raise SoundFontException(
+                "Invalid interpolation, must be none, linear, cubic, or sinc"
+            )
+        if self.realtime and max_voices < 1:
+            raise SoundFontException("Realtime mode needs a fixed number of voices, max_voices must be positive")
+        if self.realtime and note_cache:
+            raise SoundFontException("Note cache allocates while playing, not available in realtime mode")
+        if isinstance(filename_or_bytes, SharedSoundFont):
+            soundfont = filename_or_bytes._attach()
+        elif isinstance(filename_or_bytes, os.PathLike):
+            soundfont = _tinysoundfont.SoundFont(os.fspath(filename_or_bytes))
+        elif hasattr(filename_or_bytes, "read"):
+            soundfont = _tinysoundfont.SoundFont.from_file(filename_or_bytes)
+        else:
+            soundfont = _tinysoundfont.SoundFont(filename_or_bytes)
         soundfont.set_output(
-            _tinysoundfont.OutputMode.StereoInterleaved,
-            self.samplerate,
+            self._soundfont_output_mode,
+            self.internal_samplerate,
             self.gain + gain,
         )
         soundfont.set_max_voices(max_voices)
-        sfid = self.next_sfid
-        self.next_sfid += 1
-        self.soundfonts[sfid] = soundfont
-        # Set any unassigned channels to use this SoundFont
-        for chan in range(MAX_CHANNELS):
-            if chan not in self.channel:
-                self.channel[chan] = sfid
-        return sfid
+        soundfont.set_interpolation(INTERPOLATIONS[interpolation])
+        if fast_math is None:
+            fast_math = self.fast_math
+        if fast_math is not None:
+            soundfont.set_fast_math(fast_math)
+        if note_cache is None:
+            note_cache = self.note_cache
+        if note_cache:
+            soundfont.set_note_cache(note_cache)
+        if self.realtime:
+            soundfont.preallocate_channels(self.midi_channels)
+        return soundfont
+
+    def sfload_async(
+        self,
+        filename_or_bytes: "str | os.PathLike | bytes | BinaryIO | SharedSoundFont",
+        gain: float = 0.0,
+        max_voices: int = 256,
+        interpolation: Optional[str] = None,
+        fast_math: Optional[bool] = None,
+        note_cache: Optional[int] = None,
+    ) -> concurrent.futures.Future:
+        """Load SoundFont in a background thread.
+
+        Takes the same arguments as :meth:`sfload`.
+
+        :return: Future whose result is the ID of the loaded SoundFont, or
+            which raises the error of :meth:`sfload`
+
+        Parsing and decoding run without the GIL, so the caller, audio
+        playback, and other Python threads keep running while a large
+        SoundFont loads. File objects are read on the loading thread and must
+        not be used by other threads until the future is done. The SoundFont
+        is added when loading finishes, use :meth:`sfreplace` to switch
+        playing channels over to it.
+
+        See also: :meth:`sfload`, :meth:`sfreplace`
+        """
+        future = concurrent.futures.Future()
+
+        def load():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                sfid = self.sfload(filename_or_bytes, gain, max_voices, interpolation, fast_math, note_cache)
+            except BaseException as err:
+                future.set_exception(err)
+            else:
+                future.set_result(sfid)
+
+        threading.Thread(target=load, daemon=True).start()
+        return future
+
+    def sfreplace(
+        self,
+        sfid: int,
+        new: "int | str | os.PathLike | bytes | BinaryIO | SharedSoundFont",
+        crossfade: float = 0.05,
+    ):
+        """Replace a SoundFont while it is playing.
+
+        :param sfid: ID of SoundFont to replace, as returned by :func:`sfload`
+        :param new: ID of another loaded SoundFont, for example from
+            :meth:`sfload_async`, or anything accepted by :meth:`sfload`
+        :param crossfade: Time in seconds to fade out notes still playing on
+            the replaced SoundFont, 0 to stop them at once (default 0.05)
+
+        :raises: `SoundFontException` if either SoundFont does not exist or
+            they are the same
+
+        The new SoundFont takes over `sfid` between two rendered blocks, so
+        audio playback never sees a partial change. Channels using `sfid` keep
+        their parameters (volume, pan, pitch wheel, controllers) and select
+        the preset with the same bank and number in the new SoundFont, falling
+        back to bank 0. Notes started afterwards use the new SoundFont, while
+        notes already playing continue on the old one and fade out over
+        `crossfade` seconds. An ID given as `new` is no longer valid
+        afterwards, channels using it move to `sfid`.
+
+        A source given as `new` is loaded first with the settings of
+        :meth:`sfload`, blocking the caller, so pass an ID from
+        :meth:`sfload_async` to keep the caller responsive.
+
+        See also: :meth:`sfload_async`, :meth:`sfunload`
+        """
+        if crossfade < 0:
+            raise SoundFontException("Invalid crossfade, must not be negative")
+        self._get_soundfont(sfid)
+        if not isinstance(new, int):
+            new = self.sfload(new)
+        if new == sfid:
+            raise SoundFontException("Cannot replace a SoundFont with itself")
+        with self._lock:
+            old = self._get_soundfont(sfid)
+            soundfont = self._get_soundfont(new)
+            chans = [chan for chan, chan_sfid in self.channel.items() if chan_sfid == sfid]
+            soundfont.copy_channels(old, chans)
+            soundfonts = {key: value for key, value in self.soundfonts.items() if key != new}
+            soundfonts[sfid] = soundfont
+            channel = {chan: sfid if chan_sfid == new else chan_sfid for chan, chan_sfid in self.channel.items()}
+            self.soundfonts = soundfonts
+            self.channel = channel
+            frames = round(crossfade * self.internal_samplerate)
+            self._mixer.crossfade(list(soundfonts.values()), old, frames)
+
+    def sfshare(self, sfid: int) -> SharedSoundFont:
+        """Copy a loaded SoundFont into shared memory for other processes.
+
+        :param sfid: ID of SoundFont to share, as returned by :func:`sfload`
+
+        :raises: `SoundFontException` if the SoundFont does not exist
+
+        :return: Shared SoundFont that can be pickled and sent to other
+            processes and loaded there with :meth:`sfload`
+
+        The shared memory holds the parsed presets and decoded samples, so
+        processes loading it skip reading and decoding the SoundFont and share
+        one copy of the sample data. Call :meth:`SharedSoundFont.unlink` once
+        workers have loaded it or finished, otherwise the shared memory stays
+        allocated until this process exits.
+
+        See also: :meth:`sfload`
+        """
+        # Imported here so multiprocessing is only needed when sharing
+        from multiprocessing import shared_memory
+
+        soundfont = self._get_soundfont(sfid)
+        size = soundfont.export_size()
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        _created_shared_memory.add(shm.name)
+        soundfont.export_to(shm.buf[:size])
+        return SharedSoundFont(shm.name, size, shm)
 
     def sfunload(self, sfid: int):
         """Unload a SoundFont and free memory it used.
@@ -104,21 +553,23 @@ class Synth:
 
         See also: :meth:`sfload`
         """
-        _ = self._get_soundfont(sfid)
-        del self.soundfonts[sfid]
-        # Clear any channels that refers to this sfid
-        self.channel = {
-            chan: self.channel[chan]
-            for chan in self.channel
-            if self.channel[chan] != sfid
-        }
+        with self._lock:
+            _ = self._get_soundfont(sfid)
+            self.soundfonts = {key: value for key, value in self.soundfonts.items() if key != sfid}
+            self._mixer.set_soundfonts(list(self.soundfonts.values()))
+            # Clear any channels that refers to this sfid
+            self.channel = {
+                chan: self.channel[chan]
+                for chan in self.channel
+                if self.channel[chan] != sfid
+            }
 
     def program_select(
         self, chan: int, sfid: int, bank: int, preset: int, is_drums: bool = False
     ):
         """Select a program from a SoundFont for specific channel
 
-        :param chan: Channel to affect (0-15)
+        :param chan: Channel to affect (0 to `midi_channels` - 1)
         :param sfid: ID of SoundFont to use
         :param bank: Bank to set (0-127)
         :param preset: Which preset to use (0-127)
@@ -133,26 +584,28 @@ class Synth:
         Note that presets are numbered with 0-based indexing. MIDI user
         interfaces typically number presets 1-128.
         """
-        soundfont = self._get_soundfont(sfid)
-        self.channel[chan] = sfid
-        soundfont.channel_set_bank(chan, bank)
-        soundfont.channel_set_preset_number(chan, preset, is_drums)
+        with self._lock:
+            soundfont = self._get_soundfont(sfid)
+            self.channel = {**self.channel, chan: sfid}
+            soundfont.channel_set_bank(chan, bank)
+            soundfont.channel_set_preset_number(chan, preset, is_drums)
 
     def program_unset(self, chan: int):
         """Set the preset of a MIDI channel to an unassigned state.
 
-        :param chan: Channel to affect (0-15)
+        :param chan: Channel to affect (0 to `midi_channels` - 1)
 
         :raises: `SoundFontException` if channel is out of range
         """
-        if chan not in self.channel:
-            raise SoundFontException("Invalid channel (channel not assigned)")
-        del self.channel[chan]
+        with self._lock:
+            if chan not in self.channel:
+                raise SoundFontException("Invalid channel (channel not assigned)")
+            self.channel = {key: value for key, value in self.channel.items() if key != chan}
 
     def program_change(self, chan: int, preset: int, is_drums: bool = False):
         """Select a program for a specific channel.
 
-        :param chan: Channel to affect (0-15)
+        :param chan: Channel to affect (0 to `midi_channels` - 1)
         :param preset: Which preset to use (0-127)
         :param is_drums: Whether to set channel to MIDI drum mode (default
             False)
@@ -172,7 +625,7 @@ class Synth:
     def program_info(self, chan: int) -> (int, int, int):
         """Get SoundFont id, bank, program number, and preset number of channel.
 
-        :param chan: Channel to use (0-15)
+        :param chan: Channel to use (0 to `midi_channels` - 1)
 
         :raises: `SoundFontException` if channel is out of range or has no
             SoundFont loaded
@@ -209,10 +662,83 @@ class Synth:
             return None
         return name
 
+    def sfpresets(self, sfid: int) -> List[dict]:
+        """Return information about all presets of a SoundFont.
+
+        :param sfid: ID of SoundFont to use
+
+        :raises: `SoundFontException` if the SoundFont does not exist
+
+        :return: List of dictionaries, one per preset, with keys `index`,
+            `bank`, `preset`, `name`, `regions` (number of regions), and
+            `sample_bytes` (size of sample data used by the preset in memory)
+
+        All presets are collected in a single call, which is much faster than
+        calling :meth:`sfpreset_name` for every possible bank and preset.
+
+        See also: :meth:`sfpreset_name`
+        """
+        soundfont = self._get_soundfont(sfid)
+        return soundfont.presets()
+
+    def warm(
+        self,
+        presets: Optional[List[Tuple[int, int]]] = None,
+        sfid: Optional[int] = None,
+        lock: bool = False,
+    ) -> dict:
+        """Bring sample data of presets into memory before playing them.
+
+        :param presets: List of `(bank, preset)` tuples to warm, or `None` for
+            the presets currently selected on all channels (default None)
+        :param sfid: ID of SoundFont to warm, or `None` for all loaded
+            SoundFonts (default None)
+        :param lock: whether to also lock the sample data in memory so it
+            cannot be paged out (default False)
+
+        :raises: `SoundFontException` if the SoundFont does not exist or a
+            preset is not in any of the SoundFonts
+
+        :return: Dictionary with `bytes` (size of sample data touched) and
+            `locked_bytes` (size of memory locked, rounded to whole pages)
+
+        The first time a preset plays, reading its samples can page fault
+        and stall rendering. Warming touches every page of the sample data
+        used by the presets ahead of time. Locking may be limited by the
+        operating system (see `ulimit -l`); memory that could not be locked
+        is not counted in `locked_bytes`. Locked memory is unlocked when the
+        SoundFont is unloaded.
+
+        See also: :meth:`sfload`
+        """
+        sfids = list(self.soundfonts) if sfid is None else [sfid]
+        soundfonts = {key: self._get_soundfont(key) for key in sfids}
+        indices = {key: set() for key in sfids}
+        if presets is None:
+            for chan, chan_sfid in self.channel.items():
+                if chan_sfid in indices:
+                    indices[chan_sfid].add(soundfonts[chan_sfid].channel_get_preset_index(chan))
+        else:
+            for bank, preset in presets:
+                found = False
+                for preset_sfid, soundfont in soundfonts.items():
+                    index = soundfont.get_preset_index(bank, preset)
+                    if index >= 0:
+                        indices[preset_sfid].add(index)
+                        found = True
+                if not found:
+                    raise SoundFontException(f"Preset {preset} in bank {bank} not found")
+        result = {"bytes": 0, "locked_bytes": 0}
+        for preset_sfid, soundfont in soundfonts.items():
+            warmed = soundfont.warm(sorted(indices[preset_sfid]), lock)
+            result["bytes"] += warmed["bytes"]
+            result["locked_bytes"] += warmed["locked_bytes"]
+        return result
+
     def noteon(self, chan: int, key: int, velocity: int) -> bool:
         """Play a note.
 
-        :param chan: Channel to use (0-15)
+        :param chan: Channel to use (0 to `midi_channels` - 1)
         :param key: MIDI key to press (0-127), 60 is middle C
         :param velocity: Velocity of keypress (0-127), 0 means to turn off, 127
             is maximum
@@ -224,17 +750,16 @@ class Synth:
             return False
         if velocity < 0 or velocity > 127:
             return False
-        if chan not in self.channel:
+        soundfont = self.soundfonts.get(self.channel.get(chan))
+        if soundfont is None:
             return False
-        sfid = self._get_sfid(chan)
-        soundfont = self._get_soundfont(sfid)
         soundfont.channel_note_on(chan, key, velocity / 127.0)
         return True
 
     def noteoff(self, chan: int, key: int):
         """Stop a note.
 
-        :param chan: Channel to use (0-15)
+        :param chan: Channel to use (0 to `midi_channels` - 1)
         :param key: MIDI key to release (0-127), 60 is middle C
 
         :return: `True` if note was valid, `False` if note was outside of legal
@@ -244,24 +769,23 @@ class Synth:
         """
         if key < 0 or key > 127:
             return False
-        if chan not in self.channel:
+        soundfont = self.soundfonts.get(self.channel.get(chan))
+        if soundfont is None:
             return False
-        sfid = self._get_sfid(chan)
-        soundfont = self._get_soundfont(sfid)
         soundfont.channel_note_off(chan, key)
         return True
 
     def notes_off(self, chan: Optional[int] = None):
         """Turn off all playing notes in all channels or one specific channel.
 
-        :param chan: Channel to use (0-15) or None to indicate all channels
+        :param chan: Channel to use (0 to `midi_channels` - 1) or None to indicate all channels
 
         Some instruments have long decays or may continue to produce sound after
         a NOTE_OFF event. If you need all sounds to stop playing use
         :meth:`sounds_off`.
         """
         if chan is None:
-            for chan in range(16):
+            for chan in range(self.midi_channels):
                 self.control_change(chan, 123, 0)
         else:
             self.control_change(chan, 123, 0)
@@ -269,14 +793,14 @@ class Synth:
     def sounds_off(self, chan: Optional[int] = None):
         """Turn off all playing sounds in all channels or one specific channel.
 
-        :param chan: Channel to use (0-15) or None to indicate all channels
+        :param chan: Channel to use (0 to `midi_channels` - 1) or None to indicate all channels
 
         Some instruments have long decays or may continue to produce sound after
         a NOTE_OFF event. If you need all notes to stop playing and continue
         producing the decay, use :meth:`notes_off`.
         """
         if chan is None:
-            for chan in range(16):
+            for chan in range(self.midi_channels):
                 self.control_change(chan, 120, 0)
         else:
             self.control_change(chan, 120, 0)
@@ -284,7 +808,7 @@ class Synth:
     def control_change(self, chan: int, controller: int, control_value: int):
         """Change control value for a specific channel.
 
-        :param chan: Channel to use (0-15)
+        :param chan: Channel to use (0 to `midi_channels` - 1)
         :param controller: Controller to update, (0-127), meaning defined by
             MIDI 1.0 standard
         :param control_value: Value to use for update, (0-127)
@@ -307,7 +831,7 @@ class Synth:
     def set_tuning(self, chan: int, tuning: float):
         """Set tuning for a channel.
 
-        :param chan: Channel to affect (0-15)
+        :param chan: Channel to affect (0 to `midi_channels` - 1)
         :param tuning: Tuning adjustment in semitones (default 0.0)
         """
         sfid = self._get_sfid(chan)
@@ -317,7 +841,7 @@ class Synth:
     def pitchbend(self, chan: int, value: int):
         """Set pitch wheel position for a channel.
 
-        :param chan: Channel to affect (0-15)
+        :param chan: Channel to affect (0 to `midi_channels` - 1)
         :param value: Value from 0 to 16383 indicating pitch bend down to pitch
             bend up (default 8192, no pitch change)
 
@@ -330,7 +854,7 @@ class Synth:
     def pitchbend_range(self, chan: int, semitones: float):
         """Set pitch bend range up and down for a channel.
 
-        :param chan: Channel to affect (0-15)
+        :param chan: Channel to affect (0 to `midi_channels` - 1)
         :param semitones: Pitch bend range up and down in semitones (default
             2.0)
 
@@ -340,14 +864,158 @@ class Synth:
         soundfont = self._get_soundfont(sfid)
         soundfont.channel_set_pitch_range(chan, semitones)
 
-    def start(self, buffer_size: int = 1024, **kwargs):
+    def set_reverb(
+        self,
+        enabled: bool = True,
+        room_size: float = 0.5,
+        damping: float = 0.5,
+        width: float = 1.0,
+        level: float = 1.0,
+    ):
+        """Enable or disable the shared reverb and set its parameters.
+
+        :param enabled: whether the reverb is active (default True)
+        :param room_size: size of the simulated room from 0.0 to 1.0, larger
+            rooms give longer reverb tails (default 0.5)
+        :param damping: high frequency damping from 0.0 to 1.0 (default 0.5)
+        :param width: stereo width from 0.0 (mono) to 1.0 (default 1.0)
+        :param level: output level of the reverb (default 1.0)
+
+        :raises: `SoundFontException` if a parameter is out of range
+
+        The amount of reverb on each channel is set by MIDI controller 91
+        (reverb send) with :meth:`control_change`, which starts at 0. All
+        voices share one reverb that is mixed into the output inside
+        :meth:`generate`, so the cost of the reverb does not depend on the
+        number of voices. Reverb is not included in :meth:`generate_stems`.
+
+        See also: :meth:`set_chorus`
+        """
+        try:
+            self._mixer.set_reverb(enabled, room_size, damping, width, level)
+        except RuntimeError as err:
+            raise SoundFontException(str(err))
+
+    def set_chorus(
+        self,
+        enabled: bool = True,
+        delay_ms: float = 12.0,
+        depth_ms: float = 4.0,
+        rate_hz: float = 0.4,
+        level: float = 1.0,
+    ):
+        """Enable or disable the shared chorus and set its parameters.
+
+        :param enabled: whether the chorus is active (default True)
+        :param delay_ms: average delay of the chorus voices in milliseconds
+            (default 12.0)
+        :param depth_ms: how far the delay is modulated up and down in
+            milliseconds, at most `delay_ms` (default 4.0)
+        :param rate_hz: modulation rate in Hz (default 0.4)
+        :param level: output level of the chorus (default 1.0)
+
+        :raises: `SoundFontException` if a parameter is out of range
+
+        The amount of chorus on each channel is set by MIDI controller 93
+        (chorus send) with :meth:`control_change`, which starts at 0. All
+        voices share one chorus that is mixed into the output inside
+        :meth:`generate`. Chorus is not included in :meth:`generate_stems`.
+
+        See also: :meth:`set_reverb`
+        """
+        try:
+            self._mixer.set_chorus(enabled, delay_ms, depth_ms, rate_hz, level)
+        except RuntimeError as err:
+            raise SoundFontException(str(err))
+
+    def set_limiter(
+        self,
+        enabled: bool = True,
+        threshold_db: float = -1.0,
+        lookahead_ms: float = 5.0,
+        release_ms: float = 50.0,
+    ):
+        """Enable or disable the peak limiter on the final output.
+
+        :param enabled: whether the limiter is active (default True)
+        :param threshold_db: highest output level in dB relative to full
+            scale, at most 0.0 (default -1.0)
+        :param lookahead_ms: how far ahead the limiter looks for peaks in
+            milliseconds, from 0.0 to 100.0 (default 5.0)
+        :param release_ms: time constant for recovering gain after a peak in
+            milliseconds (default 50.0)
+
+        :raises: `SoundFontException` if a parameter is out of range
+
+        The limiter turns down the output smoothly before peaks so the output
+        never goes above `threshold_db`, which allows using a higher `gain`
+        without clipping. Output is delayed by `lookahead_ms`. Limiting
+        happens inside :meth:`generate` before conversion to the output
+        format. It is not applied to :meth:`generate_stems`.
+
+        See also: :meth:`meters`
+        """
+        try:
+            self._mixer.set_limiter(enabled, threshold_db, lookahead_ms, release_ms)
+        except RuntimeError as err:
+            raise SoundFontException(str(err))
+
+    def set_meters(self, enabled: bool = True):
+        """Enable or disable measuring output levels.
+
+        :param enabled: whether meters are active (default True)
+
+        Levels are measured inside :meth:`generate` as each block of output
+        is produced, after the limiter and before conversion to the output
+        format. Read them with :meth:`meters`.
+
+        See also: :meth:`meters`, :meth:`reset_meters`
+        """
+        self._mixer.set_meters(enabled)
+
+    def meters(self) -> dict:
+        """Get output levels measured since the previous call.
+
+        :returns: Dictionary of output levels
+
+        The dictionary has these keys:
+
+        * `peak` -- list with highest absolute sample value for each output
+          channel since the previous call
+        * `rms` -- list with root mean square level for each output channel
+          since the previous call
+        * `frames` -- number of sample frames measured since the previous call
+        * `peak_hold` -- list with highest absolute sample value for each
+          output channel since :meth:`reset_meters`
+        * `clipped` -- number of samples over full scale since
+          :meth:`reset_meters`, counted before the limiter when it is enabled
+        * `gain_reduction_db` -- largest gain reduction of the limiter since
+          the previous call, in dB
+
+        Levels are linear with 1.0 for full scale. Meters must be enabled with
+        :meth:`set_meters` for `peak`, `rms`, and `peak_hold` to be measured.
+
+        See also: :meth:`set_meters`, :meth:`set_limiter`
+        """
+        return self._mixer.meters()
+
+    def reset_meters(self):
+        """Reset `peak_hold` and `clipped` reported by :meth:`meters`.
+
+        See also: :meth:`meters`
+        """
+        self._mixer.reset_meters()
+
+    def start(self, buffer_size: int = 1024, sink: Optional["Sink"] = None, **kwargs):
         """Start audio playback in a separate thread.
 
         :param buffer_size: Number of samples to buffer or 0 for automatic
             sizing for low latency (default 1024)
+        :param sink: Destination for generated audio, or `None` to play on a
+            sound device with :class:`PyAudioSink` (default `None`)
 
         Extra keyword arguments will be passed to the `pyaudio` stream
-        constructor. Useful arguments might include:
+        constructor when no `sink` is given. Useful arguments might include:
 
         * `output_device_index` -- index of output device to use, or `None` for
           default output device
@@ -357,44 +1025,293 @@ class Synth:
         may need to use `pyaudio` method `get_host_api_info_by_index()` to find
         details about the `pyaudio` devices and choose a suitable index.
 
-        The separate audio playback thread will continue generating and playing
-        samples until stopped with :meth:`stop`.
+        To write audio to a file or pipe use :class:`FileSink`, and to run
+        without a sound device and faster than real time, such as in tests,
+        use :class:`VirtualSink`.
+
+        The sink will continue generating samples until stopped with
+        :meth:`stop`. Output uses the output format and number of channels of
+        the synthesizer. Playback of `"planar"` layout with `pyaudio` is not
+        supported.
 
         The audio thread will not prevent the main thread from exiting. If you
         turn on notes and call :meth:`start`, your main thread will need to call
         :func:`time.sleep` to let time pass to be able to hear the notes
         playing. To schedule note events through time see :class:`Sequencer`.
 
+        :raises: `SoundFontException` if the layout is not supported by the sink
+
         See also: :meth:`stop`
         """
+        if sink is None:
+            # Imported here since sinks depend on this module
+            from .sink import PyAudioSink
 
-        # Import pyaudio here so if this function is not used there is no dependency
-        import pyaudio
-
-        def callback(in_data, frame_count, time_info, status):
-            buffer = self.generate(samples=frame_count)
-            # PyAudio needs actual bytes, not just memoryview
-            return (bytes(buffer), pyaudio.paContinue)
-
-        self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(
-            format=pyaudio.paFloat32,
-            channels=2,
-            rate=self.samplerate,
-            output=True,
-            stream_callback=callback,
-            frames_per_buffer=buffer_size,
-            **kwargs
-        )
+            sink = PyAudioSink(**kwargs)
+        elif kwargs:
+            raise SoundFontException("Extra keyword arguments are only used without a sink")
+        self.stop()
+        sink.open(self, buffer_size)
+        self.sink = sink
 
     def stop(self):
         """Stop audio playback thread.
 
+        Errors from the sink, such as failed writes of a :class:`FileSink`,
+        are raised here.
+
         See also: :meth:`start`
         """
-        if self.p is not None and self.stream is not None:
-            self.stream.close()
-            self.p.terminate()
+        sink, self.sink = self.sink, None
+        if sink is not None:
+            sink.close()
+
+    def _sink_generate(
+        self, samples: int, underflow: bool = False, buffer: Optional[memoryview] = None
+    ) -> memoryview:
+        # Generate one block for a sink, `underflow` if the device ran out of samples
+        start = time.perf_counter()
+        buffer = self.generate(samples, buffer)
+        # Count a miss if the device ran out of samples or generating took
+        # longer than the audio it produced
+        elapsed = time.perf_counter() - start
+        if underflow or elapsed > samples / self.samplerate:
+            self._deadline_misses += 1
+        return buffer
+
+    def _advance(self, samples: int, render):
+        # Count native allocations while rendering and sending events
+        start = _tinysoundfont._render_scope(True)
+        try:
+            self._advance_events(samples, render)
+        finally:
+            self._render_allocations += _tinysoundfont._render_scope(False) - start
+
+    def _advance_events(self, samples: int, render):
+        # Render `samples` frames by calling `render(pos, count)` for consecutive
+        # ranges, splitting ranges wherever a sequencer or the callback has
+        # events scheduled
+        generated = 0
+        self._block_events = 0
+        # Heap of (position of next event, order, sequencer), so only
+        # sequencers with events due are visited
+        heap = []
+        for order, seq in enumerate(self._sequencers):
+            pos = seq._step(0)
+            if pos is not None:
+                heap.append((pos, order, seq))
+        heapq.heapify(heap)
+        while generated < samples:
+            count = samples - generated
+            if heap:
+                count = min(count, heap[0][0] - generated)
+            # The callback does any actions it needs to do that are currently scheduled, then returns how much delta can advance
+            if self.callback is not None:
+                delta = count / self.samplerate
+                delta = min(self.callback(delta), delta)
+                # Compute actual frame count to render based on return value in seconds (round up to keep making progress in each iteration)
+                count = int(delta * self.samplerate + 0.999)
+            render(generated, count)
+            generated += count
+            while heap and heap[0][0] <= generated < samples:
+                _, order, seq = heapq.heappop(heap)
+                pos = seq._step(generated)
+                if pos is not None:
+                    heapq.heappush(heap, (pos, order, seq))
+        for seq in self._sequencers:
+            seq._end_block(samples)
+        if self.callback is not None or self._sequencers:
+            self._sequencer_blocks += 1
+            self._sequencer_events += self._block_events
+            self._max_block_events = max(self._max_block_events, self._block_events)
+
+    def stats(self) -> dict:
+        """Get statistics about what the synthesizer engine is doing.
+
+        :returns: Dictionary of statistics
+
+        The dictionary has these keys:
+
+        * `active_voices` -- number of voices currently playing
+        * `peak_voices` -- sum over SoundFonts of the highest number of voices
+          playing at once
+        * `stolen_voices` -- voices cut off in their release to start new notes
+        * `dropped_voices` -- voices that could not start because `max_voices`
+          were all busy
+        * `channel_voices` -- dictionary of channel to number of voices
+          currently playing on that channel
+        * `render` -- dictionary of render timing with `blocks`, `frames`,
+          `seconds`, `max_seconds`, and `histogram` (count of blocks by render
+          time, bucket 0 is under 1 microsecond and bucket `i` is from
+          `2**(i-1)` to `2**i` microseconds)
+        * `deadline_misses` -- number of audio callbacks in :meth:`start` that
+          underflowed or took longer to generate than the audio they produced
+        * `sequencer` -- dictionary with `blocks`, `events`, and
+          `max_events_per_block` for events processed by a :class:`Sequencer`
+        * `note_cache` -- dictionary with `hits` and `misses` (notes that
+          could use stored audio and whether it was already stored),
+          `hit_rate`, `evictions`, `samples` (voice samples mixed from stored
+          audio instead of being rendered), `bytes`, `entries`,
+          `fill_samples` and `fill_seconds` (voice samples rendered while
+          being stored and the time that took), and `saved_seconds` (estimated
+          render time saved, `samples` at the measured time per stored sample)
+        * `soundfonts` -- dictionary of SoundFont ID to statistics for that
+          SoundFont, including `load_seconds`, `load_bytes`, `sample_bytes`
+          (size of decoded sample data), and `note_cache`
+        * `render_allocations` -- number of native memory allocations while
+          generating audio, including events sent by sequencers and the
+          callback, which should stay 0 in `realtime` mode
+
+        Statistics are always collected, the overhead is a timer read per
+        rendered block and a few counters.
+
+        See also: :meth:`reset_stats`
+        """
+        soundfonts = {
+            sfid: soundfont.stats() for sfid, soundfont in self.soundfonts.items()
+        }
+        channel_voices = {}
+        for sfstats in soundfonts.values():
+            for chan, count in sfstats["channel_voices"].items():
+                channel_voices[chan] = channel_voices.get(chan, 0) + count
+        note_cache = {
+            key: sum(x["note_cache"][key] for x in soundfonts.values())
+            for key in (
+                "hits",
+                "misses",
+                "evictions",
+                "samples",
+                "bytes",
+                "entries",
+                "fill_samples",
+                "fill_seconds",
+                "saved_seconds",
+            )
+        }
+        lookups = note_cache["hits"] + note_cache["misses"]
+        note_cache["hit_rate"] = note_cache["hits"] / lookups if lookups else 0.0
+        return {
+            "active_voices": sum(x["active_voices"] for x in soundfonts.values()),
+            "peak_voices": sum(x["peak_voices"] for x in soundfonts.values()),
+            "stolen_voices": sum(x["stolen_voices"] for x in soundfonts.values()),
+            "dropped_voices": sum(x["dropped_voices"] for x in soundfonts.values()),
+            "channel_voices": channel_voices,
+            "render": self._mixer.stats(),
+            "deadline_misses": self._deadline_misses,
+            "sequencer": {
+                "blocks": self._sequencer_blocks,
+                "events": self._sequencer_events,
+                "max_events_per_block": self._max_block_events,
+            },
+            "note_cache": note_cache,
+            "soundfonts": soundfonts,
+            "render_allocations": self._render_allocations,
+        }
+
+    def reset_stats(self):
+        """Reset counters and timings reported by :meth:`stats`.
+
+        Load statistics of SoundFonts are kept. Peak voices restart from the
+        number of voices currently playing.
+
+        See also: :meth:`stats`
+        """
+        for soundfont in self.soundfonts.values():
+            soundfont.reset_stats()
+        self._mixer.reset_stats()
+        self._deadline_misses = 0
+        self._sequencer_blocks = 0
+        self._sequencer_events = 0
+        self._max_block_events = 0
+        self._render_allocations = 0
+
+    def _config(self):
+        return (
+            self.samplerate,
+            self.internal_samplerate,
+            self.output_format,
+            self.output_channels,
+            self.layout,
+            self.midi_channels,
+        )
+
+    def snapshot(self) -> SynthState:
+        """Save the complete playback state of the synthesizer.
+
+        :returns: Saved state to pass to :meth:`restore`
+
+        The state includes playing voices with their envelope, LFO, and filter
+        state, all channel parameters, reverb and chorus state, and the
+        position and remaining events of connected sequencers.
+        Sample data of SoundFonts is shared, not copied.
+
+        See also: :meth:`restore`, :meth:`fork`
+        """
+        with self._lock:
+            return SynthState(self)
+
+    def restore(self, state: SynthState):
+        """Return the synthesizer to a state saved with :meth:`snapshot`.
+
+        :param state: State returned by :meth:`snapshot`
+
+        :raises: `SoundFontException` if the state was saved from a
+            synthesizer with different samplerate or output format, or with a
+            different number of connected sequencers
+
+        The same state can be restored any number of times. SoundFonts loaded
+        or unloaded after the snapshot are replaced by the SoundFonts of the
+        saved state. Connected sequencers get their positions and events
+        restored too.
+
+        See also: :meth:`snapshot`
+        """
+        if state._config != self._config():
+            raise SoundFontException("State does not match synthesizer output settings")
+        if len(state.sequencers) != len(self._sequencers):
+            raise SoundFontException("State does not match connected sequencers")
+        soundfonts = {
+            sfid: _clone_soundfont(soundfont)
+            for sfid, soundfont in state.soundfonts.items()
+        }
+        mixer = _tinysoundfont.Mixer(state._mixer)
+        mixer.set_soundfonts(list(soundfonts.values()))
+        with self._lock:
+            self.soundfonts = soundfonts
+            self._mixer = mixer
+            self.channel = dict(state.channel)
+            self.next_sfid = state.next_sfid
+        for seq, seq_state in zip(self._sequencers, state.sequencers):
+            seq._restore(seq_state)
+
+    def fork(self) -> "Synth":
+        """Create an independent copy of the synthesizer in its current state.
+
+        :returns: New synthesizer that continues from the current state
+
+        The copy shares SoundFont sample data with this synthesizer, so forking
+        is cheap even with large SoundFonts. Playing voices, channels, effects,
+        and connected sequencers are copied, and the copy gets its own
+        sequencers at the same positions. Both synthesizers can then
+        generate different variations from the same point. Audio playback
+        started with :meth:`start` is not copied.
+
+        See also: :meth:`snapshot`
+        """
+        state = self.snapshot()
+        forked = copy.copy(self)
+        forked.sink = None
+        forked._lock = threading.RLock()
+        forked._sequencers = []
+        for seq in self._sequencers:
+            # Copy instead of constructing so subclasses keep their attributes,
+            # restore then gives the copy its own events and position
+            forked_seq = copy.copy(seq)
+            forked_seq.synth = forked
+            forked._sequencers.append(forked_seq)
+        forked.restore(state)
+        forked.reset_stats()
+        return forked
 
     def generate(self, samples: int, buffer: Optional[memoryview] = None) -> memoryview:
         """Generate fixed number of output samples.
@@ -402,32 +1319,220 @@ class Synth:
         :param samples: Number of samples to generate
         :param buffer: Existing buffer to fill, or `None` to allocate new buffer
 
-        :returns: View into buffer with samples filled in stereo float32 format.
+        :returns: View into buffer with samples filled in the output format of
+            the synthesizer (stereo float32 by default).
 
         This method fills in a fixed number of output samples in the output
         buffer given (or creates a new buffer if none is given). The sequencer
         callback is called as needed to trigger MIDI events at the correct
         sample location.
+
+        For `"planar"` layout the buffer holds all left samples followed by all
+        right samples, so a buffer given here must be exactly the right size.
         """
-        CHANNELS = 2
-        SIZEOF_FLOAT_IN_BYTES = 4
         if buffer is None:
             # Wrap with `memoryview` so slicing is references inside the buffer, not copies
-            buffer = memoryview(bytearray(samples * CHANNELS * SIZEOF_FLOAT_IN_BYTES))
-        generated = 0
-        while generated < samples:
-            delta = (samples - generated) / self.samplerate
-            # Call all the relevant callbacks, which each may shorten delta
-            # Each callback does any actions it needs to do that are currently scheduled, then returns how much delta can advance
-            if self.callback is not None:
-                delta = min(self.callback(delta), delta)
-            # Compute actual frame count to render based on return value in seconds (round up to keep making progress in each iteration)
-            actual_frame_count = int(delta * self.samplerate + 0.999)
-            # Index into buffer at frame boundaries
-            pos = generated * CHANNELS * SIZEOF_FLOAT_IN_BYTES
-            sz_bytes = actual_frame_count * CHANNELS * SIZEOF_FLOAT_IN_BYTES
-            self.generate_simple(actual_frame_count, buffer=buffer[pos : pos + sz_bytes])
-            generated += actual_frame_count
+            buffer = memoryview(bytearray(samples * self._mixer.frame_size()))
+
+        def render(pos, count):
+            self._mixer.render(buffer, pos, count)
+
+        self._advance(samples, render)
+        return buffer
+
+    def generate_parallel(
+        self,
+        samples: int,
+        workers: Optional[int] = None,
+        segment: float = 30.0,
+        overlap: float = 5.0,
+    ) -> memoryview:
+        """Generate a long stretch of output on several threads.
+
+        :param samples: Number of samples to generate
+        :param workers: Number of threads, or `None` for the number of CPUs
+            (default `None`)
+        :param segment: Length in seconds of the pieces rendered by each
+            thread (default 30.0)
+        :param overlap: Length in seconds of the release and reverb tail
+            rendered past the end of each segment, and of the lead-in that
+            rebuilds notes still playing at its start (default 5.0)
+
+        :returns: View into new buffer with samples filled, like
+            :meth:`generate`
+
+        :raises: `SoundFontException` if the synthesizer uses `"int16"`
+            output, `"planar"` layout, the limiter, resampling, a `callback`,
+            or a looping sequencer
+
+        The output is split into segments that render in parallel on copies
+        of the synthesizer made with :meth:`fork`. Each copy first moves to
+        `overlap` seconds before the start of its segment by sending the
+        program, controller, and pitch bend events of its sequencers without
+        rendering any audio, keeping track of notes that are held. It starts
+        those notes again and renders the lead-in up to the segment start, so
+        notes still held there play on from their own note on when it was
+        inside the lead-in. At the end of the segment held notes stop, as the
+        next segment continues them, and released notes and reverb ring out
+        for at most `overlap` seconds. The pieces are added together into the
+        output.
+
+        The result sounds the same as :meth:`generate` but is not bit
+        identical. Notes held for longer than `overlap` at a segment start
+        restart their sample there, notes in different segments do not steal
+        voices from each other or cut off each other through exclusive
+        classes, and envelopes are updated at slightly different positions.
+        The synthesizer itself does not move forward.
+
+        See also: :meth:`generate`, :meth:`fork`
+        """
+        if self.output_format != "float32":
+            raise SoundFontException("Parallel generation requires float32 output")
+        if self.output_channels == 2 and self.layout == "planar":
+            raise SoundFontException("Parallel generation requires interleaved layout")
+        if self._mixer.limiter_enabled:
+            raise SoundFontException("Parallel generation does not support the limiter")
+        if self.internal_samplerate != self.samplerate:
+            raise SoundFontException("Parallel generation does not support resampling")
+        if self.callback is not None:
+            raise SoundFontException("Parallel generation does not support a callback")
+        if any(seq.loop is not None for seq in self._sequencers):
+            raise SoundFontException("Parallel generation does not support looping sequencers")
+        length = max(1, round(segment * self.samplerate))
+        lead = round(overlap * self.samplerate)
+        bounds = list(range(0, samples, length)) + [samples]
+        output = memoryview(bytearray(samples * self._mixer.frame_size()))
+        if samples == 0:
+            return output
+
+        def render_segment(index):
+            synth = self.fork()
+            start, end = bounds[index], bounds[index + 1]
+            if start > 0:
+                # Move to the lead-in without audio, then start the notes held
+                # there again and render up to the segment start
+                lead_start = max(0, start - lead)
+                for soundfont in synth.soundfonts.values():
+                    soundfont.voices_off()
+                synth._set_note_ons(False)
+                synth._advance(lead_start, lambda pos, count: None)
+                held = synth._held_notes()
+                synth._set_note_ons(True)
+                for channel, key, velocity in held:
+                    synth.noteon(channel, key, velocity)
+                synth.generate(start - lead_start)
+                # Released notes and effects before the start belong to the previous segment
+                for soundfont in synth.soundfonts.values():
+                    soundfont.voices_off(held=False)
+                synth._mixer.clear_effects(start)
+            pieces = [synth.generate(end - start)]
+            if end < samples:
+                # Held notes continue in the next segment, the rest rings out
+                for soundfont in synth.soundfonts.values():
+                    soundfont.voices_off(held=True)
+                synth._set_note_ons(False)
+                tail_end = min(samples, end + lead)
+                while end < tail_end:
+                    count = min(PARALLEL_TAIL_BLOCK, tail_end - end)
+                    piece = synth.generate(count)
+                    pieces.append(piece)
+                    end += count
+                    if synth._active_voices() == 0 and _tinysoundfont._peak(piece) < PARALLEL_SILENCE:
+                        break
+            return b"".join(pieces)
+
+        with concurrent.futures.ThreadPoolExecutor(workers or os.cpu_count() or 1) as pool:
+            for start, piece in zip(bounds, pool.map(render_segment, range(len(bounds) - 1))):
+                _tinysoundfont._accumulate(output, piece, start * self.output_channels)
+        return output
+
+    def _set_note_ons(self, enabled: bool):
+        for seq in self._sequencers:
+            seq._note_ons = enabled
+            if not enabled:
+                seq._held = {}
+
+    def _held_notes(self) -> List[Tuple[int, int, int]]:
+        return [
+            (channel, key, velocity)
+            for seq in self._sequencers
+            for (channel, key), velocity in seq._held.items()
+        ]
+
+    def _active_voices(self) -> int:
+        return sum(soundfont.active_voice_count() for soundfont in self.soundfonts.values())
+
+    def generate_stems(
+        self, samples: int, by: str = "channel", buffer: Optional[memoryview] = None
+    ) -> memoryview:
+        """Generate fixed number of output samples as separate stems.
+
+        :param samples: Number of samples to generate
+        :param by: Either `"channel"` for one stem per MIDI channel or
+            `"soundfont"` for one stem per loaded SoundFont (default
+            `"channel"`)
+        :param buffer: Existing buffer to fill, or `None` to allocate new buffer
+
+        :returns: View into buffer of shape `(stems, samples, channels)` with
+            samples filled in float32 format.
+
+        All stems are rendered in a single pass through the playing voices, so
+        generating stems costs about the same as :meth:`generate`. Adding up
+        all stems gives the same output as :meth:`generate`.
+
+        With `by="channel"` there is one stem per MIDI channel. With
+        `by="soundfont"` stems are ordered by SoundFont ID.
+
+        Stems are always float32 with interleaved samples. The number of
+        samples in each frame follows the `channels` of the synthesizer. Stems
+        are not resampled, so they are not available when `internal_samplerate`
+        differs from `samplerate`.
+
+        As with :meth:`generate`, the sequencer callback is called as needed to
+        trigger MIDI events at the correct sample location.
+
+        See also: :meth:`generate`
+        """
+        CHANNELS = self.output_channels
+        SIZEOF_FLOAT_IN_BYTES = 4
+        if self.internal_samplerate != self.samplerate:
+            raise SoundFontException("Stems require internal_samplerate to match samplerate")
+        if by == "channel":
+            stems = self.midi_channels
+        elif by == "soundfont":
+            stems = len(self.soundfonts)
+        else:
+            raise SoundFontException("Invalid stem type, must be channel or soundfont")
+        if buffer is None:
+            buffer = memoryview(
+                bytearray(stems * samples * CHANNELS * SIZEOF_FLOAT_IN_BYTES)
+            ).cast("f", (stems, samples, CHANNELS))
+
+        def render_channels(pos, count):
+            mix = False
+            for soundfont in self.soundfonts.values():
+                soundfont.render_channels(buffer, pos, count, mix)
+                mix = True
+            if not mix:
+                # No SoundFonts to render, make sure stems are still cleared
+                flat = buffer.cast("B")
+                for stem in range(stems):
+                    start = (stem * samples + pos) * CHANNELS * SIZEOF_FLOAT_IN_BYTES
+                    end = start + count * CHANNELS * SIZEOF_FLOAT_IN_BYTES
+                    flat[start:end] = bytes(end - start)
+
+        def render_soundfonts(pos, count):
+            # Stems are stored one after another, so each SoundFont renders
+            # into a contiguous range of its own stem
+            flat = buffer.cast("B")
+            for stem, sfid in enumerate(sorted(self.soundfonts)):
+                start = (stem * samples + pos) * CHANNELS * SIZEOF_FLOAT_IN_BYTES
+                end = start + count * CHANNELS * SIZEOF_FLOAT_IN_BYTES
+                self.soundfonts[sfid].render(flat[start:end], False)
+
+        self._advance(
+            samples, render_channels if by == "channel" else render_soundfonts
+        )
         return buffer
 
     def generate_simple(self, samples: int, buffer: Optional[memoryview] = None) -> memoryview:
@@ -436,7 +1541,8 @@ class Synth:
         :param samples: Number of samples to generate
         :param buffer: Existing buffer to fill, or `None` to allocate new buffer
 
-        :returns: View into buffer with samples filled in stereo float32 format.
+        :returns: View into buffer with samples filled in the output format of
+            the synthesizer (stereo float32 by default).
 
         This method fills in a fixed number of output samples in the output
         buffer given (or creates a new buffer if none is given). The sequencer
@@ -445,13 +1551,7 @@ class Synth:
 
         See also: :meth:`generate`
         """
-        CHANNELS = 2
-        SIZEOF_FLOAT_IN_BYTES = 4
         if buffer is None:
-            buffer = memoryview(bytearray(samples * CHANNELS * SIZEOF_FLOAT_IN_BYTES))
-        mix = False
-        for soundfont in self.soundfonts.values():
-            soundfont.render(buffer, mix)
-            # After first render turn on mix to mix together all sounds
-            mix = True
+            buffer = memoryview(bytearray(samples * self._mixer.frame_size()))
+        self._mixer.render(buffer, 0, samples)
         return buffer
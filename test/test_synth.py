@@ -1,6 +1,5 @@
 import pytest
 import tinysoundfont
-import time
 
 
 def test_0():
@@ -34,7 +33,8 @@ def test_0():
 
     synth = tinysoundfont.Synth(samplerate=22050, gain=-3.0)
     # Try with buffer size large enough that listener will hear jitter if notes must start/end on buffer boundaries
-    synth.start(buffer_size=4096)
+    sink = tinysoundfont.VirtualSink()
+    synth.start(buffer_size=4096, sink=sink)
 
     sfid = synth.sfload("test/florestan-piano.sf2", gain=-12.0)
     assert sfid == 0
@@ -53,15 +53,15 @@ def test_0():
     synth.noteon(1, 60, 100)
     synth.noteon(1, 64, 100)
     synth.noteon(1, 67, 100)
-    time.sleep(0.5)
+    sink.sleep(0.5)
     # Tune channel 0 up half a semitone
     synth.set_tuning(0, 0.5)
-    time.sleep(0.5)
+    sink.sleep(0.5)
     synth.noteoff(0, 48)
     synth.noteoff(1, 60)
     synth.noteoff(1, 64)
     synth.noteoff(1, 67)
-    time.sleep(1.0)
+    sink.sleep(1.0)
 
     synth.sfunload(sfid)
     synth.sfunload(sfid2)
@@ -79,7 +79,7 @@ def test_0():
                 event.program = 40
     seq = tinysoundfont.Sequencer(synth)
     seq.midi_load("test/1080-c01.mid", filter=filter_program_change)
-    time.sleep(10)
+    sink.sleep(10)
 
     with pytest.raises(Exception):
         synth.sfunload(sfid)
@@ -1,15 +1,46 @@
 
+import concurrent.futures
+import io
+import mmap
+import multiprocessing
 import numpy as np
+import os
+import pathlib
+import pickle
+import pytest
 import pydoc
 import scipy.io.wavfile
+import struct
+import sys
 import tempfile
+import threading
 import time
+import zipfile
 import zlib
 
 import tinysoundfont
 
 PAN_CONTROL = 10
 
+
+# Synth with the piano preset selected on `select` channels, then `controls`
+# of (channel, control, value) sent and `notes` of (channel, key) started
+def piano_synth(notes=(), select=(0,), controls=(), soundfont="test/florestan-piano.sf2", **kwargs):
+    s = tinysoundfont.Synth(**kwargs)
+    sfid = s.sfload(soundfont)
+    for chan in select:
+        s.program_select(chan, sfid, 0, 0)
+    for chan, control, value in controls:
+        s.control_change(chan, control, value)
+    for chan, key in notes:
+        s.noteon(chan, key, 100)
+    return s
+
+
+def render_middle_c(soundfont):
+    return bytes(piano_synth([(0, 60)], soundfont=soundfont).generate(4410))
+
+
 def test_help():
     # Just make sure there is some text for `help(tinysoundfont)`
     helptext = pydoc.render_doc(tinysoundfont, "%s")
@@ -28,6 +59,68 @@ def test_load():
         assert s.sfpreset_name(sfid2, 0, 0) == "Piano"
 
 
+def test_load_sources():
+    path = "test/florestan-piano.sf2"
+    expected = render_middle_c(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    # Buffers are used in place
+    for source in [bytearray(data), memoryview(data), np.frombuffer(data, dtype=np.uint8)]:
+        assert render_middle_c(source) == expected
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        assert render_middle_c(mapped) == expected
+    with pytest.raises(RuntimeError):
+        render_middle_c(np.frombuffer(data, dtype=np.uint8)[::2])
+    # File objects are read in chunks
+    assert render_middle_c(pathlib.Path(path)) == expected
+    with open(path, "rb") as f:
+        assert render_middle_c(f) == expected
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("piano.sf2", data)
+    with zipfile.ZipFile(archive) as z, z.open("piano.sf2") as member:
+        assert render_middle_c(member) == expected
+    with open("test/florestan-subset.sfo", "rb") as f:
+        s = tinysoundfont.Synth()
+        assert s.sfpreset_name(s.sfload(f), 0, 2) == "Piano"
+    with pytest.raises(RuntimeError):
+        render_middle_c(io.BytesIO(data[:1000]))
+
+
+def test_sfreplace():
+    s = tinysoundfont.Synth()
+    sfid = s.sfload("test/florestan-piano.sf2")
+    s.program_select(0, sfid, 0, 0)
+    s.control_change(0, 7, 80)
+    s.noteon(0, 60, 100)
+    s.generate(4410)
+    reference = s.fork()
+    # Background load, then swap while the note is still playing
+    future = s.sfload_async("test/florestan-subset.sfo")
+    new = future.result()
+    s.sfreplace(sfid, new, crossfade=0.1)
+    assert sorted(s.soundfonts) == [sfid]
+    assert s.program_info(0) == (sfid, 0, 2)
+    assert s.soundfonts[sfid].channel_get_volume(0) == reference.soundfonts[sfid].channel_get_volume(0)
+    # The old note fades out from full level, without a jump
+    output = np.frombuffer(s.generate(64), dtype=np.float32)
+    expected = np.frombuffer(reference.generate(64), dtype=np.float32)
+    assert np.abs(output[:8] - expected[:8]).max() < 1e-4
+    # Nothing plays once the crossfade is over
+    s.generate(4410)
+    assert not np.frombuffer(s.generate(64), dtype=np.float32).any()
+    # Replace from a filename with no crossfade
+    s.sfreplace(sfid, "test/florestan-piano.sf2", crossfade=0)
+    assert s.program_info(0) == (sfid, 0, 0)
+    assert not np.frombuffer(s.generate(64), dtype=np.float32).any()
+    with pytest.raises(tinysoundfont.SoundFontException):
+        s.sfreplace(sfid, sfid)
+    with pytest.raises(tinysoundfont.SoundFontException):
+        s.sfreplace(sfid, 99)
+    with pytest.raises(RuntimeError):
+        s.sfload_async("test/missing.sf2").result()
+
+
 def test_bytes():
     s = tinysoundfont.Synth(gain=-14)
     sfid = s.sfload("test/florestan-piano.sf2")
@@ -99,15 +192,17 @@ def test_start():
     s.pitchbend_range(0, 12.0)
     s.pitchbend_range(1, 12.0)
     s.pitchbend_range(2, 12.0)
-    s.start(buffer_size=2048)
+    # Virtual clock generates audio during sink.sleep, no sound device needed
+    sink = tinysoundfont.VirtualSink(keep=True)
+    s.start(buffer_size=2048, sink=sink)
 
-    time.sleep(1.0)
+    sink.sleep(1.0)
 
     s.noteon(0, 48, 100)
     s.noteon(1, 52, 100)
     s.noteon(2, 55, 100)
 
-    time.sleep(1.0)
+    sink.sleep(1.0)
 
     s.pitchbend(0, 0)
     s.pitchbend(1, 8192)
@@ -116,12 +211,820 @@ def test_start():
     s.control_change(1, PAN_CONTROL, 64)
     s.control_change(2, PAN_CONTROL, 127)
 
-    time.sleep(1.0)
+    sink.sleep(1.0)
 
     s.noteoff(0, 48)
     s.noteoff(1, 52)
     s.noteoff(2, 55)
 
-    time.sleep(1.0)
+    sink.sleep(1.0)
+
+    s.stop()
+    assert sink.time == 4.0
+    assert len(sink.data) == 4 * 44100 * 8
+    output = np.frombuffer(bytes(sink.data), dtype=np.float32)
+    # Silence before the notes start, sound after
+    assert not output[: 44100 * 2].any()
+    assert output[44100 * 2 :].any()
+
+
+def test_sinks(tmp_path):
+    # WAV file written by background threads holds the same audio as generate
+    s = piano_synth([(0, 60)], output_format="int16")
+    sink = tinysoundfont.FileSink(tmp_path / "out.wav", bulk_size=4096)
+    s.start(buffer_size=256, sink=sink)
+    while sink.bytes_written < 44100 * 4:
+        time.sleep(0.01)
+    s.stop()
+    samplerate, data = scipy.io.wavfile.read(tmp_path / "out.wav")
+    assert samplerate == 44100
+    assert data.dtype == np.int16
+    assert data.nbytes == sink.bytes_written
+    expected = piano_synth([(0, 60)], output_format="int16").generate(len(data))
+    expected = np.frombuffer(expected, dtype=np.int16).reshape(-1, 2)
+    assert np.array_equal(data, expected)
+
+    # Raw samples into a pipe, with a reader that exits early
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(write_fd, "wb", buffering=0) as pipe, os.fdopen(read_fd, "rb") as reader:
+        s = piano_synth([(0, 60)], output_format="int16")
+        s.start(sink=tinysoundfont.FileSink(pipe, bulk_size=4096))
+        assert reader.read(4096) == bytes(piano_synth([(0, 60)], output_format="int16").generate(1024))
+        reader.close()
+        with pytest.raises(BrokenPipeError):
+            s.stop()
 
+    # Background virtual clock
+    s = piano_synth([(0, 60)], output_format="int16")
+    sink = tinysoundfont.VirtualSink(threaded=True)
+    s.start(buffer_size=512, sink=sink)
+    sink.sleep(0.5)
+    assert sink.time >= 0.5
     s.stop()
+    with pytest.raises(tinysoundfont.SoundFontException):
+        sink.sleep(0.5)
+    with pytest.raises(tinysoundfont.SoundFontException):
+        s.start(sink=sink, output_device_index=0)
+
+    # Errors in the background thread are raised by sleep and stop
+    def callback(delta):
+        raise ValueError("callback failed")
+
+    for wait in [True, False]:
+        s = piano_synth([(0, 60)], output_format="int16")
+        sink = tinysoundfont.VirtualSink(threaded=True)
+        s.callback = callback
+        s.start(sink=sink)
+        if wait:
+            with pytest.raises(ValueError):
+                sink.sleep(10.0)
+        else:
+            time.sleep(0.1)
+        with pytest.raises(ValueError):
+            s.stop()
+    # and by stop for file sinks, without waiting for more output
+    s = piano_synth([(0, 60)], output_format="int16")
+    s.callback = callback
+    s.start(sink=tinysoundfont.FileSink(io.BytesIO(), bulk_size=4096))
+    time.sleep(0.1)
+    with pytest.raises(ValueError):
+        s.stop()
+    planar = tinysoundfont.Synth(layout="planar")
+    with pytest.raises(tinysoundfont.SoundFontException):
+        planar.start(sink=tinysoundfont.FileSink(tmp_path / "planar.wav"))
+
+
+def test_stems():
+    notes = [(0, 48), (3, 55)]
+    controls = [(3, PAN_CONTROL, 0)]
+    mixed = piano_synth(notes, (0, 3), controls, gain=-14).generate(4410)
+    mixed = np.frombuffer(mixed, dtype=np.float32).reshape(-1, 2)
+    stems = np.asarray(piano_synth(notes, (0, 3), controls, gain=-14).generate_stems(4410))
+    assert stems.shape == (16, 4410, 2)
+    # Only channels with notes have output
+    assert np.abs(stems[0]).max() > 0
+    assert np.abs(stems[3]).max() > 0
+    assert np.abs(stems[1]).max() == 0
+    # Channel 3 is panned hard left
+    assert np.abs(stems[3][:, 1]).max() == 0
+    assert np.allclose(stems.sum(axis=0), mixed, atol=1e-6)
+
+    s = piano_synth(notes, (0, 3), controls, gain=-14)
+    sfid2 = s.sfload("test/florestan-piano.sf2")
+    s.program_select(1, sfid2, 0, 0)
+    s.noteon(1, 60, 100)
+    stems = np.asarray(s.generate_stems(4410, by="soundfont"))
+    assert stems.shape == (2, 4410, 2)
+    assert np.abs(stems[0]).max() > 0
+    assert np.abs(stems[1]).max() > 0
+
+
+def test_output_formats():
+    outputs = {
+        name: piano_synth([(0, 48)], controls=[(0, PAN_CONTROL, 20)], gain=-14, **kwargs).generate(4410)
+        for name, kwargs in {
+            "reference": {},
+            "planar": {"layout": "planar"},
+            "int16": {"output_format": "int16"},
+            "int16_planar": {"output_format": "int16", "layout": "planar"},
+            "dithered": {"output_format": "int16", "dither": True},
+            "mono": {"channels": 1},
+        }.items()
+    }
+    reference = np.frombuffer(outputs["reference"], dtype=np.float32).reshape(-1, 2)
+
+    planar = np.frombuffer(outputs["planar"], dtype=np.float32).reshape(2, -1)
+    assert np.array_equal(planar.T, reference)
+
+    int16 = np.frombuffer(outputs["int16"], dtype=np.int16).reshape(-1, 2)
+    assert np.array_equal(int16, (reference * 32767.5).astype(np.int16))
+
+    int16_planar = np.frombuffer(outputs["int16_planar"], dtype=np.int16).reshape(2, -1)
+    assert np.array_equal(int16_planar.T, int16)
+
+    dithered = np.frombuffer(outputs["dithered"], dtype=np.int16).reshape(-1, 2)
+    assert np.abs(dithered.astype(np.int32) - int16).max() <= 2
+
+    mono = np.frombuffer(outputs["mono"], dtype=np.float32)
+    assert mono.shape == (4410,)
+    assert np.abs(mono).max() > 0
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth(output_format="int8")
+
+
+def test_interpolation():
+    outputs = [
+        np.frombuffer(piano_synth([(0, 48), (0, 96)], gain=-14, **kwargs).generate(4410), dtype=np.float32)
+        for kwargs in (
+            {},
+            {"interpolation": "linear"},
+            {"interpolation": "none"},
+            {"interpolation": "cubic"},
+            {"interpolation": "sinc"},
+            {"internal_samplerate": 22050},
+            {"internal_samplerate": 88200},
+            {"samplerate": 48000, "internal_samplerate": 44100},
+        )
+    ]
+    outputs = [output.reshape(-1, 2) for output in outputs]
+    reference = outputs[0]
+    assert np.array_equal(outputs[1], reference)
+    for output in outputs[2:5]:
+        assert not np.array_equal(output, reference)
+        assert np.abs(output - reference).max() < 0.05
+
+    for output in outputs[5:7]:
+        assert output.shape == reference.shape
+        assert np.corrcoef(output[:, 0], reference[:, 0])[0, 1] > 0.99
+
+    assert outputs[7].shape == reference.shape
+    assert np.abs(outputs[7]).max() > 0
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth(interpolation="quadratic")
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth(internal_samplerate=88200).generate_stems(64)
+
+
+def test_fast_math():
+    outputs = []
+    for kwargs in (
+        {},
+        {"fast_math": False},
+        {"fast_math": True},
+        {"interpolation": "sinc"},
+        {"interpolation": "sinc", "fast_math": True},
+    ):
+        s = piano_synth([(0, 48), (0, 96)], gain=-14, **kwargs)
+        s.pitchbend(0, 9000)
+        outputs.append(np.frombuffer(s.generate(4410), dtype=np.float32))
+
+    reference, exact, linear, sinc, sinc_fast = outputs
+    assert np.array_equal(exact, reference)
+    for exact, output in ((reference, linear), (sinc, sinc_fast)):
+        assert not np.array_equal(output, exact)
+        assert np.abs(output - exact).max() < 1e-3
+
+
+def test_effects():
+    results = []
+    for reverb, chorus, sends, channels in (
+        (None, None, True, 2),
+        (False, False, True, 2),
+        (True, True, False, 2),
+        (True, None, True, 2),
+        (None, True, True, 2),
+        (True, True, True, 1),
+    ):
+        s = piano_synth(gain=-14, channels=channels)
+        if reverb is not None:
+            s.set_reverb(reverb)
+        if chorus is not None:
+            s.set_chorus(chorus)
+        if sends:
+            s.control_change(0, 91, 100)
+            s.control_change(0, 93, 100)
+        s.noteon(0, 60, 100)
+        output = np.frombuffer(s.generate(8820), dtype=np.float32)
+        s.noteoff(0, 60)
+        s.sounds_off()
+        s.generate(2205)
+        # Reverb tail keeps going after voices stop
+        tail = np.frombuffer(s.generate(4410), dtype=np.float32)
+        results.append((output, tail))
+
+    (dry, dry_tail), (off, _), (no_sends, _), (wet, wet_tail), (chorus, _), (mono, _) = results
+    assert np.array_equal(off, dry)
+    # Without sends the buses are silent
+    assert np.array_equal(no_sends, dry)
+    assert not np.array_equal(wet, dry)
+    assert np.abs(dry_tail).max() == 0
+    assert np.abs(wet_tail).max() > 0
+    assert not np.array_equal(chorus, dry)
+    assert mono.shape == (8820,)
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth().set_reverb(room_size=2.0)
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth().set_chorus(delay_ms=5.0, depth_ms=10.0)
+
+
+def test_limiter():
+    results = []
+    for limiter, kwargs in ((False, {}), (True, {}), (True, {"output_format": "int16", "channels": 1})):
+        s = piano_synth(gain=12, **kwargs)
+        s.set_meters()
+        if limiter:
+            s.set_limiter(threshold_db=-3.0)
+        for key in (48, 55, 60, 64, 67):
+            s.noteon(0, key, 127)
+        results.append((s.generate(22050), s.meters(), s))
+
+    output, meters, s = results[0]
+    output = np.frombuffer(output, dtype=np.float32).reshape(-1, 2)
+    assert meters["frames"] == 22050
+    assert meters["clipped"] > 0
+    assert meters["gain_reduction_db"] == 0
+    assert meters["peak"] == pytest.approx(np.abs(output).max(axis=0))
+    assert meters["rms"] == pytest.approx(np.sqrt(np.mean(output.astype(np.float64) ** 2, axis=0)))
+    # Levels are since last call, peak hold and clip count since reset
+    assert s.meters()["frames"] == 0
+    assert s.meters()["peak_hold"] == meters["peak_hold"]
+    s.reset_meters()
+    assert s.meters()["clipped"] == 0
+
+    ceiling = 10 ** (-3.0 / 20)
+    output, meters, _ = results[1]
+    assert np.abs(np.frombuffer(output, dtype=np.float32)).max() <= ceiling + 1e-6
+    assert meters["clipped"] > 0
+    assert meters["gain_reduction_db"] > 3
+    output, meters, _ = results[2]
+    assert np.abs(np.frombuffer(output, dtype=np.int16)).max() <= ceiling * 32768
+    assert len(meters["peak"]) == 1
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth().set_limiter(threshold_db=3.0)
+
+
+def test_sample_clock():
+    # Events land exactly on their rounded sample position
+    s = piano_synth()
+    seq = tinysoundfont.Sequencer(s, sample_clock=True)
+    seq.add([tinysoundfont.midi.Event(tinysoundfont.midi.NoteOn(60, 100), t=1 / 3, persistent=False)])
+    output = s.generate(44100)
+    expected = piano_synth()
+    expected.generate(14700)
+    expected.noteon(0, 60, 100)
+    assert output == expected.generate(44100 - 14700, memoryview(bytearray(len(output)))[14700 * 8 :]).obj
+    assert seq.get_time() == 1.0 and seq.frame == 44100
+    assert seq.is_empty()
+
+    # Long sessions in small blocks keep exact positions
+    s = piano_synth()
+    seq = tinysoundfont.Sequencer(s, sample_clock=True)
+    seq.midi_load("test/1080-c01.mid")
+    events = list(seq.events)
+    for _ in range(1000):
+        s.generate(441)
+    assert seq.frame == 441000 and seq.get_time() == 10.0
+    assert s.stats()["sequencer"]["events"] == len([e for e in events if round(e.t * 44100) < 441000])
+    seq.set_time(0.5)
+    assert seq.frame == 22050
+    # Forks continue from the same sample position
+    forked = s.fork()
+    assert forked.generate(4410) == s.generate(4410)
+    assert seq.frame == 22050 + 4410
+
+
+def test_tempo_map():
+    events, tempo_map = tinysoundfont.midi.load_ticks("test/1080-c01.mid")
+    assert tempo_map.division == 120 and len(tempo_map.ticks) > 1
+    assert all(event.tick is not None for event in events)
+    for seconds in (0.0, 1.5, 30.0, 100.0):
+        assert tempo_map.seconds(tempo_map.tick(seconds)) == pytest.approx(seconds)
+    # Same events as loading in milliseconds
+    assert [e.action for e in events] == [e.action for e in tinysoundfont.midi.load("test/1080-c01.mid")]
+
+    for sample_clock in (False, True):
+        s = tinysoundfont.Synth()
+        sfid = s.sfload("test/florestan-piano.sf2")
+        seq = tinysoundfont.Sequencer(s, sample_clock=sample_clock)
+        seq.add(events, tempo_map=tempo_map)
+        s.generate(44100)
+        assert seq.get_time() == pytest.approx(1.0)
+        # Rate changes apply immediately
+        seq.set_rate(2.0)
+        s.generate(44100)
+        # Without sample clock, rounding event times up to whole samples can
+        # leave time slightly behind
+        assert seq.get_time() == pytest.approx(3.0, abs=0 if sample_clock else 1e-3)
+        assert s.stats()["sequencer"]["events"] == len([e for e in events if e.t < 3.0])
+        # Forks continue from the same tick at the same rate
+        forked = s.fork()
+        assert forked.generate(44100) == s.generate(44100)
+        seq.set_time(0.0)
+        assert seq.tick == 0
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        seq.set_rate(0)
+    with pytest.raises(tinysoundfont.SoundFontException):
+        seq.add(tinysoundfont.midi.load("test/1080-c01.mid"))
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Sequencer(tinysoundfont.Synth()).set_rate(2.0)
+
+
+def test_multiple_sequencers():
+    from tinysoundfont.midi import Event, NoteOn, NoteOff
+
+    first = [Event(NoteOn(60, 100), t=0.25), Event(NoteOff(60), t=0.75)]
+    second = [Event(NoteOn(64, 100), t=0.5), Event(NoteOff(64), t=1.0)]
+
+    # Two sequencers give the same output as one with merged events
+    s = piano_synth(select=(0, 1))
+    tinysoundfont.Sequencer(s).add(first)
+    backing = tinysoundfont.Sequencer(s, channel_map={0: 1})
+    backing.add(second)
+    output = s.generate(44100)
+    expected = piano_synth(select=(0, 1))
+    merged = first + [Event(e.action, t=e.t, channel=1) for e in second]
+    tinysoundfont.Sequencer(expected).add(sorted(merged, key=lambda e: e.t))
+    assert output == expected.generate(44100)
+
+    # Each sequencer pauses and loops on its own
+    s = piano_synth(select=(0, 1))
+    loop = tinysoundfont.Sequencer(s, sample_clock=True)
+    loop.add(first)
+    loop.set_loop(0.0, 0.5)
+    paused = tinysoundfont.Sequencer(s)
+    paused.add(second)
+    paused.pause()
+    s.generate(44100 * 19 // 10)
+    assert s.stats()["sequencer"]["events"] == 4
+    assert loop.get_time() == 0.4 and paused.get_time() == 0.0
+    assert not loop.is_empty()
+    # Forks keep looping and pausing
+    forked = s.fork()
+    assert forked.generate(44100) == s.generate(44100)
+    assert loop.get_time() == 0.4
+    # Detached sequencers no longer move
+    paused.detach()
+    paused.pause(False)
+    s.generate(4410)
+    assert paused.get_time() == 0.0
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        loop.set_loop(1.0, 0.5)
+
+
+def test_midi_ports():
+    def track(port, key):
+        data = b"\x00\xff\x21\x01" + bytes([port])
+        data += bytes([0, 0x90, key, 100, 0x60, 0x80, key, 0]) + b"\x00\xff\x2f\x00"
+        return b"MTrk" + struct.pack(">I", len(data)) + data
+
+    data = b"MThd" + struct.pack(">IHHH", 6, 1, 2, 96) + track(0, 60) + track(1, 64)
+    assert {e.channel for e in tinysoundfont.midi.load_memory(data)} == {0}
+    events = tinysoundfont.midi.load_memory(data, ports=True)
+    assert {(e.channel, e.action.key) for e in events} == {(0, 60), (16, 64)}
+    events, _ = tinysoundfont.midi.load_memory_ticks(data, ports=True)
+    assert {e.channel for e in events} == {0, 16}
+
+    # Channels of all ports share one SoundFont and voice pool
+    s = tinysoundfont.Synth(midi_channels=32)
+    sfid = s.sfload("test/florestan-piano.sf2")
+    for chan in range(32):
+        s.program_select(chan, sfid, 0, 0)
+    tinysoundfont.Sequencer(s).add(tinysoundfont.midi.load_memory(data, ports=True))
+    seq = tinysoundfont.Sequencer(s, port=1)
+    seq.add([tinysoundfont.midi.Event(tinysoundfont.midi.NoteOn(67, 100), channel=1)])
+    s.generate(4410)
+    assert s.stats()["channel_voices"] == {0: 1, 16: 1, 17: 1}
+    assert len(s.soundfonts) == 1
+    stems = np.frombuffer(s.generate_stems(4410), dtype=np.float32).reshape(32, 4410, 2)
+    assert np.abs(stems[16]).max() > 0 and np.abs(stems[17]).max() > 0 and np.abs(stems[1]).max() == 0
+    s.sounds_off()
+    s.generate(4410)
+    assert s.stats()["active_voices"] == 0
+
+    # A channel on a later port plays exactly like the same channel on the first port
+    expected = tinysoundfont.Synth()
+    expected.program_select(0, expected.sfload("test/florestan-piano.sf2"), 0, 0)
+    expected.noteon(0, 60, 100)
+    s = tinysoundfont.Synth(midi_channels=64)
+    s.program_select(48, s.sfload("test/florestan-piano.sf2"), 0, 0)
+    s.noteon(48, 60, 100)
+    assert s.generate(4410) == expected.generate(4410)
+
+    assert not s.noteon(64, 60, 100)
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth(midi_channels=0)
+
+
+def test_analyze(tmp_path):
+    # Bank select and program change on channel 0, chord of 3 notes and a drum hit on channel 9
+    data = bytes([0, 0xB0, 0, 1, 0, 0xC0, 5, 0, 0x99, 36, 100])
+    for key in (60, 64, 67):
+        data += bytes([0, 0x90, key, 100])
+    data += bytes([0x60, 0x90, 60, 0, 0, 0x80, 64, 0, 0, 0x80, 67, 0, 0, 0x89, 36, 0])
+    data += b"\x00\xff\x2f\x00"
+    song = tmp_path / "song.mid"
+    song.write_bytes(b"MThd" + struct.pack(">IHHH", 6, 0, 1, 96) + b"MTrk" + struct.pack(">I", len(data)) + data)
+    bad = tmp_path / "bad.mid"
+    bad.write_bytes(b"not a MIDI file")
+
+    summaries = tinysoundfont.midi.analyze([song, "test/1080-c01.mid", bad, tmp_path / "missing.mid"], workers=2)
+    assert [s.path for s in summaries] == [str(song), "test/1080-c01.mid", str(bad), str(tmp_path / "missing.mid")]
+    summary = summaries[0]
+    assert summary.error is None
+    assert summary.notes == 4
+    assert summary.peak_notes == 4
+    assert summary.channels == [0, 9]
+    assert summary.programs == [(0, 0, True), (1, 5, False)]
+    assert summary.duration == pytest.approx(0.5)
+    assert summary.peak_voices is None
+    assert summaries[2].error is not None and summaries[3].error is not None
+
+    # Matches a sweep over the loaded events
+    events = tinysoundfont.midi.load("test/1080-c01.mid")
+    summary = summaries[1]
+    assert summary.notes == sum(isinstance(e.action, tinysoundfont.midi.NoteOn) and e.action.velocity > 0 for e in events)
+    assert summary.channels == sorted({e.channel for e in events if isinstance(e.action, tinysoundfont.midi.NoteOn)})
+    assert summary.duration == pytest.approx(events[-1].t)
+    assert summary.tempo_changes > 0
+
+    # Voices depend on region layering of the SoundFont, each piano note is one region
+    s = tinysoundfont.Synth()
+    sfid = s.sfload("test/florestan-piano.sf2")
+    summary = tinysoundfont.midi.analyze([song], synth=s, sfid=sfid)[0]
+    assert summary.peak_voices == 4
+    assert tinysoundfont.midi.analyze([song], workers=1, synth=s)[0] == summary
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.midi.analyze([song], synth=s, sfid=sfid + 1)
+
+
+def test_realtime():
+    def play(synth, sfid):
+        synth.program_select(0, sfid, 0, 0)
+        events = [tinysoundfont.midi.Event(tinysoundfont.midi.ProgramChange(0), t=0.01, channel=15)]
+        events += [tinysoundfont.midi.Event(tinysoundfont.midi.NoteOn(48 + chan, 100), t=0.02, channel=chan) for chan in range(16)]
+        tinysoundfont.Sequencer(synth).add(events)
+        return bytes(synth.generate(44100))
+
+    # Voices and channels growing while playing are counted
+    s = tinysoundfont.Synth()
+    play(s, s.sfload("test/florestan-piano.sf2", max_voices=0))
+    assert s.stats()["render_allocations"] > 0
+
+    s = tinysoundfont.Synth(realtime=True)
+    sfid = s.sfload("test/florestan-piano.sf2")
+    warmed = s.warm()
+    assert warmed["bytes"] > 0 and warmed["locked_bytes"] == 0
+    assert s.warm([(0, 0)], sfid=sfid)["bytes"] == warmed["bytes"]
+    output = play(s, sfid)
+    assert s.stats()["active_voices"] == 16
+    assert s.stats()["render_allocations"] == 0
+
+    # Same output as without realtime mode
+    expected = tinysoundfont.Synth()
+    assert play(expected, expected.sfload("test/florestan-piano.sf2")) == output
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        s.warm([(5, 5)])
+    with pytest.raises(tinysoundfont.SoundFontException):
+        s.sfload("test/florestan-piano.sf2", max_voices=0)
+    with pytest.raises(tinysoundfont.SoundFontException):
+        s.sfload("test/florestan-piano.sf2", note_cache=1 << 20)
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth(realtime=True, note_cache=1 << 20)
+
+
+def test_shared_soundfont():
+    s = tinysoundfont.Synth()
+    sfid = s.sfload("test/florestan-piano.sf2")
+    expected = render_middle_c("test/florestan-piano.sf2")
+    shared = s.sfshare(sfid)
+    try:
+        # Only the name of the shared memory is pickled
+        assert len(pickle.dumps(shared)) < 200
+        assert render_middle_c(pickle.loads(pickle.dumps(shared))) == expected
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+            assert executor.submit(render_middle_c, shared).result() == expected
+
+        # SoundFonts loaded from shared memory keep it mapped while in use
+        s2 = tinysoundfont.Synth()
+        s2.sfload(shared)
+        with pytest.raises(tinysoundfont.SoundFontException):
+            shared.close()
+        assert s2.sfpresets(0) == s.sfpresets(sfid)
+        assert s2.fork().sfpresets(0) == s.sfpresets(sfid)
+        del s2
+        shared.close()
+    finally:
+        shared.unlink()
+
+    # Native SoundFonts pickle their parsed data
+    soundfont = pickle.loads(pickle.dumps(s.soundfonts[sfid]))
+    assert soundfont.presets() == s.sfpresets(sfid)
+    with pytest.raises(RuntimeError):
+        tinysoundfont._tinysoundfont.SoundFont.attach(b"\0" * 64)
+
+
+def test_threads():
+    def render(results, index):
+        results[index] = render_middle_c("test/florestan-piano.sf2")
+
+    # Independent synthesizers on parallel threads give the same output
+    results = [None] * 4
+    workers = [threading.Thread(target=render, args=(results, i)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert results == [render_middle_c("test/florestan-piano.sf2")] * 4
+
+    # One synthesizer rendering while other threads change it
+    s = tinysoundfont.Synth(gain=-20)
+    sfid = s.sfload("test/florestan-piano.sf2")
+    stop = threading.Event()
+    errors = []
+
+    def events(index):
+        try:
+            n = 0
+            while not stop.is_set():
+                chan = (index + n) % 16
+                s.program_select(chan, sfid, 0, 0)
+                s.noteon(chan, 36 + n % 60, 100)
+                s.control_change(chan, PAN_CONTROL, n % 128)
+                s.noteoff(chan, 36 + n % 60)
+                s.stats()
+                n += 1
+        except Exception as err:
+            errors.append(err)
+
+    def routing():
+        try:
+            while not stop.is_set():
+                # Channels appear and disappear while warm() iterates over them
+                for chan in range(16, 32):
+                    s.program_select(chan, sfid, 0, 0)
+                for chan in range(16, 32):
+                    s.program_unset(chan)
+        except Exception as err:
+            errors.append(err)
+
+    workers = [threading.Thread(target=events, args=(i,)) for i in range(3)]
+    workers.append(threading.Thread(target=routing))
+    # Switch threads often so races show up with the GIL too
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    for worker in workers:
+        worker.start()
+    try:
+        for n in range(2000):
+            if n % 40 == 0:
+                s.generate(512)
+            s.warm()
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+        sys.setswitchinterval(interval)
+    assert errors == []
+
+
+def test_generate_parallel():
+    from tinysoundfont.midi import Event, NoteOn, NoteOff
+
+    synths = []
+    for kwargs in ({}, {}, {}, {"output_format": "int16"}):
+        synth = piano_synth(select=range(16), controls=[(0, 91, 60)], gain=-6, **kwargs)
+        synth.set_reverb()
+        tinysoundfont.Sequencer(synth, sample_clock=True).midi_load("test/1080-c01.mid")
+        synths.append(synth)
+
+    samples = 44100 * 8
+    reference = np.frombuffer(synths[0].generate(samples), dtype=np.float32)
+    # A single segment renders exactly like generate
+    single = synths[1].generate_parallel(samples, workers=2, segment=60.0)
+    assert np.array_equal(np.frombuffer(single, dtype=np.float32), reference)
+    # Segments with notes and reverb overlapping their boundaries add up to
+    # nearly the same audio
+    output = np.frombuffer(synths[2].generate_parallel(samples, workers=3, segment=1.5), dtype=np.float32)
+    assert len(output) == len(reference)
+    error = np.sqrt(np.mean((output - reference) ** 2) / np.mean(reference**2))
+    assert 0 < error < 0.01
+    # The synthesizer itself does not move
+    assert np.array_equal(np.frombuffer(synths[2].generate(samples), dtype=np.float32), reference)
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        synths[3].generate_parallel(samples)
+    synths[0].set_limiter()
+    with pytest.raises(tinysoundfont.SoundFontException):
+        synths[0].generate_parallel(samples)
+
+    # Notes held across a boundary are rebuilt from their note on in the
+    # lead-in of the next segment, and stop in the previous one
+    outputs = []
+    for parallel in (False, True):
+        synth = piano_synth()
+        seq = tinysoundfont.Sequencer(synth, sample_clock=True)
+        seq.add([Event(NoteOn(48, 100), t=0.25), Event(NoteOff(48), t=2.5)])
+        if parallel:
+            outputs.append(synth.generate_parallel(44100 * 4, segment=1.0, overlap=3.0))
+        else:
+            outputs.append(synth.generate(44100 * 4))
+    reference, output = (np.frombuffer(x, dtype=np.float32) for x in outputs)
+    error = np.sqrt(np.mean((output - reference) ** 2) / np.mean(reference**2))
+    assert error < 0.01
+
+
+class LabeledSequencer(tinysoundfont.Sequencer):
+    # Subclass with a different constructor
+    def __init__(self, synth, label):
+        super().__init__(synth)
+        self.label = label
+
+
+def test_snapshot():
+    synth = tinysoundfont.Synth(samplerate=48000, internal_samplerate=44100)
+    sfid = synth.sfload("test/florestan-piano.sf2")
+    synth.set_reverb()
+    seq = LabeledSequencer(synth, "song")
+    seq.midi_load("test/1080-c01.mid")
+    synth.control_change(0, 91, 80)
+    synth.generate(24000)
+    state = synth.snapshot()
+    forked = synth.fork()
+    first = np.frombuffer(synth.generate(24000), dtype=np.float32)
+    assert np.abs(first).max() > 0
+    # Fork continues independently from the same point
+    assert np.array_equal(np.frombuffer(forked.generate(24000), dtype=np.float32), first)
+    # Restoring twice replays the same audio, including sequencer events
+    for _ in range(2):
+        synth.restore(state)
+        assert np.array_equal(np.frombuffer(synth.generate(24000), dtype=np.float32), first)
+
+    # Variations diverge from the shared prefix
+    forked = synth.fork()
+    forked.noteon(0, 60, 100)
+    assert not np.array_equal(forked.generate(4800), synth.generate(4800))
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.Synth().restore(state)
+    # Sequencers connected after the snapshot do not match it
+    tinysoundfont.Sequencer(synth)
+    with pytest.raises(tinysoundfont.SoundFontException):
+        synth.restore(state)
+
+
+def test_note_cache():
+    # Piano without loops and pitch/filter modulation, so all notes are one-shots
+    with open("test/florestan-piano.sf2", "rb") as f:
+        data = bytearray(f.read())
+    for chunk in (b"pgen", b"igen"):
+        pos = data.find(chunk)
+        size = struct.unpack_from("<I", data, pos + 4)[0]
+        for offset in range(pos + 8, pos + 8 + size, 4):
+            if struct.unpack_from("<H", data, offset)[0] in (5, 6, 7, 10, 11, 54):
+                struct.pack_into("<H", data, offset + 2, 0)
+    soundfont = bytes(data)
+
+    results = []
+    for kwargs in ({}, {"interpolation": "sinc"}, {"fast_math": True}, {}):
+        for note_cache in (0, 1 << 24 if len(results) < 6 else 100000):
+            s = piano_synth(soundfont=soundfont, note_cache=note_cache, **kwargs)
+            for velocity in (100, 60, 100, 80):
+                s.noteon(0, 60, velocity)
+                s.noteon(0, 67, velocity)
+                s.generate(1000)
+            # Bending pitch switches playing notes back to normal rendering
+            s.pitchbend(0, 9000)
+            s.noteon(0, 60, 100)
+            results.append((np.frombuffer(s.generate(4410), dtype=np.float32), s.stats()["note_cache"]))
+
+    for index in range(0, 6, 2):
+        (reference, stats), (output, cached) = results[index : index + 2]
+        assert stats["hits"] == 0 and stats["bytes"] == 0
+        stats = cached
+        assert np.array_equal(output, reference)
+        assert stats["misses"] == 2
+        assert stats["hits"] == 6
+        assert stats["samples"] > 0
+        # Stored samples were rendered once while the first notes played
+        assert 0 < stats["fill_samples"] < stats["samples"]
+        assert stats["saved_seconds"] > 0
+    # Forks keep playing notes that read stored audio still being filled
+    s = piano_synth([(0, 60)], soundfont=soundfont, note_cache=1 << 24)
+    s.generate(1000)
+    s.noteon(0, 60, 80)
+    s.generate(1000)
+    forked = s.fork()
+    assert forked.generate(4410) == s.generate(4410)
+    # Forks do not share stored audio, so they render on threads while the source plays on
+    s.noteon(0, 60, 90)
+    s.generate(1000)
+    forks = [s.fork() for _ in range(4)]
+    expected = bytes(s.fork().generate(44100))
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        outputs = list(pool.map(lambda synth: bytes(synth.generate(44100)), forks))
+        s.noteon(0, 67, 100)
+        s.generate(44100)
+    assert outputs == [expected] * 4
+    # Tiny budget keeps evicting
+    (reference, _), (output, stats) = results[6:]
+    assert np.array_equal(output, reference)
+    assert stats["evictions"] > 0
+    assert stats["bytes"] <= 100000
+
+
+def test_stats():
+    s = tinysoundfont.Synth(gain=-14)
+    sfid = s.sfload("test/florestan-piano.sf2", max_voices=4)
+    s.program_select(0, sfid, 0, 0)
+    for key in range(40, 46):
+        s.noteon(0, key, 100)
+    s.generate(4410)
+    stats = s.stats()
+    assert stats["active_voices"] == 4
+    assert stats["peak_voices"] == 4
+    assert stats["dropped_voices"] > 0
+    assert stats["channel_voices"] == {0: 4}
+    assert stats["render"]["frames"] == 4410
+    assert sum(stats["render"]["histogram"]) == stats["render"]["blocks"]
+    assert stats["soundfonts"][sfid]["load_bytes"] == 187548
+    assert stats["soundfonts"][sfid]["load_seconds"] > 0
+
+    # New notes while old ones are releasing steal voices
+    s.notes_off()
+    s.generate(64)
+    s.noteon(0, 60, 100)
+    assert s.stats()["stolen_voices"] > 0
+
+    seq = tinysoundfont.Sequencer(s)
+    seq.midi_load("test/1080-c01.mid")
+    s.reset_stats()
+    s.generate(44100)
+    stats = s.stats()
+    assert stats["render"]["frames"] == 44100
+    assert stats["sequencer"]["blocks"] == 1
+    assert stats["sequencer"]["events"] >= stats["sequencer"]["max_events_per_block"] > 0
+
+
+def test_presets():
+    s = tinysoundfont.Synth()
+    sfid = s.sfload("test/florestan-subset.sfo")
+    presets = s.sfpresets(sfid)
+    assert len(presets) == 17
+    for preset in presets:
+        assert s.sfpreset_name(sfid, preset["bank"], preset["preset"]) == preset["name"]
+        assert preset["regions"] > 0
+        assert preset["sample_bytes"] > 0
+    piano = [p for p in presets if p["name"] == "Piano"][0]
+    assert piano["bank"] == 0 and piano["preset"] == 2
+
+
+def test_subset():
+    data = tinysoundfont.subset("test/florestan-piano.sf2", midi_files=["test/1080-c01.mid"])
+    assert data[:4] == b"RIFF"
+    notes = [(0, 48), (0, 84)]
+    assert bytes(piano_synth(notes, soundfont=data, gain=-14).generate(4410)) == bytes(
+        piano_synth(notes, gain=-14).generate(4410)
+    )
+    # Subsetting again keeps the same font
+    assert tinysoundfont.subset(data, presets=[(0, 0)]) == data
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename = f"{tmpdirname}/subset.sf2"
+        tinysoundfont.subset("test/florestan-piano.sf2", presets=[(0, 0)], output=filename)
+        with open(filename, "rb") as f:
+            assert f.read() == data
+
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.subset("test/florestan-piano.sf2", presets=[(0, 5)])
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.subset("test/florestan-piano.sf2")
+    with pytest.raises(tinysoundfont.SoundFontException):
+        tinysoundfont.subset("test/florestan-subset.sfo", presets=[(0, 2)])